@@ -1,6 +1,8 @@
-import re, tldextract, requests
+import re
 from html import unescape
 
+import domains
+
 CATEGORIES = [
     "Advertising",
     "AI Chatbots & Tools",
@@ -55,6 +57,7 @@ KEYWORDS = {
 
 def _fetch_html(url: str, timeout=3):
     try:
+        import requests
         r = requests.get(url, timeout=timeout, headers={"User-Agent":"Mozilla/5.0"})
         if r.ok and "text" in r.headers.get("Content-Type",""):
             return r.text
@@ -71,18 +74,19 @@ def _textify(html: str):
     txt = re.sub(r"\s+", " ", txt).strip().lower()
     return txt
 
-def classify(url: str, html: str = None):
+def classify(url: str, html: str = None, fetch: bool = True):
     """
     Returns dict: {category: str, confidence: float}
+
+    With fetch=False and no html, only the URL is scored (no network).
     """
     if not (url or "").startswith(("http://","https://")):
         url = "https://" + (url or "")
-    ext = tldextract.extract(url)
-    domain = ".".join([p for p in [ext.domain, ext.suffix] if p])
-    host = ".".join([p for p in [ext.subdomain, ext.domain, ext.suffix] if p if p])
+    host = domains.host_of(url)
+    domain = domains.registered_domain(host)
 
     tokens = [url.lower(), host.lower(), domain.lower()]
-    body = _textify(html) if html else _textify(_fetch_html(url))
+    body = _textify(html) if html else (_textify(_fetch_html(url)) if fetch else "")
     if body:
         tokens.append(body)
 
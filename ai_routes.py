@@ -1,16 +1,24 @@
 from flask import Blueprint, request, jsonify
 import sqlite3, os, json, time
 from ai_classifier import classify, CATEGORIES
-
-ROOT = os.path.dirname(__file__)
-DB_PATH = os.path.join(ROOT, "gschool.db")
+import chat_store
+import metrics
+import rollups
+import schedules
+import tenancy
 
 ai = Blueprint("ai", __name__, url_prefix="/api/ai")
 
 def _db():
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(tenancy.path("gschool.db"))
+
+# Tenants whose schema has been checked in this process
+_schema_ready = set()
 
 def ensure_schema():
+    if tenancy.current() in _schema_ready:
+        return
+    chat_store.ensure_schema()
     with _db() as conn:
         cur = conn.cursor()
         # Tables
@@ -27,14 +35,6 @@ def ensure_schema():
             k TEXT PRIMARY KEY,
             v TEXT
         )""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS chat_messages(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room TEXT,
-            user_id TEXT,
-            role TEXT,
-            text TEXT,
-            ts INTEGER
-        )""")
         conn.commit()
 
         # Seed categories if any missing
@@ -44,62 +44,13 @@ def ensure_schema():
             if c not in existing:
                 cur.execute("INSERT OR IGNORE INTO categories(name, blocked, block_url) VALUES(?,?,?)", (c, 0, None))
         conn.commit()
+    _schema_ready.add(tenancy.current())
 
 
 def _is_schedule_active(sched, now_ts=None):
-    """
-    Simple helper to decide if a schedule is currently "active".
-    Sched format:
-      {
-        "enabled": bool,
-        "start": "HH:MM",   # optional, default "00:00"
-        "end": "HH:MM",     # optional, default "23:59"
-        "weekdays_only": bool
-      }
-    """
-    if not isinstance(sched, dict):
-        return False
-    if not sched.get("enabled"):
-        return False
-
-    if now_ts is None:
-        now_ts = time.time()
-    lt = time.localtime(now_ts)
-
-    # Optional weekday restriction (Mon=0 .. Sun=6)
-    if sched.get("weekdays_only") and lt.tm_wday >= 5:
-        return False
-
-    def _parse_hhmm(val, default_h, default_m):
-        if not val:
-            return default_h, default_m
-        try:
-            parts = str(val).split(":", 1)
-            h = int(parts[0])
-            m = int(parts[1]) if len(parts) > 1 else 0
-            h = max(0, min(23, h))
-            m = max(0, min(59, m))
-            return h, m
-        except Exception:
-            return default_h, default_m
-
-    sh, sm = _parse_hhmm(sched.get("start"), 0, 0)
-    eh, em = _parse_hhmm(sched.get("end"), 23, 59)
-
-    cur_minutes = lt.tm_hour * 60 + lt.tm_min
-    start_minutes = sh * 60 + sm
-    end_minutes = eh * 60 + em
+    """True while a category schedule's window is open (see schedules.py)."""
+    return schedules.category_active(sched, now_ts)
 
-    if start_minutes == end_minutes:
-        # Degenerate case: treat as always off
-        return False
-
-    if start_minutes < end_minutes:
-        # Normal same-day window
-        return start_minutes <= cur_minutes < end_minutes
-    else:
-        # Window wraps past midnight (e.g. 22:00–06:00)
-        return not (end_minutes <= cur_minutes < start_minutes)
 
 def get_setting(key, default=None):
     with _db() as conn:
@@ -220,7 +171,9 @@ def api_classify():
     body = request.json or {}
     url = body.get("url") or ""
     html = body.get("html")
-    result = classify(url, html)
+    with metrics.timed("gschool_classifier_seconds", "Time spent in the URL category classifier"):
+        result = classify(url, html)
+    rollups.record_verdict(result.get("domain"), result.get("category"), "page" if html else "url")
 
     return jsonify(
         {
@@ -234,7 +187,6 @@ def api_classify():
 
 @ai.route("/chat/send", methods=["POST"])
 def chat_send():
-    ensure_schema()
     b = request.json or {}
     room = b.get("room") or "*"
     user_id = b.get("user_id") or "unknown"
@@ -242,22 +194,38 @@ def chat_send():
     text = (b.get("text") or "").strip()[:1000]
     if not text:
         return jsonify({"ok": False, "error": "empty"}), 400
-    ts = int(time.time() * 1000)
-    with _db() as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO chat_messages(room,user_id,role,text,ts) VALUES(?,?,?,?,?)",
-                    (room, user_id, role, text, ts))
-        conn.commit()
-    return jsonify({"ok": True, "ts": ts})
+    msg = chat_store.add_message(room, user_id, role, text)
+    return jsonify({"ok": True, "id": msg["id"], "ts": msg["ts"]})
 
 @ai.route("/chat/poll", methods=["GET"])
 def chat_poll():
-    ensure_schema()
+    """
+    Query params:
+      room:  chat room (default "*")
+      after: message id cursor – return messages with a larger id
+      since: legacy millisecond timestamp cursor (used only when `after` is absent)
+      wait:  long-poll up to this many seconds (max 25) for a new message
+    Response carries `cursor`, the id to pass as `after` next time.
+    """
     room = request.args.get("room", "*")
-    since = int(request.args.get("since", "0") or 0)
-    with _db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, role, text, ts FROM chat_messages WHERE room=? AND ts>? ORDER BY ts ASC",
-                    (room, since))
-        rows = [{"user_id": u, "role": r, "text": t, "ts": ts} for (u, r, t, ts) in cur.fetchall()]
-    return jsonify({"ok": True, "messages": rows})
+    after = request.args.get("after")
+    try:
+        wait = max(0.0, min(float(request.args.get("wait", 0) or 0), 25.0))
+    except Exception:
+        wait = 0.0
+
+    if after is None and request.args.get("since"):
+        since = int(request.args.get("since", "0") or 0)
+        msgs = chat_store.messages_since_ts(room, since)
+        after_id = msgs[-1]["id"] if msgs else 0
+        if not msgs and wait:
+            latest = chat_store.latest_messages(room, 1)
+            after_id = latest[-1]["id"] if latest else 0
+            msgs = chat_store.wait_for_messages(room, after_id, wait)
+    else:
+        after_id = int(after or 0)
+        msgs = chat_store.wait_for_messages(room, after_id, wait) if wait else chat_store.messages_after(room, after_id)
+
+    rows = [{"id": m["id"], "user_id": m["user_id"], "role": m["role"], "text": m["text"], "ts": m["ts"]} for m in msgs]
+    cursor = rows[-1]["id"] if rows else after_id
+    return jsonify({"ok": True, "messages": rows, "cursor": cursor})
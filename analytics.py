@@ -0,0 +1,320 @@
+"""
+Vectorised time-on-site analytics over the browsing timeline.
+
+Dwell intervals are held as columnar NumPy arrays - student id, domain id,
+start, end - plus the student and domain vocabularies. A window query clips
+every interval to [since, until) in one pass and aggregates with bincount,
+so a whole school week (hundreds of thousands of intervals) sums up in
+milliseconds.
+
+The per-tenant columns (Store) are filled from timeline_intervals, which
+only grows: each load appends the rows stored since the previous one, and
+the few intervals still open in data.json are added on top of a copy. Which
+intervals are still open is judged against the latest start the store holds
+per student, so rows another worker rolled up are never counted twice. The
+store is only rebuilt when rows were pruned from the table.
+
+Domains are mapped to categories by the admin category URL lists first,
+then by recorded classifier verdicts (rollups.verdicts()) when given, then
+by the URL-only keyword classifier (no page fetch), cached per domain. A
+store keeps its domains' categories until the categories or the verdicts
+change.
+
+Interface:
+    Intervals.from_history(history) -> Intervals
+    load(rows_after, first_rowid, unrolled=None) -> Intervals   # per-tenant Store, appended incrementally
+    usage(iv, since, until, students=None, categories=None, top=50, known=None, known_rev=None) -> dict
+    category_map(domain_names, admin_categories=None, known=None) -> list[str]
+    classify_domain(domain) -> str
+"""
+
+import json
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+import ai_classifier
+import tenancy
+
+
+class Intervals:
+    """Columnar view of history: parallel arrays, one row per dwell interval."""
+
+    __slots__ = ("students", "domains", "student_idx", "domain_idx", "start", "end", "store")
+
+    def __init__(self, students, domains, student_idx, domain_idx, start, end, store=None):
+        self.students = students
+        self.domains = domains
+        self.student_idx = student_idx
+        self.domain_idx = domain_idx
+        self.start = start
+        self.end = end
+        self.store = store
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_history(cls, history):
+        students, domains = [], []
+        dom_ids = {}
+        s_idx, d_idx, start, end = [], [], [], []
+        for sid, (student, arr) in enumerate(sorted((history or {}).items())):
+            students.append(student)
+            for e in arr or ():
+                dom = e.get("domain") or ""
+                did = dom_ids.get(dom)
+                if did is None:
+                    did = dom_ids[dom] = len(domains)
+                    domains.append(dom)
+                ts = int(e.get("ts") or 0)
+                s_idx.append(sid)
+                d_idx.append(did)
+                start.append(ts)
+                end.append(max(ts, int(e.get("end") or ts)))
+        return cls(students, domains,
+                   np.asarray(s_idx, dtype=np.int32), np.asarray(d_idx, dtype=np.int32),
+                   np.asarray(start, dtype=np.int64), np.asarray(end, dtype=np.int64))
+
+
+_load_lock = threading.Lock()
+
+
+class Store:
+    """Growable columns of the closed intervals in timeline_intervals, for one tenant."""
+
+    def __init__(self, first_rowid=None):
+        self.lock = threading.Lock()
+        self.first_rowid = first_rowid
+        self.last_rowid = 0
+        self.marks = {}
+        self.students, self.student_ids = [], {}
+        self.domains, self.domain_ids = [], {}
+        self.n = 0
+        self.student_idx = np.zeros(0, dtype=np.int32)
+        self.domain_idx = np.zeros(0, dtype=np.int32)
+        self.start = np.zeros(0, dtype=np.int64)
+        self.end = np.zeros(0, dtype=np.int64)
+        self.cat_key = None
+        self.cat_names = []
+
+    def _ids(self, rows):
+        """(student ids, domain ids, starts, ends) for (student, domain, ts, end) rows, growing the vocabularies."""
+        s_idx, d_idx, start, end = [], [], [], []
+        for student, dom, ts, stop in rows:
+            sid = self.student_ids.get(student)
+            if sid is None:
+                sid = self.student_ids[student] = len(self.students)
+                self.students.append(student)
+            dom = dom or ""
+            did = self.domain_ids.get(dom)
+            if did is None:
+                did = self.domain_ids[dom] = len(self.domains)
+                self.domains.append(dom)
+            ts = int(ts or 0)
+            s_idx.append(sid)
+            d_idx.append(did)
+            start.append(ts)
+            end.append(max(ts, int(stop or ts)))
+        return (np.asarray(s_idx, dtype=np.int32), np.asarray(d_idx, dtype=np.int32),
+                np.asarray(start, dtype=np.int64), np.asarray(end, dtype=np.int64))
+
+    def append(self, rows):
+        """Add (rowid, student, domain, ts, end) rows, in rowid order."""
+        rows = list(rows)
+        if not rows:
+            return
+        self.last_rowid = rows[-1][0]
+        marks = self.marks
+        for _, student, _, ts, _ in rows:
+            if ts > marks.get(student, ts - 1):
+                marks[student] = ts
+        cols = self._ids(r[1:] for r in rows)
+        need = self.n + len(rows)
+        if need > len(self.start):
+            cap = max(need, 2 * len(self.start), 1024)
+            for name in ("student_idx", "domain_idx", "start", "end"):
+                old = getattr(self, name)
+                grown = np.zeros(cap, dtype=old.dtype)
+                grown[:self.n] = old[:self.n]
+                setattr(self, name, grown)
+        for name, col in zip(("student_idx", "domain_idx", "start", "end"), cols):
+            getattr(self, name)[self.n:need] = col
+        self.n = need
+
+    def view(self, pending=()):
+        """Intervals over the stored rows plus `pending` [(student, interval)] (copied, never stored)."""
+        n = self.n
+        cols = [self.student_idx[:n], self.domain_idx[:n], self.start[:n], self.end[:n]]
+        if pending:
+            extra = self._ids((who, e.get("domain"), e.get("ts"), e.get("end")) for who, e in pending)
+            cols = [np.concatenate((c, x)) for c, x in zip(cols, extra)]
+        return Intervals(self.students, self.domains, *cols, store=self)
+
+    def categories(self, admin_categories, known, known_rev):
+        """category_map() of every domain, extended as domains are added; rebuilt when the inputs change."""
+        key = (json.dumps(admin_categories or {}, sort_keys=True, default=str), known_rev)
+        with self.lock:
+            if key != self.cat_key or known_rev is None:
+                self.cat_key = key
+                self.cat_names = []
+            domains = self.domains[len(self.cat_names):]
+            if domains:
+                self.cat_names = self.cat_names + category_map(domains, admin_categories, known)
+            return self.cat_names
+
+
+def load(rows_after, first_rowid, unrolled=None):
+    """
+    Intervals for the current tenant.
+
+    rows_after(rowid) -> (rowid, student, domain, ts, end) rows of
+    timeline_intervals past rowid, in rowid order; first_rowid: the table's
+    smallest rowid (when it moves, rows were pruned and the store starts
+    over); unrolled(marks) -> [(student, interval)] not rolled up yet, given
+    {student: latest start in the store}.
+    """
+    cached = tenancy.cache("analytics_store")
+    with _load_lock:
+        store = cached.get("store")
+        if store is None or store.first_rowid != first_rowid:
+            store = cached["store"] = Store(first_rowid)
+    with store.lock:
+        store.append(rows_after(store.last_rowid))
+        return store.view(unrolled(store.marks) if unrolled else ())
+
+
+def _pattern_host(pattern):
+    p = (pattern or "").strip().lower()
+    if "://" in p:
+        p = p.split("://", 1)[1]
+    p = p.split("/", 1)[0].lstrip("*.")
+    return p
+
+
+@lru_cache(maxsize=65536)
+def classify_domain(domain):
+    """URL-only keyword category of a bare domain (never fetches the page)."""
+    if not domain:
+        return "Uncategorized"
+    return ai_classifier.classify("https://" + domain + "/", fetch=False)["category"]
+
+
+@lru_cache(maxsize=64)
+def _admin_rules(categories_json):
+    """{host: category} for the admin URL lists, plus every parent of a rule host (first rule wins)."""
+    exact, parents = {}, {}
+    for name, cat in json.loads(categories_json).items():
+        urls = cat.get("urls") if isinstance(cat, dict) else None
+        for pat in urls or []:
+            host = _pattern_host(pat)
+            if not host:
+                continue
+            exact.setdefault(host, name)
+            parent = host.partition(".")[2]
+            while parent:
+                parents.setdefault(parent, name)
+                parent = parent.partition(".")[2]
+    return exact, parents
+
+
+def category_map(domain_names, admin_categories=None, known=None):
+    """Category name for each domain: admin URL lists, then `known` {domain: category}, then keywords."""
+    exact, parents = _admin_rules(json.dumps(admin_categories or {}, sort_keys=True, default=str))
+    known = known or {}
+    out = []
+    for dom in domain_names:
+        # A rule matches the domain, a parent of it, or a subdomain of it
+        hit, host = None, dom
+        while host and hit is None:
+            hit = exact.get(host)
+            host = host.partition(".")[2]
+        out.append(hit or parents.get(dom) or known.get(dom) or classify_domain(dom))
+    return out
+
+
+DENSE_DISTINCT_MAX = 1 << 24
+
+
+def _distinct(keys, size):
+    """Sorted unique values of non-negative int keys below `size`."""
+    if size <= DENSE_DISTINCT_MAX:
+        seen = np.zeros(size, dtype=bool)
+        seen[keys] = True
+        return np.flatnonzero(seen)
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+
+def _ranked(names, seconds, counts, top, key):
+    order = np.argsort(-seconds, kind="stable")
+    rows = []
+    for i in order[:top] if top else order:
+        if seconds[i] <= 0:
+            break
+        rows.append({key: names[i], "seconds": int(seconds[i]), "minutes": round(float(seconds[i]) / 60.0, 2),
+                     "students": int(counts[i])})
+    return rows
+
+
+def usage(iv, since, until, students=None, categories=None, top=50, known=None, known_rev=None):
+    """
+    Time on site inside [since, until).
+
+    students: optional iterable limiting the aggregate (e.g. one class roster).
+    categories: admin category dict (data.json["categories"]) for the category view;
+    known: recorded {domain: category} verdicts consulted after it; known_rev,
+    when given, lets a store-backed iv reuse its category names until it changes.
+    Returns totals plus by_domain / by_category / by_student, largest first;
+    the "students" column is how many distinct students contributed.
+    """
+    secs = np.minimum(iv.end, until) - np.maximum(iv.start, since)
+    mask = secs > 0
+    if students is not None:
+        wanted = {s.strip().lower() for s in students if s}
+        ids = np.asarray([i for i, s in enumerate(iv.students) if s.strip().lower() in wanted], dtype=np.int32)
+        mask &= np.isin(iv.student_idx, ids)
+    secs = secs[mask]
+    s_idx = iv.student_idx[mask]
+    d_idx = iv.domain_idx[mask]
+    n_students, n_domains = len(iv.students), len(iv.domains)
+
+    by_domain = np.bincount(d_idx, weights=secs, minlength=n_domains)
+    by_student = np.bincount(s_idx, weights=secs, minlength=n_students)
+
+    # Distinct (student, domain) pairs give "how many students" per domain / category
+    pairs = _distinct(s_idx.astype(np.int64) * max(n_domains, 1) + d_idx, n_students * max(n_domains, 1))
+    pair_dom = (pairs % max(n_domains, 1)).astype(np.int32)
+    pair_stu = (pairs // max(n_domains, 1)).astype(np.int32)
+    dom_students = np.bincount(pair_dom, minlength=n_domains)
+    stu_domains = np.bincount(pair_stu, minlength=n_students)
+
+    if iv.store is not None:
+        cat_names = iv.store.categories(categories, known, known_rev)
+    else:
+        cat_names = category_map(iv.domains, categories, known)
+    cat_vocab = sorted(set(cat_names))
+    cat_ids = {c: i for i, c in enumerate(cat_vocab)}
+    cat_of_dom = np.asarray([cat_ids[c] for c in cat_names], dtype=np.int32)
+    by_category = np.bincount(cat_of_dom[d_idx], weights=secs, minlength=len(cat_vocab)) \
+        if len(cat_vocab) else np.zeros(0)
+    cat_pairs = _distinct(pair_stu.astype(np.int64) * max(len(cat_vocab), 1) + cat_of_dom[pair_dom],
+                          n_students * max(len(cat_vocab), 1))
+    cat_students = np.bincount((cat_pairs % max(len(cat_vocab), 1)).astype(np.int32), minlength=len(cat_vocab))
+
+    by_student_rows = _ranked(iv.students, by_student, stu_domains, top, "student")
+    for row in by_student_rows:
+        row["domains"] = row.pop("students")
+
+    total = int(secs.sum())
+    return {
+        "since": int(since),
+        "until": int(until),
+        "intervals": int(mask.sum()),
+        "total_seconds": total,
+        "total_minutes": round(total / 60.0, 2),
+        "by_domain": _ranked(iv.domains, by_domain, dom_students, top, "domain"),
+        "by_category": _ranked(cat_vocab, by_category, cat_students, top, "category"),
+        "by_student": by_student_rows,
+    }
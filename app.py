@@ -2,13 +2,31 @@
 # G-SCHOOLS CONNECT BACKEND
 # =========================
 
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, Response, has_request_context, send_file, stream_with_context
 from flask_cors import CORS
-import json, os, time, sqlite3, traceback, uuid, re
-from urllib.parse import urlparse
+import json, os, time, sqlite3, traceback, uuid, re, threading, heapq, itertools, functools
 from datetime import datetime
 from collections import defaultdict
 from image_filter_ai import classify_image as _gschool_classify_image
+from frame_diff import frame_signature, file_signature as frame_signature_file, is_similar
+import chat_store
+import event_bus
+import live_tally
+import class_store
+import tenancy
+import domains
+import metrics
+import profiler
+import audit_log
+import schedules
+import policy_versions
+import compression
+import blob_store
+import analytics
+import rollups
+import exports
+import search
+import offtask
 
 # ---------------------------
 # Flask App Initialization
@@ -42,9 +60,18 @@ def _ice_servers():
 
 
 ROOT = os.path.dirname(__file__)
-DATA_PATH = os.path.join(ROOT, "data.json")
-DB_PATH = os.path.join(ROOT, "gschool.db")
-SCENES_PATH = os.path.join(ROOT, "scenes.json")
+
+
+# Storage is per tenant (school); see tenancy.py. GSCHOOL_DATA_DIR still
+# moves the whole data dir, which lets benchmarks run against a scratch copy.
+def _data_path():
+    return tenancy.path("data.json")
+
+def _db_path():
+    return tenancy.path("gschool.db")
+
+def _scenes_path():
+    return tenancy.path("scenes.json")
 
 
 # =========================
@@ -53,7 +80,7 @@ SCENES_PATH = os.path.join(ROOT, "scenes.json")
 
 def db():
     """Open sqlite connection (row factory stays default to keep light)."""
-    con = sqlite3.connect(DB_PATH)
+    con = sqlite3.connect(_db_path())
     return con
 
 def _init_db():
@@ -74,34 +101,19 @@ def _init_db():
         );
     """)
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room TEXT,
-            user_id TEXT,
-            role TEXT,
-            text TEXT,
-            ts INTEGER
+        CREATE TABLE IF NOT EXISTS command_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last INTEGER NOT NULL
         );
     """)
     con.commit()
     con.close()
-
-_init_db()
+    chat_store.ensure_schema()
+    audit_log.ensure_schema()
 
 def _safe_default_data():
     return {
         "settings": {"chat_enabled": False},
-        "classes": {
-            "period1": {
-                "name": "Period 1",
-                "active": True,
-                "focus_mode": False,
-                "paused": False,
-                "allowlist": [],
-                "teacher_blocks": [],
-                "students": []
-            }
-        },
         "categories": {},
         "pending_commands": {},
         "pending_per_student": {},
@@ -109,8 +121,7 @@ def _safe_default_data():
         "history": {},
         "screenshots": {},
         "dm": {},
-        "alerts": [],
-        "audit": []
+        "alerts": []
     }
 
 def _coerce_to_dict(obj):
@@ -126,20 +137,21 @@ def _coerce_to_dict(obj):
         return d
     return _safe_default_data()
 
+@metrics.timed("gschool_load_data_seconds", "Time spent in load_data (read + parse data.json)")
 def load_data():
     """Load JSON with self-repair for common corruption patterns."""
-    if not os.path.exists(DATA_PATH):
+    if not os.path.exists(_data_path()):
         d = _safe_default_data()
         save_data(d)
         return d
     try:
-        with open(DATA_PATH, "r", encoding="utf-8") as f:
+        with open(_data_path(), "r", encoding="utf-8") as f:
             obj = json.load(f)
             return ensure_keys(_coerce_to_dict(obj))
     except json.JSONDecodeError as e:
         # Try simple auto-repair: merge stray blocks like "} {"
         try:
-            text = open(DATA_PATH, "r", encoding="utf-8").read().strip()
+            text = open(_data_path(), "r", encoding="utf-8").read().strip()
             # Fix common '}{' issues
             text = re.sub(r"}\s*{", "},{", text)
             if not text.startswith("["):
@@ -159,10 +171,19 @@ def load_data():
         print("[WARN] load_data failed; using defaults:", e)
         return ensure_keys(_safe_default_data())
 
+@metrics.timed("gschool_save_data_seconds", "Time spent in save_data (serialise + write data.json)")
 def save_data(d):
     d = ensure_keys(_coerce_to_dict(d))
-    with open(DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2)
+    with metrics.timed("gschool_json_dump_seconds", "Time spent serialising data.json"):
+        text = json.dumps(d, indent=2)
+    # Write-then-rename: concurrent readers see the old or the new file, never a
+    # truncated one (which load_data would "repair" by starting fresh).
+    path = _data_path()
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    metrics.inc("gschool_data_json_written_bytes_total", len(text), "Bytes written to data.json")
 
 def get_setting(key, default=None):
     con = db(); cur = con.cursor()
@@ -186,15 +207,7 @@ def current_user():
 
 def ensure_keys(d):
     d.setdefault("settings", {}).setdefault("chat_enabled", False)
-    d.setdefault("classes", {}).setdefault("period1", {
-        "name": "Period 1",
-        "active": True,
-        "focus_mode": False,
-        "paused": False,
-        "allowlist": [],
-        "teacher_blocks": [],
-        "students": []
-    })
+    # Classes live in per-class shards (class_store), not in data.json
     d.setdefault("categories", {})
     d.setdefault("pending_commands", {})
     d.setdefault("pending_per_student", {})
@@ -204,7 +217,6 @@ def ensure_keys(d):
     d.setdefault("screenshots", {})
     d.setdefault("alerts", [])
     d.setdefault("dm", {})
-    d.setdefault("audit", [])
     # Policy system
     #   policies:           id -> policy object
     #   policy_assignments: { "users": {email: policy_id}, "groups": {group_id: policy_id} }
@@ -219,18 +231,46 @@ def ensure_keys(d):
 
 
 def log_action(entry):
+    """Record an audit entry. Queued for the background writer; never touches data.json."""
     try:
-        d = ensure_keys(load_data())
-        log = d.setdefault("audit", [])
-        entry = dict(entry or {})
-        entry["ts"] = int(time.time())
-        log.append(entry)
-        d["audit"] = log[-500:]
-        save_data(d)
+        u = current_user() if has_request_context() else None
+        audit_log.log(entry, user=(u or {}).get("email"))
     except Exception:
         pass
 
 
+def _migrate_legacy_audit():
+    """Move the capped audit list in data.json into the audit_log table (one-off)."""
+    try:
+        d = load_data()
+        legacy = d.get("audit")
+        if legacy is None:
+            return
+        n = audit_log.import_entries(legacy or [])
+        d.pop("audit", None)
+        save_data(d)
+        if n:
+            print(f"[INFO] Migrated {n} audit entries into SQLite")
+    except Exception as e:
+        print("[WARN] audit migration failed:", e)
+
+
+def _migrate_legacy_dm():
+    """Move DMs left in data.json["dm"] into the SQLite DM store (one-off)."""
+    try:
+        d = load_data()
+        legacy = d.get("dm") or {}
+        if not legacy:
+            return
+        for student, msgs in legacy.items():
+            chat_store.import_dm(student, msgs)
+        d["dm"] = {}
+        save_data(d)
+        print(f"[INFO] Migrated DMs for {len(legacy)} students into SQLite")
+    except Exception as e:
+        print("[WARN] DM migration failed:", e)
+
+
 # =========================
 # Guest handling helper
 # =========================
@@ -254,7 +294,7 @@ def _is_guest_identity(email: str, name: str) -> bool:
 # =========================
 def _load_scenes():
     try:
-        with open(SCENES_PATH, "r", encoding="utf-8") as f:
+        with open(_scenes_path(), "r", encoding="utf-8") as f:
             obj = json.load(f)
     except Exception:
         obj = {"allowed": [], "blocked": [], "current": []}
@@ -285,10 +325,455 @@ def _save_scenes(obj):
         obj["current"] = [c for c in cur if c]
     else:
         obj["current"] = []
-    with open(SCENES_PATH, "w", encoding="utf-8") as f:
+    with open(_scenes_path(), "w", encoding="utf-8") as f:
         json.dump(obj, f, indent=2)
 
 
+# =========================
+# Class shards
+# =========================
+_CLASS_SHARD_KEYS = ("name", "active", "focus_mode", "paused", "allowlist", "teacher_blocks", "students")
+
+def _migrate_classes_to_shards():
+    """Move data.json["classes"], class chat and the class-wide scenes into class shards (one-off)."""
+    try:
+        d = load_data()
+        legacy = d.get("classes")
+        legacy_chat = d.get("chat")
+        if not legacy and not legacy_chat:
+            if not class_store.list_ids():
+                class_store.update(class_store.DEFAULT_CLASS_ID, lambda c: None)
+            return
+
+        scenes = _load_scenes()
+        ids = set((legacy or {}).keys()) | set((legacy_chat or {}).keys())
+        for raw_cid in ids:
+            cid = class_store.clean_id(raw_cid)
+            if class_store.exists(cid):
+                continue
+            cls = (legacy or {}).get(raw_cid) or {}
+
+            def fill(shard, cls=cls, raw_cid=raw_cid, cid=cid):
+                for k in _CLASS_SHARD_KEYS:
+                    if k in cls:
+                        shard[k] = cls[k]
+                shard["chat"] = list((legacy_chat or {}).get(raw_cid) or [])[-200:]
+                if cid == class_store.DEFAULT_CLASS_ID:
+                    shard["scenes_current"] = list(scenes.get("current") or [])
+                    # teacher lists used to be mirrored into the settings table
+                    if not shard["teacher_blocks"]:
+                        shard["teacher_blocks"] = list(get_setting("teacher_blocks", []) or [])
+                    if not shard["allowlist"]:
+                        shard["allowlist"] = list(get_setting("teacher_allow", []) or [])
+
+            class_store.update(cid, fill)
+
+        if not class_store.exists(class_store.DEFAULT_CLASS_ID):
+            class_store.update(class_store.DEFAULT_CLASS_ID, lambda c: None)
+
+        d.pop("classes", None)
+        d.pop("chat", None)
+        save_data(d)
+        if scenes.get("current"):
+            scenes["current"] = []
+            _save_scenes(scenes)
+        print(f"[INFO] Migrated {len(ids)} classes into per-class shards")
+    except Exception as e:
+        print("[WARN] class shard migration failed:", e)
+
+
+def _student_class_ids(student):
+    """Classes whose roster lists the student; unrostered students belong to the default class."""
+    return class_store.classes_for(student) or [class_store.DEFAULT_CLASS_ID]
+
+
+def _class_id_arg(body=None):
+    return class_store.clean_id((body or {}).get("class_id") or request.args.get("class_id"))
+
+
+# Every queued command gets a "seq": a per-tenant increasing number (close to
+# the enqueue time in ms, so it survives restarts), taken from the command_seq
+# row inside a write transaction so worker processes never hand out the same
+# one. Heartbeat clients ack the highest seq they have applied; shared queues
+# ("*" and class shards) cannot be drained by one student, so entries older
+# than BROADCAST_COMMAND_TTL fall off.
+#
+# A worker can stamp a command and save it after another worker's higher seq is
+# already visible. Commands are therefore handed out only once their seq is
+# COMMAND_SETTLE_MS old, so an ack never moves past a command still being saved.
+BROADCAST_COMMAND_TTL = 600
+COMMAND_SETTLE_MS = 1000
+_command_seq_lock = threading.Lock()
+
+
+def _next_command_seq():
+    with _command_seq_lock:
+        con = sqlite3.connect(_db_path(), timeout=10)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT last FROM command_seq WHERE id = 1").fetchone()
+            seq = max((row[0] if row else 0) + 1, int(time.time() * 1000))
+            con.execute("INSERT OR REPLACE INTO command_seq(id, last) VALUES(1, ?)", (seq,))
+            con.commit()
+        finally:
+            con.close()
+    return seq
+
+
+def _stamp_command(cmd):
+    if isinstance(cmd, dict) and not cmd.get("seq"):
+        cmd["seq"] = _next_command_seq()
+    return cmd
+
+
+def _trim_broadcast(cmds):
+    cutoff = int((time.time() - BROADCAST_COMMAND_TTL) * 1000)
+    cmds[:] = [c for c in cmds if not isinstance(c, dict) or int(c.get("seq") or cutoff) >= cutoff]
+
+
+def _queue_command(d, target, cmd):
+    """Queue a command for one student (email) or every extension ("*") in data.json."""
+    cmds = d.setdefault("pending_commands", {}).setdefault(target, [])
+    cmds.append(_stamp_command(cmd))
+    if target == "*":
+        _trim_broadcast(cmds)
+
+
+def _queue_class_command(cid, cmd):
+    def add(c):
+        c["pending_commands"].append(_stamp_command(cmd))
+        _trim_broadcast(c["pending_commands"])
+
+    class_store.update(cid, add)
+
+
+def _policy_version(student, class_id=None):
+    """Policy version for a student: global, their classes (plus an explicit class_id) and themselves."""
+    class_ids = set(_student_class_ids(student))
+    if class_id:
+        class_ids.add(class_store.clean_id(class_id))
+    return policy_versions.version_for(student, class_ids)
+
+
+def _migrate_policy_refresh_commands():
+    """Drop queued policy_refresh commands (replaced by policy versions) and bump once if any were waiting."""
+    try:
+        def is_refresh(c):
+            return isinstance(c, dict) and c.get("type") == "policy_refresh"
+
+        def strip(cls):
+            cls["pending_commands"] = [c for c in cls["pending_commands"] if not is_refresh(c)]
+
+        d = load_data()
+        dropped = 0
+        for bucket in ("pending_commands", "pending_per_student"):
+            for target, cmds in list((d.get(bucket) or {}).items()):
+                kept = [c for c in (cmds or []) if not is_refresh(c)]
+                dropped += len(cmds or []) - len(kept)
+                d[bucket][target] = kept
+        if dropped:
+            save_data(d)
+        for cid in class_store.list_ids():
+            if any(is_refresh(c) for c in class_store.get(cid).get("pending_commands") or []):
+                class_store.update(cid, strip)
+                dropped += 1
+        if dropped:
+            policy_versions.bump()
+            print(f"[INFO] Replaced {dropped} queued policy_refresh commands with a policy version bump")
+    except Exception as e:
+        print("[WARN] policy_refresh migration failed:", e)
+
+
+# =========================
+# Metrics (Prometheus text format at /metrics)
+# =========================
+@app.before_request
+def _metrics_start():
+    request.environ["gschool.t0"] = time.perf_counter()
+
+
+@app.after_request
+def _metrics_observe(resp):
+    t0 = request.environ.pop("gschool.t0", None)
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        metrics.observe("gschool_http_request_seconds", time.perf_counter() - t0,
+                        "Request latency by route", route=route, method=request.method)
+        metrics.inc("gschool_http_requests_total", help="Requests by route and status class",
+                    route=route, method=request.method, status=f"{resp.status_code // 100}xx")
+    return resp
+
+
+# Gauges that need a full data.json parse or a walk over every class shard
+# are recomputed at most once per METRICS_SLOW_SECONDS, not on every scrape.
+METRICS_SLOW_SECONDS = int(os.environ.get("METRICS_SLOW_SECONDS", "60") or 0)
+_slow_gauges = {}
+
+
+def _slow_gauge(name, compute):
+    key = (tenancy.current(), name)
+    hit = _slow_gauges.get(key)
+    now = time.monotonic()
+    if not hit or now - hit[0] >= METRICS_SLOW_SECONDS:
+        hit = _slow_gauges[key] = (now, compute())
+    return hit[1]
+
+
+def _data_key_sizes():
+    with open(_data_path(), "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    return {k: len(json.dumps(v, indent=2)) for k, v in (doc.items() if isinstance(doc, dict) else [])}
+
+
+def _pending_command_counts():
+    d = load_data()
+    pending_student = sum(len(v or []) for v in (d.get("pending_commands") or {}).values())
+    pending_class = sum(len(class_store.get(cid).get("pending_commands") or []) for cid in class_store.list_ids())
+    return pending_student, pending_class
+
+
+@metrics.register_collector
+def _collect_data_json():
+    """Size of the current tenant's data.json and of each top-level key (refreshed every METRICS_SLOW_SECONDS)."""
+    try:
+        size = os.stat(_data_path()).st_size
+    except OSError:
+        return []
+    sizes = _slow_gauge("data_key_sizes", _data_key_sizes)
+    return [
+        ("gschool_data_json_bytes", "gauge", "Size of data.json on disk", [({}, size)]),
+        ("gschool_data_json_key_bytes", "gauge", "Serialised size of each top-level data.json key",
+         [({"key": k}, n) for k, n in sorted(sizes.items())]),
+    ]
+
+
+@metrics.register_collector
+def _collect_runtime():
+    rooms = _present()
+    active = sum(1 for r in rooms.values() if r.get("active"))
+    depths = event_bus.queue_depths()
+    pending_student, pending_class = _slow_gauge("pending_commands", _pending_command_counts)
+    cache_samples = []
+    for name, ci in domains.cache_info().items():
+        cache_samples.append(({"cache": name, "result": "hit"}, ci["hits"]))
+        cache_samples.append(({"cache": name, "result": "miss"}, ci["misses"]))
+    usage = tenancy.usage()
+    zc = compression.cache_info()
+    return [
+        ("gschool_present_rooms", "gauge", "Presentation signaling rooms",
+         [({"state": "active"}, active), ({"state": "idle"}, len(rooms) - active)]),
+        ("gschool_event_subscribers", "gauge", "Open event stream subscriptions", [({}, len(depths))]),
+        ("gschool_event_queue_depth", "gauge", "Events waiting in subscriber queues",
+         [({"stat": "total"}, sum(x[1] for x in depths)), ({"stat": "max"}, max([x[1] for x in depths] or [0]))]),
+        ("gschool_event_dropped", "gauge", "Events dropped by slow subscribers", [({}, sum(x[2] for x in depths))]),
+        ("gschool_pending_commands", "gauge", "Commands queued for extensions",
+         [({"scope": "student"}, pending_student), ({"scope": "class"}, pending_class)]),
+        ("gschool_domain_cache_requests_total", "counter", "Domain normalizer LRU lookups", cache_samples),
+        ("gschool_audit_queue", "gauge", "Audit entries waiting for the background writer",
+         [({}, audit_log.stats()["queued"])]),
+        ("gschool_audit_dropped", "gauge", "Audit entries dropped because the queue was full",
+         [({}, audit_log.stats()["dropped"])]),
+        ("gschool_requests_in_flight", "gauge", "Requests in flight per tenant",
+         [({"tenant": tid}, u["in_flight"]) for tid, u in sorted(usage.items())]),
+        ("gschool_compression_cache_requests_total", "counter", "Precompressed response cache lookups",
+         [({"result": "hit"}, zc["hits"]), ({"result": "miss"}, zc["misses"])]),
+        ("gschool_compression_cache_bytes", "gauge", "Bytes held by the precompressed response cache",
+         [({}, zc["bytes"])]),
+    ]
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target. Needs METRICS_TOKEN (bearer or ?token=) when set, else admin or loopback."""
+    token = os.environ.get("METRICS_TOKEN")
+    u = current_user()
+    if token:
+        given = request.args.get("token") or request.headers.get("Authorization", "").replace("Bearer ", "", 1)
+        allowed = given == token
+    else:
+        allowed = (u and u.get("role") == "admin") or request.remote_addr in ("127.0.0.1", "::1")
+    if not allowed:
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# =========================
+# Profiler (admin, on demand)
+# =========================
+@app.before_request
+def _profiler_start():
+    if profiler.active():
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        request.environ["gschool.profile"] = profiler.request_started(route)
+
+
+@app.teardown_request
+def _profiler_finish(exc=None):
+    profiler.request_finished(request.environ.pop("gschool.profile", None))
+
+
+def _require_district_admin():
+    u = current_user()
+    return bool(u and u["role"] == "admin" and tenancy.current() == tenancy.DEFAULT_TENANT)
+
+
+@app.route("/api/admin/profiler", methods=["GET", "POST", "DELETE"])
+def api_admin_profiler():
+    """
+    GET: session status plus the hot list (?limit=).
+    POST: start a session – {"mode": "sample", "duration": 30, "interval_ms": 10}
+          or {"mode": "requests", "requests": 50, "routes": ["/api/heartbeat"], "duration": 120}.
+    DELETE: stop the running session (results are kept until the next start).
+    """
+    if not _require_district_admin():
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    if request.method == "POST":
+        b = request.json or {}
+        try:
+            sess = profiler.start(
+                b.get("mode", "sample"),
+                duration=b.get("duration", 30),
+                interval_ms=b.get("interval_ms", 10),
+                requests=b.get("requests", 50),
+                routes=b.get("routes"),
+            )
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"ok": False, "error": str(e)}), 409
+        log_action({"event": "profiler_start", "mode": sess["mode"], "duration": sess["duration"]})
+        return jsonify({"ok": True, "session": sess})
+
+    if request.method == "DELETE":
+        return jsonify({"ok": True, "session": profiler.stop()})
+
+    limit = max(1, min(int(request.args.get("limit", 30)), 500))
+    return jsonify({"ok": True, "session": profiler.status(), "hot": profiler.hot(limit)})
+
+
+@app.route("/api/admin/profiler/collapsed", methods=["GET"])
+def api_admin_profiler_collapsed():
+    """Collapsed stacks of the last session, ready for flamegraph.pl / speedscope."""
+    if not _require_district_admin():
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    sess = profiler.status()
+    name = f"gschool-{sess.get('mode', 'profile')}-{sess.get('started', 0)}.collapsed"
+    return Response(profiler.collapsed(), mimetype="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+
+# =========================
+# Tenancy (one deployment, many schools)
+# =========================
+# Schema setup and one-off migrations run on a tenant's first request rather
+# than at import, so importing the app stays cheap and never touches disk.
+_tenants_ready = set()
+_tenants_ready_lock = threading.Lock()
+_startup_stats = {}
+
+def _prepare_tenant():
+    """Create the current tenant's tables and run the one-off migrations against its shard."""
+    tid = tenancy.current()
+    if tid in _tenants_ready:
+        return
+    with _tenants_ready_lock:
+        if tid in _tenants_ready:
+            return
+        t0 = time.perf_counter()
+        _init_db()
+        _migrate_legacy_dm()
+        _migrate_legacy_audit()
+        _migrate_classes_to_shards()
+        _migrate_policy_refresh_commands()
+        _migrate_history_to_intervals()
+        search.ensure_schema()
+        _startup_stats[tid] = round((time.perf_counter() - t0) * 1000.0, 2)
+        _tenants_ready.add(tid)
+    _schedule_timer.start()
+    _schedule_timer.poke()
+    _rollup_timer.start()
+
+
+@app.before_request
+def _route_tenant():
+    token = request.headers.get("X-Tenant-Token")
+    tid = tenancy.resolve(request.host, token)
+    if tid is None:
+        return jsonify({"ok": False, "error": "unknown tenant"}), 404
+    request.environ["gschool.tenant_ctx"] = tenancy.set_current(tid)
+    request.environ["gschool.tenant_usage"] = tenancy.begin_request(tid)
+    _prepare_tenant()
+    # A session only counts in the school it was created in.
+    u = session.get("user")
+    if u and u.get("tenant", tenancy.DEFAULT_TENANT) != tid:
+        session.pop("user", None)
+
+
+@app.after_request
+def _account_tenant(resp):
+    state = request.environ.pop("gschool.tenant_usage", None)
+    if state is not None:
+        out = 0 if resp.is_streamed else (resp.calculate_content_length() or 0)
+        tenancy.end_request(state, resp.status_code, request.content_length or 0, out)
+    return resp
+
+
+@app.teardown_request
+def _release_tenant(exc=None):
+    state = request.environ.pop("gschool.tenant_usage", None)
+    if state is not None:
+        tenancy.end_request(state, 500)
+    ctx = request.environ.pop("gschool.tenant_ctx", None)
+    if ctx is not None:
+        tenancy.reset_current(ctx)
+
+
+# =========================
+# Compression
+# =========================
+# Extensions may gzip their heartbeat and image-filter uploads; text/JSON
+# responses are gzip/brotli-compressed for clients that accept it. Registered
+# after the tenant hooks so usage accounting and metrics see wire sizes.
+app.wsgi_app = compression.GzipRequestMiddleware(app.wsgi_app, ("/api/heartbeat", "/api/image_filter/"))
+
+
+@app.after_request
+def _compress_response(resp):
+    return compression.compress_response(resp, request.headers.get("Accept-Encoding", ""))
+
+
+@app.route("/api/admin/tenants", methods=["GET", "POST"])
+def api_admin_tenants():
+    """District admins (default tenant) list schools with usage, or create/update one."""
+    u = current_user()
+    if not u or u["role"] != "admin" or tenancy.current() != tenancy.DEFAULT_TENANT:
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    if request.method == "POST":
+        b = request.json or {}
+        try:
+            t = tenancy.save_tenant(b.get("id"), name=b.get("name"), hosts=b.get("hosts"), tokens=b.get("tokens"))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        log_action({"event": "tenant_saved", "tenant": tenancy.clean_id(b.get("id")), "hosts": t["hosts"]})
+        return jsonify({"ok": True, "tenant": t})
+
+    tenants = {tenancy.DEFAULT_TENANT: {"name": "Default", "hosts": [], "tokens": []}}
+    tenants.update(tenancy.registry())
+    out = []
+    for tid, t in tenants.items():
+        out.append({
+            "id": tid,
+            "name": t["name"],
+            "hosts": t["hosts"],
+            "tokens": len(t["tokens"]),
+            "storage_bytes": tenancy.storage_bytes(tid),
+            "usage": tenancy.usage(tid),
+        })
+    return jsonify({"ok": True, "tenants": out})
+
+
 def ai_get_categories():
     u = current_user()
     if not u or u["role"] != "admin":
@@ -444,17 +929,22 @@ def logout():
 # Teacher Presentation (WebRTC signaling via REST polling)
 # =========================
 
-PRESENT = defaultdict(lambda: {
-    "offers": {},
-    "answers": {},
-    "cand_v": defaultdict(list),
-    "cand_t": defaultdict(list),
-    "updated": int(time.time()),
-    "active": False
-})
+def _present_rooms():
+    return defaultdict(lambda: {
+        "offers": {},
+        "answers": {},
+        "cand_v": defaultdict(list),
+        "cand_t": defaultdict(list),
+        "updated": int(time.time()),
+        "active": False
+    })
+
+def _present():
+    """Signaling rooms of the current tenant (rooms are in-process only)."""
+    return tenancy.cache("present", _present_rooms)
 
 def _clean_room(room):
-    r = PRESENT.get(room)
+    r = _present().get(room)
     if not r:
         return
     now = int(time.time())
@@ -483,14 +973,14 @@ def student_present_view(room):
 @app.route("/api/present/<room>/start", methods=["POST"])
 def api_present_start(room):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    PRESENT[room]["active"] = True
-    PRESENT[room]["updated"] = int(time.time())
+    _present()[room]["active"] = True
+    _present()[room]["updated"] = int(time.time())
     return jsonify({"ok": True, "room": room})
 
 @app.route("/api/present/<room>/end", methods=["POST"])
 def api_present_end(room):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    PRESENT[room] = {
+    _present()[room] = {
         "offers": {},
         "answers": {},
         "cand_v": defaultdict(list),
@@ -503,7 +993,7 @@ def api_present_end(room):
 @app.route("/api/present/<room>/status", methods=["GET"])
 def api_present_status(room):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    r = PRESENT.get(room) or {}
+    r = _present().get(room) or {}
     return jsonify({"ok": True, "active": bool(r.get("active"))})
 
 # Viewer posts offer and polls for answer
@@ -513,7 +1003,7 @@ def api_present_viewer_offer(room):
     sdp = body.get("sdp")
     client_id = body.get("client_id") or str(uuid.uuid4())
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    r = PRESENT[room]
+    r = _present()[room]
     r["offers"][client_id] = sdp
     r["updated"] = int(time.time())
     return jsonify({"ok": True, "client_id": client_id})
@@ -522,14 +1012,14 @@ def api_present_viewer_offer(room):
 def api_present_offers(room):
     # Teacher polls for pending offers
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    offers = PRESENT[room]["offers"]
+    offers = _present()[room]["offers"]
     return jsonify({"ok": True, "offers": offers})
 
 @app.route("/api/present/<room>/answer/<client_id>", methods=["POST", "GET"])
 def api_present_answer(room, client_id):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
     client_id = re.sub(r'[^a-zA-Z0-9_-]+', '', client_id)
-    r = PRESENT[room]
+    r = _present()[room]
     if request.method == "POST":
         body = request.json or {}
         sdp = body.get("sdp")
@@ -549,7 +1039,7 @@ def api_present_candidate(room, side, client_id):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
     client_id = re.sub(r'[^a-zA-Z0-9_-]+', '', client_id)
     side = "viewer" if side.lower().startswith("v") else "teacher"
-    r = PRESENT[room]
+    r = _present()[room]
     bucket_from = r["cand_v"] if side == "viewer" else r["cand_t"]
     bucket_to = r["cand_t"] if side == "viewer" else r["cand_v"]
     if request.method == "POST":
@@ -568,7 +1058,7 @@ def api_present_candidate(room, side, client_id):
 @app.route("/api/present/<room>/diag", methods=["GET"])
 def api_present_diag(room):
     room = re.sub(r'[^a-zA-Z0-9_-]+', '', room)
-    r = PRESENT.get(room) or {"offers": {}, "answers": {}, "cand_v": {}, "cand_t": {}, "active": False}
+    r = _present().get(room) or {"offers": {}, "answers": {}, "cand_v": {}, "cand_t": {}, "active": False}
     return jsonify({
         "ok": True,
         "active": bool(r.get("active")),
@@ -657,7 +1147,7 @@ def api_login():
     row = cur.fetchone()
     con.close()
     if row:
-        session["user"] = {"email": row[0], "role": row[1]}
+        session["user"] = {"email": row[0], "role": row[1], "tenant": tenancy.current()}
         return jsonify({"ok": True, "role": row[1]})
     return jsonify({"ok": False, "error": "Invalid credentials"}), 401
 
@@ -667,21 +1157,23 @@ def api_login():
 # =========================
 @app.route("/api/data")
 def api_data():
-    """Compatibility wrapper used by teacher.html's loadData()."""
+    """Compatibility wrapper used by teacher.html's loadData(). ?class_id= selects the class."""
     d = ensure_keys(load_data())
-    cls = d["classes"].get("period1", {})
+    cid = _class_id_arg()
+    cls = class_store.get(cid)
     return jsonify({
         "settings": {
             "chat_enabled": bool(d.get("settings", {}).get("chat_enabled", True)),
             "youtube_mode": get_setting("youtube_mode", "normal"),
         },
         "lists": {
-            "teacher_blocks": get_setting("teacher_blocks", []),
-            "teacher_allow": get_setting("teacher_allow", []),
+            "teacher_blocks": list(cls.get("teacher_blocks", [])),
+            "teacher_allow": list(cls.get("allowlist", [])),
         },
+        "class_ids": class_store.list_ids(),
         # added for teacher.html compatibility
         "classes": {
-            "period1": {
+            cid: {
                 "name": cls.get("name", "Graden's Classroom"),
                 "active": bool(cls.get("active", True)),
                 "focus_mode": bool(cls.get("focus_mode", False)),
@@ -728,6 +1220,7 @@ def api_settings():
         d["settings"]["bypass_ttl_minutes"] = ttl
 
     save_data(d)
+    policy_versions.bump()
     return jsonify({"ok": True, "settings": d["settings"]})
 
 @app.route("/api/categories", methods=["POST"])
@@ -745,13 +1238,10 @@ def api_categories():
         return jsonify({"ok": False, "error": "name required"}), 400
 
     d["categories"][name] = {"urls": urls, "blockPage": bp}
-
-    # Policy changed → force refresh for all extensions
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
-        "type": "policy_refresh"
-    })
-
     save_data(d)
+
+    # Policy changed → every extension re-fetches
+    policy_versions.bump()
     log_action({"event": "categories_update", "name": name})
     return jsonify({"ok": True})
 
@@ -765,13 +1255,10 @@ def api_categories_delete():
     name = (request.json or {}).get("name")
     if name in d["categories"]:
         del d["categories"][name]
-
-        # Policy changed → force refresh
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({
-            "type": "policy_refresh"
-        })
-
         save_data(d)
+
+        # Policy changed → every extension re-fetches
+        policy_versions.bump()
         log_action({"event": "categories_delete", "name": name})
     return jsonify({"ok": True})
 
@@ -864,66 +1351,60 @@ def api_announce():
     )
 
     d["announcements"] = msg
+    save_data(d)
 
     # Tell all extensions to re-fetch /api/policy so they see the new announcement
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
-        "type": "policy_refresh"
-    })
-
-    save_data(d)
+    policy_versions.bump()
     log_action({"event": "announce", "message": msg})
     return jsonify({"ok": True})
 
 @app.route("/api/class/set", methods=["GET", "POST"])
 def api_class_set():
-    d = ensure_keys(load_data())
+    """Update one class shard; only global settings (chat, passcode) touch data.json."""
+    body = (request.json or {}) if request.method == "POST" else {}
+    cid = _class_id_arg(body)
 
     if request.method == "GET":
-        cls = d["classes"].get("period1", {})
-        return jsonify({"class": cls, "settings": d["settings"]})
-
-    body = request.json or {}
-    cls = d["classes"].get("period1", {})
-    prev_active = bool(cls.get("active", True))
-
-    if "teacher_blocks" in body:
-        set_setting("teacher_blocks", body["teacher_blocks"])
-        cls["teacher_blocks"] = list(body["teacher_blocks"])
-    else:
-        cls.setdefault("teacher_blocks", [])
-
-    if "allowlist" in body:
-        set_setting("teacher_allow", body["allowlist"])
-        cls["allowlist"] = list(body["allowlist"])
-    else:
-        cls.setdefault("allowlist", [])
-
-    if "chat_enabled" in body:
-        set_setting("chat_enabled", body["chat_enabled"])
-        d["settings"]["chat_enabled"] = bool(body["chat_enabled"])
-
-    if "active" in body:
-        cls["active"] = bool(body["active"])
-    if "passcode" in body and body["passcode"]:
-        d["settings"]["passcode"] = body["passcode"]
-
-    d["classes"]["period1"] = cls
-
-    if bool(cls.get("active", True)) and not prev_active:
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({
-            "type": "notify",
-            "title": "Class session is active",
-            "message": "Please join and stay until dismissed."
-        })
-
-    # IMPORTANT: force all extensions to re-fetch policy for new rules
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
-        "type": "policy_refresh"
-    })
+        d = ensure_keys(load_data())
+        return jsonify({"class": class_store.get(cid), "settings": d["settings"]})
+
+    state = {}
+
+    def apply(cls):
+        state["prev_active"] = bool(cls.get("active", True))
+        if "teacher_blocks" in body:
+            cls["teacher_blocks"] = list(body["teacher_blocks"])
+        if "allowlist" in body:
+            cls["allowlist"] = list(body["allowlist"])
+        if "active" in body:
+            cls["active"] = bool(body["active"])
+
+        if bool(cls.get("active", True)) and not state["prev_active"]:
+            cls["pending_commands"].append(_stamp_command({
+                "type": "notify",
+                "title": "Class session is active",
+                "message": "Please join and stay until dismissed."
+            }))
+
+    cls = class_store.update(cid, apply)
+    # IMPORTANT: force this class's extensions to re-fetch policy for new rules
+    policy_versions.bump("class", cid)
+
+    d = None
+    if "chat_enabled" in body or ("passcode" in body and body["passcode"]):
+        d = ensure_keys(load_data())
+        if "chat_enabled" in body:
+            set_setting("chat_enabled", body["chat_enabled"])
+            d["settings"]["chat_enabled"] = bool(body["chat_enabled"])
+        if "passcode" in body and body["passcode"]:
+            d["settings"]["passcode"] = body["passcode"]
+        save_data(d)
+        if "chat_enabled" in body:
+            policy_versions.bump()
+    settings = (d or ensure_keys(load_data()))["settings"]
 
-    save_data(d)
-    log_action({"event": "class_set", "active": cls.get("active", True)})
-    return jsonify({"ok": True, "class": cls, "settings": d["settings"]})
+    log_action({"event": "class_set", "class_id": cid, "active": cls.get("active", True)})
+    return jsonify({"ok": True, "class": cls, "settings": settings})
 
 @app.route("/api/class/toggle", methods=["POST"])
 def api_class_toggle():
@@ -931,21 +1412,74 @@ def api_class_toggle():
     if not u or u["role"] not in ("teacher", "admin"):
         return jsonify({"ok": False, "error": "forbidden"}), 403
 
-    d = ensure_keys(load_data())
     b = request.json or {}
-    cid = b.get("class_id", "period1")
+    cid = class_store.clean_id(b.get("class_id"))
     key = b.get("key")
     val = bool(b.get("value"))
 
-    if cid in d["classes"] and key in ("focus_mode", "paused"):
-        d["classes"][cid][key] = val
-        save_data(d)
-        log_action({"event": "class_toggle", "key": key, "value": val})
-        return jsonify({"ok": True, "class": d["classes"][cid]})
+    if key in ("focus_mode", "paused") and (class_store.exists(cid) or cid == class_store.DEFAULT_CLASS_ID):
+        cls = class_store.update(cid, lambda c: c.__setitem__(key, val))
+        policy_versions.bump("class", cid)
+        log_action({"event": "class_toggle", "class_id": cid, "key": key, "value": val})
+        return jsonify({"ok": True, "class": cls})
 
     return jsonify({"ok": False, "error": "invalid"}), 400
 
 
+@app.route("/api/classes", methods=["GET", "POST", "DELETE"])
+def api_classes():
+    """
+    GET: list classes (id, name, active, roster size).
+    POST: create/update a class – {id, name?, active?, students?}.
+    DELETE: admin only – {id}.
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    if request.method == "GET":
+        out = []
+        for cid in class_store.list_ids():
+            c = class_store.get(cid)
+            out.append({"id": cid, "name": c.get("name"), "active": bool(c.get("active", True)),
+                        "students": len(c.get("students") or [])})
+        return jsonify({"ok": True, "classes": out})
+
+    body = request.json or {}
+    raw_id = (body.get("id") or "").strip()
+    if not raw_id:
+        return jsonify({"ok": False, "error": "id required"}), 400
+    cid = class_store.clean_id(raw_id)
+
+    if request.method == "DELETE":
+        if u["role"] != "admin":
+            return jsonify({"ok": False, "error": "forbidden"}), 403
+        roster = list(class_store.get(cid).get("students") or []) if class_store.exists(cid) else []
+        class_store.delete(cid)
+        policy_versions.bump_many("student", roster)
+        log_action({"event": "class_delete", "class_id": cid})
+        return jsonify({"ok": True})
+
+    before = {}
+
+    def apply(cls):
+        before["students"] = set(cls.get("students") or [])
+        if "name" in body:
+            cls["name"] = (body.get("name") or "").strip() or cid
+        if "active" in body:
+            cls["active"] = bool(body["active"])
+        if isinstance(body.get("students"), list):
+            cls["students"] = [(s or "").strip().lower() for s in body["students"] if (s or "").strip()]
+
+    cls = class_store.update(cid, apply)
+    if "active" in body:
+        policy_versions.bump("class", cid)
+    # Students joining or leaving pick up a different set of class policies
+    policy_versions.bump_many("student", before["students"] ^ set(cls.get("students") or []))
+    log_action({"event": "class_upsert", "class_id": cid, "students": len(cls.get("students") or [])})
+    return jsonify({"ok": True, "class": cls})
+
+
 # =========================
 # Commands
 # =========================
@@ -960,8 +1494,12 @@ def api_command():
     cmd = b.get("command")
     if not cmd or "type" not in cmd:
         return jsonify({"ok": False, "error": "invalid"}), 400
-    d.setdefault("pending_commands", {}).setdefault(target, []).append(cmd)
-    save_data(d)
+    if target == "*" and b.get("class_id"):
+        # Class-wide command: only that class's shard is written
+        _queue_class_command(class_store.clean_id(b["class_id"]), cmd)
+    else:
+        _queue_command(d, target, cmd)
+        save_data(d)
     log_action({"event": "command", "target": target, "type": cmd.get("type")})
     return jsonify({"ok": True})
 
@@ -970,11 +1508,21 @@ def api_commands(student):
     d = ensure_keys(load_data())
 
     if request.method == "GET":
-        cmds = d["pending_commands"].get(student, []) + d["pending_commands"].get("*", [])
-        d["pending_commands"][student] = []
-        d["pending_commands"]["*"] = []
-        save_data(d)
-        return jsonify({"commands": cmds})
+        # Shared queues ("*" and the student's classes) are never drained here -
+        # heartbeat-sync extensions still need them and BROADCAST_COMMAND_TTL
+        # expires them. The seq this student was last handed is kept server-side
+        # instead of an ack from the client.
+        cursors = d.setdefault("command_cursors", {})
+        ack = int(cursors.get(student) or 0)
+        out = _heartbeat_sync(d, student, {"ack": ack, "class_id": request.args.get("class_id")})
+        if out["commands"]:
+            cursors[student] = out["cursor"]
+            own = d["pending_commands"].get(student)
+            if own:
+                d["pending_commands"][student] = [c for c in own
+                                                  if isinstance(c, dict) and int(c.get("seq") or 0) > out["cursor"]]
+            save_data(d)
+        return jsonify({"commands": out["commands"], "policy_version": out["policy_version"]})
 
     # POST (push from teacher)
     u = current_user()
@@ -985,64 +1533,287 @@ def api_commands(student):
     if not b.get("type"):
         return jsonify({"ok": False, "error": "missing type"}), 400
 
-    d["pending_commands"].setdefault(student, []).append(b)
+    _queue_command(d, student, b)
     save_data(d)
     log_action({"event": "command_sent", "to": student, "cmd": b.get("type")})
     return jsonify({"ok": True})
 
 
 # =========================
-# Off-task Check (simple)
+# Off-task evaluation
 # =========================
+# Part of heartbeat ingestion (see _offtask_stage): the active tab is judged
+# against the student's compiled rules (offtask.py) and the state is kept in
+# presence. Going off task, or moving on to another off-task site, is one
+# entry in offtask_events (what /api/engagement counts); that and coming back
+# on task are published on the event bus as "offtask". Browsing within a
+# site, or between on-task pages, records nothing.
+OFFTASK_EVENTS_MAX = 2000
+
+
+def _scenes_mtime():
+    try:
+        return os.stat(_scenes_path()).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _offtask_rules(d, student, class_id=None):
+    """
+    The student's compiled off-task rules: class lists and scenes, the active
+    policy's URLs and blocked categories, and the off-task keywords
+    (settings.offtask_keywords). Rebuilt only when the student's policy
+    version, the scene store or the global inputs change.
+    """
+    settings = d.get("settings", {}) or {}
+    keywords = tuple(settings.get("offtask_keywords") or offtask.DEFAULT_KEYWORDS)
+    categories = d.get("categories", {}) or {}
+    blocked_globally = tuple(sorted(name for name, c in categories.items() if isinstance(c, dict) and c.get("blocked")))
+    key = (_policy_version(student, class_id), class_id, _scenes_mtime(), keywords, blocked_globally)
+    cache = tenancy.cache("offtask_rules")
+    hit = cache.get(student)
+    if hit and hit[0] == key:
+        return hit[1]
+
+    policy = _select_active_policy(d, student)
+    allowlist, teacher_blocks, _, _ = _scene_lists(d, student, _policy_shards(student, class_id))
+    allowlist, teacher_blocks, categories = _apply_policy_to_lists(allowlist, teacher_blocks, categories, policy)
+    blocked = {name for name, c in categories.items() if isinstance(c, dict) and c.get("blocked")}
+    blocked.update(str(name) for name in ((policy or {}).get("blocked_categories") or []) if name)
+    rules = offtask.compile_rules(tuple(allowlist), tuple(teacher_blocks), tuple(sorted(blocked)), keywords)
+    cache[student] = (key, rules)
+    return rules
+
+
+def _offtask_verdict(d, student, url, class_id=None):
+    categories = d.get("categories", {}) or {}
+
+    def category_of(dom):
+        known = rollups.verdict(dom)
+        return analytics.category_map([dom], categories, {dom: known} if known else None)[0]
+
+    return offtask.evaluate(_offtask_rules(d, student, class_id), url, category_of)
+
+
+def _record_offtask(d, event):
+    """Append an off-task episode to d (the caller saves d, then publishes it)."""
+    d.setdefault("offtask_events", []).append(event)
+    d["offtask_events"] = d["offtask_events"][-OFFTASK_EVENTS_MAX:]
+
+
+def _offtask_stage(d, student, pres, now, class_id=None):
+    """
+    Heartbeat stage: judge the active tab and keep the verdict in pres["offtask"].
+
+    Returns the event to publish once d is saved when the student went off
+    task, moved to another off-task site (both also appended to
+    offtask_events) or came back on task; else None. Tabs that are not web
+    pages carry no verdict.
+    """
+    url = ((pres.get("tab") or {}).get("url") or "").strip()
+    if not url.lower().startswith(("http://", "https://")):
+        pres.pop("offtask", None)
+        return None
+    v = _offtask_verdict(d, student, url, class_id)
+    prev = pres.get("offtask") or {}
+    flipped = prev.get("on_task") != v["on_task"]
+    moved = not v["on_task"] and prev.get("domain") != v["domain"]
+    pres["offtask"] = {"on_task": v["on_task"], "reason": v["reason"], "url": url, "domain": v["domain"],
+                       "since": now if flipped else prev.get("since", now)}
+    if not (flipped or moved):
+        return None
+    event = {"student": student, "url": url, "domain": v["domain"], "ts": now,
+             "on_task": v["on_task"], "reason": v["reason"]}
+    if not v["on_task"]:
+        _record_offtask(d, event)
+    return event
+
+
 @app.route("/api/offtask/check", methods=["POST"])
 def api_offtask_check():
+    """
+    Judge one URL for a student on demand. Heartbeats already do this for the
+    active tab (the "offtask" block of the heartbeat response), so extensions
+    that send heartbeats never need to call it.
+    """
     b = request.json or {}
     student = (b.get("student") or "").strip()
-    url = (b.get("url") or "")
+    url = (b.get("url") or "").strip()
     if not student or not url:
         return jsonify({"ok": False}), 400
 
     d = ensure_keys(load_data())
-    # allowlist from policy (scene) if any
-    scene_allowed = set()
-    for patt in (d.get("policy", {}).get("allowlist") or []):
-        m = re.match(r"\*\:\/\/\*\.(.+?)\/\*", patt)
-        if m:
-            scene_allowed.add(m.group(1).lower())
-
-    host = ""
-    try:
-        host = urlparse(url).hostname or ""
-    except Exception:
-        pass
+    v = _offtask_verdict(d, student, url, b.get("class_id"))
+    event = {"student": student, "url": url, "domain": v["domain"], "ts": int(time.time()),
+             "on_task": v["on_task"], "reason": v["reason"]}
+    if not v["on_task"]:
+        _record_offtask(d, event)
+        save_data(d)
+    event_bus.publish("offtask", event)
+    return jsonify({"ok": True, "on_task": v["on_task"], "reason": v["reason"]})
 
-    on_task = any(host.endswith(dom) for dom in scene_allowed) if host else False
-    bad_kw = ("coolmath", "roblox", "twitch", "steam", "epicgames")
-    if any(k in url.lower() for k in bad_kw):
-        on_task = False
 
-    v = {"student": student, "url": url, "ts": int(time.time()), "on_task": bool(on_task)}
-    d.setdefault("offtask_events", []).append(v)
-    d["offtask_events"] = d["offtask_events"][-2000:]
-    save_data(d)
+# =========================
+# Presence / Heartbeat
+# =========================
 
-    try:
-        # If using socketio, you could emit here; safely ignore if not present
-        from flask_socketio import SocketIO  # type: ignore
-        socketio = SocketIO(message_queue=None)
-        socketio.emit("offtask", v, broadcast=True)
-    except Exception:
-        pass
+def _ensure_screenshot_filter_config(d):
+    """
+    Ensure d["screenshot_filter"] exists with safe defaults.
+
+    Frames whose difference hash is within `diff_threshold` bits (out of 64)
+    of the student's previous frame are treated as unchanged and are not
+    stored again.
+    """
+    cfg = d.setdefault("screenshot_filter", {})
+    cfg.setdefault("enabled", True)
+    cfg.setdefault("diff_threshold", 4)
+    stats = d.setdefault("screenshot_filter_stats", {})
+    stats.setdefault("frames", 0)
+    stats.setdefault("suppressed", 0)
+    return cfg
 
-    return jsonify({"ok": True, "on_task": bool(on_task)})
+
+def _screenshot_filter_report(d):
+    cfg = _ensure_screenshot_filter_config(d)
+    stats = d["screenshot_filter_stats"]
+    frames = int(stats.get("frames", 0) or 0)
+    suppressed = int(stats.get("suppressed", 0) or 0)
+    return {
+        "config": cfg,
+        "frames": frames,
+        "suppressed": suppressed,
+        "suppression_rate": (suppressed / float(frames)) if frames else 0.0,
+    }
 
 
 # =========================
-# Presence / Heartbeat
+# Browsing timeline (dwell intervals)
 # =========================
+# history[student] holds intervals {"ts": start, "end": last seen, url, title,
+# domain, favIconUrl}; a heartbeat on the same URL extends the last one.
+# Older rows without "end" are single points. The legacy point view (one row
+# per HISTORY_SAMPLE_SECONDS of dwell) is derived on demand.
+HISTORY_SAMPLE_SECONDS = 15
+HISTORY_GAP_SECONDS = 120        # a longer silence starts a new interval
+HISTORY_MAX_INTERVALS = 500
+
+
+def _interval_end(e):
+    start = int(e.get("ts") or 0)
+    return max(start, int(e.get("end") or start))
+
+
+def _interval_points(e, since=0, newest_first=False):
+    """Legacy timeline rows for an interval, one every HISTORY_SAMPLE_SECONDS from its start (lazily)."""
+    start, end = int(e.get("ts") or 0), _interval_end(e)
+    base = {k: v for k, v in e.items() if k != "end"}
+    first = start
+    if since > start:
+        first = start + -(-(since - start) // HISTORY_SAMPLE_SECONDS) * HISTORY_SAMPLE_SECONDS
+    times = range(first, end + 1, HISTORY_SAMPLE_SECONDS)
+    return (dict(base, ts=t) for t in (reversed(times) if newest_first else times))
+
+
+def _interval_samples(e, since=0):
+    """len(_interval_points(e, since)) without building the rows."""
+    start, end = int(e.get("ts") or 0), _interval_end(e)
+    first = start
+    if since > start:
+        first = start + -(-(since - start) // HISTORY_SAMPLE_SECONDS) * HISTORY_SAMPLE_SECONDS
+    return 0 if first > end else (end - first) // HISTORY_SAMPLE_SECONDS + 1
+
+
+def _migrate_history_to_intervals():
+    """Collapse legacy 15-second history rows into dwell intervals (one-off)."""
+    try:
+        d = load_data()
+        hist = d.get("history") or {}
+        if not any(e for arr in hist.values() for e in (arr or []) if "end" not in e):
+            return
+        before = after = 0
+        for student, arr in hist.items():
+            merged = []
+            for e in sorted(arr or [], key=lambda x: int(x.get("ts") or 0)):
+                before += 1
+                last = merged[-1] if merged else None
+                ts = int(e.get("ts") or 0)
+                if last and last.get("url") == e.get("url") and ts - _interval_end(last) <= HISTORY_GAP_SECONDS:
+                    last["end"] = max(_interval_end(last), _interval_end(e))
+                else:
+                    merged.append(dict(e, end=_interval_end(e)))
+            hist[student] = merged[-HISTORY_MAX_INTERVALS:]
+            after += len(hist[student])
+        save_data(d)
+        print(f"[INFO] Collapsed {before} history rows into {after} dwell intervals")
+    except Exception as e:
+        print("[WARN] history interval migration failed:", e)
+
+
+def _heartbeat_sync(d, student, sync):
+    """
+    Everything the extension would otherwise poll for, for a heartbeat that asked for it:
+    commands newer than the client's ack cursor and at least COMMAND_SETTLE_MS old
+    (from its own queue, "*" and its classes), the new cursor, its policy version
+    and the config versions.
+
+    Commands in the student's own queue at or below the ack are dropped; the
+    caller saves `d`.
+    """
+    try:
+        ack = int(sync.get("ack") or 0)
+    except (TypeError, ValueError):
+        ack = 0
+    pending = d.setdefault("pending_commands", {})
+
+    own = pending.get(student) or []
+    for c in own:
+        _stamp_command(c)
+    own = [c for c in own if not isinstance(c, dict) or int(c.get("seq") or 0) > ack]
+    if own or student in pending:
+        pending[student] = own
+
+    broadcast = pending.get("*") or []
+    for c in broadcast:
+        _stamp_command(c)
+    _trim_broadcast(broadcast)
+
+    class_cmds = []
+    for cid in _student_class_ids(student):
+        cmds = class_store.get(cid).get("pending_commands") or []
+        if any(isinstance(c, dict) and not c.get("seq") for c in cmds):
+            def stamp(cls):
+                for c in cls["pending_commands"]:
+                    _stamp_command(c)
+                _trim_broadcast(cls["pending_commands"])
+
+            cmds = class_store.update(cid, stamp).get("pending_commands") or []
+        class_cmds.extend(cmds)
+
+    settled = int(time.time() * 1000) - COMMAND_SETTLE_MS
+    out = [c for c in own + broadcast + class_cmds
+           if isinstance(c, dict) and ack < int(c.get("seq") or 0) <= settled]
+    out.sort(key=lambda c: c["seq"])
+    return {
+        "commands": out,
+        "cursor": max([ack] + [c["seq"] for c in out]),
+        "policy_version": _policy_version(student, sync.get("class_id")),
+        "config_versions": policy_versions.config_versions(),
+    }
+
+
 @app.route("/api/heartbeat", methods=["POST"])
 def api_heartbeat():
-    """Student heartbeat – updates presence, logs timeline, screenshots, and returns extension state."""
+    """Student heartbeat – updates presence, logs timeline, screenshots, and returns extension state.
+
+    Optional body field `sync` ({"ack": <last applied command seq>, "class_id": ...}
+    or just true) adds a "sync" block to the response (see _heartbeat_sync), so the
+    extension does not have to poll /api/commands, /api/policy, /api/youtube_rules
+    and /api/image_filter/config separately.
+
+    The active tab is also judged on/off task (see _offtask_stage); the verdict is
+    returned as "offtask" and changes are published on the event bus.
+    """
     b = request.json or {}
     student = (b.get("student") or "").strip()
     display_name = b.get("student_name", "")
@@ -1061,6 +1832,8 @@ def api_heartbeat():
 
     d = ensure_keys(load_data())
     d.setdefault("presence", {})
+    sync = b.get("sync")
+    offtask_event = None
 
     if student:
         pres = d["presence"].setdefault(student, {})
@@ -1074,7 +1847,28 @@ def api_heartbeat():
         elif "favicon" in pres.get("tab", {}):
             pres["tab"]["favIconUrl"] = pres["tab"].get("favicon")
 
-        pres["screenshot"] = b.get("screenshot", "") or ""
+        # --- Drop frames that haven't meaningfully changed since the last one ---
+        sf_cfg = _ensure_screenshot_filter_config(d)
+        sf_stats = d["screenshot_filter_stats"]
+        sf_on = bool(sf_cfg.get("enabled", True))
+        sf_threshold = int(sf_cfg.get("diff_threshold", 4) or 0)
+
+        # Binary frames arrive through /api/heartbeat/screenshot; leave the stored
+        # frame alone unless this heartbeat actually carries a screenshot field.
+        if "screenshot" in b:
+            shot = b.get("screenshot") or ""
+            if shot and sf_on:
+                sig = frame_signature(shot)
+                sf_stats["frames"] = int(sf_stats.get("frames", 0)) + 1
+                if sig and pres.get("screenshot") and is_similar(sig, pres.get("screenshot_sig"), sf_threshold):
+                    sf_stats["suppressed"] = int(sf_stats.get("suppressed", 0)) + 1
+                else:
+                    pres["screenshot"] = shot
+                    pres["screenshot_sig"] = sig
+                    pres["screenshot_ts"] = int(time.time())
+            else:
+                pres["screenshot"] = shot
+                pres.pop("screenshot_sig", None)
 
         # --- Keep only screenshots for open tabs shown in modal preview ---
         shots = pres.get("tabshots", {})
@@ -1096,43 +1890,220 @@ def api_heartbeat():
             title = (cur.get("title") or "").strip()
             fav = cur.get("favIconUrl")
 
-            should_add = False
+            # Dwell intervals: extend the open interval while the URL stays the same
             if url:
-                if not timeline:
-                    should_add = True
+                last = timeline[-1] if timeline else None
+                if last and last.get("url") == url and now - _interval_end(last) <= HISTORY_GAP_SECONDS:
+                    last["end"] = max(_interval_end(last), now)
+                    if title:
+                        last["title"] = title
                 else:
-                    last = timeline[-1]
-                    if last.get("url") != url or now - int(last.get("ts", 0)) >= 15:
-                        should_add = True
-
-            if should_add:
-                timeline.append({"ts": now, "title": title, "url": url, "favIconUrl": fav})
-                d["history"][student] = timeline[-500:]  # cap
+                    timeline.append({"ts": now, "end": now, "title": title, "url": url,
+                                     "domain": domains.domain_of(url), "favIconUrl": fav})
+                    d["history"][student] = timeline[-HISTORY_MAX_INTERVALS:]  # cap
 
             # Screenshot history: if extension passes `shot_log: [{tabId,dataUrl,title,url}]`
             shot_log = b.get("shot_log") or []
             if shot_log:
                 hist = d.setdefault("screenshots", {}).setdefault(student, [])
+                last_by_tab = {}
+                for e in hist:
+                    last_by_tab[str(e.get("tabId"))] = e
                 for s in shot_log[:10]:
-                    hist.append({
+                    sig = frame_signature(s.get("dataUrl")) if sf_on else None
+                    if sf_on:
+                        sf_stats["frames"] = int(sf_stats.get("frames", 0)) + 1
+                    prev = last_by_tab.get(str(s.get("tabId")))
+                    if sig and prev and prev.get("url") == (s.get("url") or "") \
+                            and is_similar(sig, prev.get("sig"), sf_threshold):
+                        # Unchanged frame: extend the previous entry instead of storing a copy
+                        prev["repeat_until"] = now
+                        prev["repeats"] = int(prev.get("repeats", 0)) + 1
+                        sf_stats["suppressed"] = int(sf_stats.get("suppressed", 0)) + 1
+                        continue
+                    entry = {
                         "ts": now,
                         "tabId": s.get("tabId"),
                         "dataUrl": s.get("dataUrl"),
                         "title": (s.get("title") or ""),
                         "url": (s.get("url") or "")
-                    })
+                    }
+                    if sig:
+                        entry["sig"] = sig
+                    hist.append(entry)
+                    last_by_tab[str(s.get("tabId"))] = entry
                 d["screenshots"][student] = hist[-200:]
         except Exception as e:
             print("[WARN] Heartbeat logging error:", e)
 
+        # ---------- Off-task state of the active tab ----------
+        try:
+            class_id = sync.get("class_id") if isinstance(sync, dict) else None
+            offtask_event = _offtask_stage(d, student, pres, int(time.time()), class_id)
+        except Exception as e:
+            print("[WARN] Heartbeat off-task error:", e)
+
+    sync_out = None
+    if student and sync:
+        sync_out = _heartbeat_sync(d, student, sync if isinstance(sync, dict) else {})
+
     save_data(d)
+    if offtask_event:
+        event_bus.publish("offtask", offtask_event)
 
-    return jsonify({
+    resp = {
         "ok": True,
         "server_time": int(time.time()),
         # Honor global kill switch but also keep guest lockout enforced above.
         "extension_enabled": bool(extension_enabled_global)
-    })
+    }
+    if student and (d["presence"].get(student) or {}).get("offtask"):
+        state = d["presence"][student]["offtask"]
+        resp["offtask"] = {"on_task": state["on_task"], "reason": state["reason"]}
+    if sync_out is not None:
+        resp["sync"] = sync_out
+    return jsonify(resp)
+
+# =========================
+# Binary uploads (screenshots, image-filter thumbnails)
+# =========================
+# Raw-body (Content-Type: image/*) or multipart ("file" field) alternatives to
+# the base64 data URLs inside heartbeat / evaluate JSON. Screenshots are
+# streamed in fixed-size chunks into blob_store and referenced by URL;
+# thumbnails are read once, bounded, and handed to the classifier as bytes.
+MAX_THUMBNAIL_BYTES = int(os.environ.get("MAX_THUMBNAIL_BYTES", str(512 * 1024)) or 0)
+_UPLOAD_BUCKETS = (4096, 16384, 65536, 262144, 1048576, 4194304, 8388608)
+
+
+def _upload_source():
+    """(binary stream or None, metadata mapping) for a raw or multipart upload."""
+    if request.mimetype == "multipart/form-data":
+        f = request.files.get("file") or next(iter(request.files.values()), None)
+        meta = dict(request.args.items())
+        meta.update(request.form.items())
+        return (f.stream if f else None), meta
+    return request.stream, dict(request.args.items())
+
+
+def _read_bounded(stream, limit):
+    """Read a whole upload in chunks; None once it passes `limit` bytes."""
+    buf = bytearray()
+    while True:
+        chunk = stream.read(blob_store.CHUNK_BYTES)
+        if not chunk:
+            return bytes(buf)
+        buf += chunk
+        if limit and len(buf) > limit:
+            return None
+
+
+def _too_large(limit):
+    return bool(limit) and (request.content_length or 0) > limit + 64 * 1024  # multipart framing slack
+
+
+def _upload_too_large():
+    return jsonify({"ok": False, "error": "upload too large"}), 413
+
+
+@app.route("/api/heartbeat/screenshot", methods=["POST"])
+def api_heartbeat_screenshot():
+    """
+    Binary screenshot upload. Metadata in the query string (or multipart form):
+      student, kind = "screenshot" (default) | "tabshot" | "shot", tab_id, url, title
+
+    screenshot → presence screenshot, tabshot → presence tabshots[tab_id],
+    shot → screenshot history (same frame suppression as shot_log). Stored
+    values are /api/blob/<sha> URLs rather than data URLs. A suppressed frame
+    never reaches the store: the response has "blob": null and the URL of the
+    kept frame it matched.
+    """
+    if _too_large(blob_store.MAX_BYTES):
+        return _upload_too_large()
+    stream, meta = _upload_source()
+    student = (meta.get("student") or "").strip()
+    kind = (meta.get("kind") or "screenshot").strip()
+    if not student or kind not in ("screenshot", "tabshot", "shot") or stream is None:
+        return jsonify({"ok": False, "error": "student, kind and a body are required"}), 400
+    if _is_guest_identity(student, meta.get("student_name", "")):
+        return jsonify({"ok": True, "stored": False})
+    try:
+        upload = blob_store.stage_stream(stream)
+    except blob_store.TooLarge:
+        return _upload_too_large()
+    try:
+        return _store_screenshot(upload, student, kind, meta)
+    finally:
+        blob_store.discard(upload)  # no-op once committed
+
+
+def _store_screenshot(upload, student, kind, meta):
+    """Place a staged screenshot; near-duplicate frames are suppressed before they reach the store."""
+    sha, size = upload.sha, upload.size
+    metrics.observe("gschool_upload_bytes", size, "Binary upload sizes", buckets=_UPLOAD_BUCKETS, kind=kind)
+    url = blob_store.url_for(sha)
+    now = int(time.time())
+
+    d = ensure_keys(load_data())
+    sf_cfg = _ensure_screenshot_filter_config(d)
+    sf_stats = d["screenshot_filter_stats"]
+    sf_on = bool(sf_cfg.get("enabled", True))
+    sf_threshold = int(sf_cfg.get("diff_threshold", 4) or 0)
+    sig = frame_signature_file(upload.path, sha) if sf_on and kind != "tabshot" else None
+    if sig:
+        sf_stats["frames"] = int(sf_stats.get("frames", 0)) + 1
+    pres = d.setdefault("presence", {}).setdefault(student, {})
+    suppressed = False
+
+    if kind == "screenshot":
+        if sig and pres.get("screenshot") and is_similar(sig, pres.get("screenshot_sig"), sf_threshold):
+            suppressed, url = True, pres["screenshot"]
+        else:
+            pres["screenshot"] = url
+            pres["screenshot_ts"] = now
+            if sig:
+                pres["screenshot_sig"] = sig
+            else:
+                pres.pop("screenshot_sig", None)
+    elif kind == "tabshot":
+        pres.setdefault("tabshots", {})[str(meta.get("tab_id"))] = url
+    else:
+        hist = d.setdefault("screenshots", {}).setdefault(student, [])
+        tab_id = meta.get("tab_id")
+        page = meta.get("url") or ""
+        prev = next((e for e in reversed(hist) if str(e.get("tabId")) == str(tab_id)), None)
+        if sig and prev and prev.get("url") == page and is_similar(sig, prev.get("sig"), sf_threshold):
+            prev["repeat_until"] = now
+            prev["repeats"] = int(prev.get("repeats", 0)) + 1
+            suppressed, url = True, prev.get("dataUrl")
+        else:
+            entry = {"ts": now, "tabId": tab_id, "dataUrl": url, "blob": sha,
+                     "title": meta.get("title") or "", "url": page}
+            if sig:
+                entry["sig"] = sig
+            hist.append(entry)
+            d["screenshots"][student] = hist[-200:]
+    if suppressed:
+        sf_stats["suppressed"] = int(sf_stats.get("suppressed", 0)) + 1
+    else:
+        blob_store.commit(upload)
+    save_data(d)
+    # A suppressed frame is not stored; url is the kept frame it matched
+    return jsonify({"ok": True, "blob": None if suppressed else sha, "url": url, "bytes": size,
+                    "suppressed": suppressed})
+
+
+@app.route("/api/blob/<sha>", methods=["GET"])
+def api_blob(sha):
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    path = blob_store.path_for(sha)
+    if not path or not os.path.exists(path):
+        return jsonify({"ok": False, "error": "not found"}), 404
+    resp = send_file(path, mimetype=blob_store.sniff_mimetype(path), conditional=True, etag=sha)
+    resp.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return resp
+
 
 @app.route("/api/presence")
 def api_presence():
@@ -1172,24 +2143,6 @@ def api_extension_toggle():
 # Policy helpers
 # =========================
 
-def _parse_hhmm(s):
-    """Minimal HH:MM parser -> (hour, minute) or (None, None)"""
-    if not s or not isinstance(s, str):
-        return (None, None)
-    parts = s.split(":")
-    if len(parts) != 2:
-        return (None, None)
-    try:
-        h = int(parts[0])
-        m = int(parts[1])
-        if 0 <= h < 24 and 0 <= m < 60:
-            return (h, m)
-    except Exception:
-        pass
-    return (None, None)
-
-
-
 def _is_policy_schedule_active(policy, now_ts=None):
     """Return True if the policy is currently active based on its schedule.
 
@@ -1199,60 +2152,21 @@ def _is_policy_schedule_active(policy, now_ts=None):
     - If start/end are missing or invalid → treat as always on.
     - If weekdays_only is True → policy is inactive on Saturday/Sunday.
     - Supports overnight windows (e.g. 22:00–06:00).
-    """
-    if not policy or not policy.get("active", True):
-        return False
-
-    sched = (policy.get("schedule") or {})
-    if not sched.get("enabled"):
-        return True  # always on when schedule is disabled
-
-    try:
-        import time as _time
-        import datetime as _dt
-    except Exception:
-        # If we cannot import time/datetime, fail open (treat as active)
-        return True
 
-    if now_ts is None:
-        now_ts = int(_time.time())
-
-    dt = _dt.datetime.fromtimestamp(now_ts)
-
-    # Weekday filter (0 = Monday, 6 = Sunday)
-    if sched.get("weekdays_only") and dt.weekday() >= 5:
-        return False
-
-    start_h, start_m = _parse_hhmm(sched.get("start") or "")
-    end_h, end_m = _parse_hhmm(sched.get("end") or "")
-
-    # If schedule fields are not set correctly, treat as always on
-    if start_h is None or end_h is None:
-        return True
+    Evaluated by the shared engine in schedules.py, which caches each
+    window's state until its next transition.
+    """
+    return schedules.policy_active(policy, now_ts)
 
-    start_min = start_h * 60 + start_m
-    end_min = end_h * 60 + end_m
-    cur_min = dt.hour * 60 + dt.minute
 
-    # If start == end → treat as "all day"
-    if start_min == end_min:
-        return True
+def _assignment_ids(v):
+    if isinstance(v, list):
+        return [str(pid) for pid in v if pid]
+    return [str(v)] if v else []
 
-    # Normal window (same day)
-    if start_min < end_min:
-        return start_min <= cur_min < end_min
 
-    # Overnight window (e.g. 22:00–06:00)
-    return cur_min >= start_min or cur_min < end_min
-def _select_active_policy(data, student_email):
-    """Determine the highest-priority policy that applies to this student.
-
-    Emails can be assigned to multiple policies. We collect all applicable
-    policy IDs and then choose the policy with the highest numeric priority
-    (where 0 is the lowest priority).
-    """
-    data = ensure_keys(data or {})
-    policies = data.get("policies", {}) or {}
+def _applicable_policy_ids(data, student_email):
+    """Policy ids assigned to this student directly or via their classes, else the default."""
     assigns = data.get("policy_assignments", {}) or {}
 
     # Normalize user assignment keys to lowercase and values to lists of IDs
@@ -1262,12 +2176,7 @@ def _select_active_policy(data, student_email):
         email = (k or "").strip().lower()
         if not email:
             continue
-        if isinstance(v, list):
-            ids = [str(pid) for pid in v if pid]
-        elif v:
-            ids = [str(v)]
-        else:
-            ids = []
+        ids = _assignment_ids(v)
         if ids:
             user_map[email] = ids
 
@@ -1277,12 +2186,7 @@ def _select_active_policy(data, student_email):
         key = (k or "").strip()
         if not key:
             continue
-        if isinstance(v, list):
-            ids = [str(pid) for pid in v if pid]
-        elif v:
-            ids = [str(v)]
-        else:
-            ids = []
+        ids = _assignment_ids(v)
         if ids:
             group_map[key] = ids
 
@@ -1294,19 +2198,26 @@ def _select_active_policy(data, student_email):
         for pid in user_map.get(student_email) or []:
             applicable_ids.add(pid)
 
-    # Class/group policies
-    for cid, cls in (data.get("classes") or {}).items():
-        try:
-            students = cls.get("students") or []
-        except Exception:
-            students = []
-        lowered = [(s or "").strip().lower() for s in students]
-        if student_email and student_email in lowered:
-            for pid in group_map.get(cid, []) or []:
-                applicable_ids.add(pid)
+    # Class/group policies – only the student's own classes, via the roster index
+    for cid in class_store.classes_for(student_email):
+        for pid in group_map.get(cid, []) or []:
+            applicable_ids.add(pid)
 
     if not applicable_ids and default_id:
         applicable_ids.add(str(default_id))
+    return applicable_ids
+
+
+def _select_active_policy(data, student_email):
+    """Determine the highest-priority policy that applies to this student.
+
+    Emails can be assigned to multiple policies. We collect all applicable
+    policy IDs and then choose the policy with the highest numeric priority
+    (where 0 is the lowest priority).
+    """
+    data = ensure_keys(data or {})
+    policies = data.get("policies", {}) or {}
+    applicable_ids = _applicable_policy_ids(data, student_email)
 
     active = []
     for pid in applicable_ids:
@@ -1378,47 +2289,132 @@ def _apply_policy_to_lists(base_allow, base_blocks, base_categories, policy):
 
 
 
-@app.route("/api/policy", methods=["POST"])
-def api_policy():
-    b = request.json or {}
-    student = (b.get("student") or "").strip()
+# =========================
+# Schedule boundaries
+# =========================
+# A /api/policy answer only changes on its own at a schedule boundary, so it
+# is sent with a max-age running up to the next one. A background timer
+# wakes at each boundary and bumps the policy version of the students whose
+# policy schedule just flipped, so nobody waits out a max-age. (Category
+# schedules are not part of policy evaluation, so they are not boundaries.)
+POLICY_MAX_AGE = int(os.environ.get("POLICY_MAX_AGE", "300") or 0)
+
+
+def _next_policy_boundary(data, policy_ids, now_ts):
+    """Earliest upcoming transition among these policies' schedules."""
+    policies = data.get("policies", {}) or {}
+    scheds = [p.get("schedule") for p in (policies.get(pid) for pid in policy_ids) if p and p.get("active", True)]
+    times = [t for t in (schedules.next_transition(sc, now_ts) for sc in scheds) if t]
+    return min(times) if times else None
+
+
+def _schedule_boundary_next(now_ts):
+    nxt = None
+    for tid in list(_tenants_ready):
+        with tenancy.activate(tid):
+            d = ensure_keys(load_data())
+            t = _next_policy_boundary(d, list(d.get("policies") or {}), now_ts)
+        if t and (nxt is None or t < nxt):
+            nxt = t
+    return nxt
+
+
+def _push_boundary_refresh(since, until):
+    """Bump policy versions for everyone affected by a schedule flip in (since, until]."""
     d = ensure_keys(load_data())
 
-    # Class config (single default class)
-    cls = (d.get("classes") or {}).get("period1", {})
+    def flipped(sched):
+        t = schedules.next_transition(sched, since)
+        return t is not None and t <= until
 
-    # Base flags
-    focus = bool(cls.get("focus_mode", False))
-    paused = bool(cls.get("paused", False))
+    pids = {pid for pid, p in (d.get("policies") or {}).items() if p.get("active", True) and flipped(p.get("schedule"))}
+    if not pids:
+        return None
 
-    # Per-student overrides
-    if student:
-        ov = (d.get("student_overrides") or {}).get(student, {}) or {}
-        focus = bool(ov.get("focus_mode", focus))
-        paused = bool(ov.get("paused", paused))
+    assigns = d.get("policy_assignments", {}) or {}
+    everyone = str(d.get("default_policy_id")) in pids
+    students = sorted({(e or "").strip().lower() for e, v in (assigns.get("users") or {}).items()
+                       if pids.intersection(_assignment_ids(v))} - {""})
+    classes = sorted({class_store.clean_id(k) for k, v in (assigns.get("groups") or {}).items()
+                      if (k or "").strip() and pids.intersection(_assignment_ids(v))})
 
-    # Per-student pending items (open_tabs etc)
-    pending = []
-    if student:
-        pending_all = d.get("pending_per_student", {}) or {}
-        pend = pending_all.get(student, []) or []
-        if pend:
-            pending = pend
-            pending_all.pop(student, None)
-            d["pending_per_student"] = pending_all
-            save_data(d)
+    if everyone:
+        policy_versions.bump()
+    else:
+        policy_versions.bump_many("student", students)
+        policy_versions.bump_many("class", classes)
+
+    summary = {"policies": sorted(pids), "all": everyone,
+               "students": [] if everyone else students, "classes": [] if everyone else classes,
+               "ts": int(until)}
+    event_bus.publish("policy_refresh", summary)
+    return summary
+
+
+def _fire_schedule_boundary(ts):
+    now = time.time()
+    for tid in list(_tenants_ready):
+        with tenancy.activate(tid):
+            _push_boundary_refresh(ts - 1, now)
+
+
+_schedule_timer = schedules.BoundaryTimer(_schedule_boundary_next, _fire_schedule_boundary,
+                                          max_sleep=POLICY_MAX_AGE or 300)
 
-    # Scene merge logic
+# =========================
+# Usage rollups
+# =========================
+# Every ROLLUP_INTERVAL_SECONDS the closed dwell intervals of each tenant are
+# tagged with their domain's category and summed into per-hour rows per
+# student and class (see rollups.py); dashboards read /api/analytics/rollup.
+ROLLUP_INTERVAL_SECONDS = int(os.environ.get("ROLLUP_INTERVAL_SECONDS", "60") or 60)
+
+
+def _rollup_tenant():
+    d = ensure_keys(load_data())
+    return rollups.ingest(d.get("history", {}), int(time.time()) - HISTORY_GAP_SECONDS,
+                          _student_class_ids, d.get("categories"))
+
+
+def _run_rollups(ts):
+    for tid in list(_tenants_ready):
+        with tenancy.activate(tid):
+            try:
+                _rollup_tenant()
+            except Exception as e:
+                print(f"[WARN] usage rollup failed for tenant {tid}:", e)
+
+
+_rollup_timer = schedules.BoundaryTimer(lambda now: now + ROLLUP_INTERVAL_SECONDS, _run_rollups,
+                                        max_sleep=ROLLUP_INTERVAL_SECONDS, name="gschool-usage-rollup")
+
+@app.route("/api/policy/version", methods=["GET"])
+def api_policy_version():
+    """The student's current policy version; re-fetch /api/policy only when it changed."""
+    student = (request.args.get("student") or "").strip()
+    return jsonify({"ok": True, "policy_version": _policy_version(student, request.args.get("class_id"))})
+
+
+def _policy_shards(student, class_id=None):
+    """
+    The class shards a student's policy is built from: only their own classes
+    (or an explicit class_id). A student in several classes gets the union of
+    the active ones.
+    """
+    class_ids = [class_store.clean_id(class_id)] if class_id else _student_class_ids(student)
+    shards = [class_store.get(cid) for cid in class_ids]
+    return [c for c in shards if c.get("active", True)] or shards
+
+
+def _scene_lists(d, student, shards):
+    """
+    Class lists merged with the current scenes (class-wide and per-student):
+    (allowlist, teacher_blocks, current scenes, whether an allowed scene forces focus).
+    """
     store = _load_scenes()
-    current_raw = store.get("current") or []
 
-    # Global scenes applied to the whole class
-    if isinstance(current_raw, dict):
-        base_current = [current_raw]
-    elif isinstance(current_raw, list):
-        base_current = [c for c in current_raw if c]
-    else:
-        base_current = []
+    # Class-wide scenes from the student's class shards
+    base_current = [c for shard in shards for c in (shard.get("scenes_current") or []) if c]
 
     # Optional per‑student scenes stored in data.json
     student_scenes_map = d.get("student_scenes") or {}
@@ -1451,13 +2447,13 @@ def api_policy():
             combined.append(c)
 
     current_list = combined
+    scene_focus = False
 
     # Start with class-level lists
-    allowlist = list(cls.get("allowlist", []))
-    teacher_blocks = list(cls.get("teacher_blocks", []))
-    categories = d.get("categories", {}) or {}
+    allowlist = [url for shard in shards for url in (shard.get("allowlist") or [])]
+    teacher_blocks = [url for shard in shards for url in (shard.get("teacher_blocks") or [])]
 
-    if current_list:
+    if current_list or len(shards) > 1:
         scene_index = {}
         for bucket in ("allowed", "blocked"):
             for s in store.get(bucket, []) or []:
@@ -1471,7 +2467,7 @@ def api_policy():
                 continue
             if scene_obj.get("type") == "allowed":
                 allowlist = list(allowlist) + list(scene_obj.get("allow", []))
-                focus = True
+                scene_focus = True
             elif scene_obj.get("type") == "blocked":
                 teacher_blocks = list(teacher_blocks) + list(scene_obj.get("block", []))
 
@@ -1484,13 +2480,49 @@ def api_policy():
                 dedup_allow.append(url)
         allowlist = dedup_allow
 
-        seen = set()
-        dedup_blocks = []
-        for url in teacher_blocks:
-            if url not in seen:
-                seen.add(url)
-                dedup_blocks.append(url)
-        teacher_blocks = dedup_blocks
+        seen = set()
+        dedup_blocks = []
+        for url in teacher_blocks:
+            if url not in seen:
+                seen.add(url)
+                dedup_blocks.append(url)
+        teacher_blocks = dedup_blocks
+
+    return allowlist, teacher_blocks, current_list, scene_focus
+
+
+@app.route("/api/policy", methods=["POST"])
+def api_policy():
+    b = request.json or {}
+    student = (b.get("student") or "").strip()
+    d = ensure_keys(load_data())
+
+    shards = _policy_shards(student, b.get("class_id"))
+    cls = shards[0]
+
+    # Base flags
+    focus = any(bool(c.get("focus_mode", False)) for c in shards)
+    paused = any(bool(c.get("paused", False)) for c in shards)
+
+    # Per-student overrides
+    if student:
+        ov = (d.get("student_overrides") or {}).get(student, {}) or {}
+        focus = bool(ov.get("focus_mode", focus))
+        paused = bool(ov.get("paused", paused))
+
+    # Per-student pending items (open_tabs etc)
+    pending = []
+    if student:
+        pending_all = d.get("pending_per_student", {}) or {}
+        pend = pending_all.get(student, []) or []
+        if pend:
+            pending = pend
+            pending_all.pop(student, None)
+            d["pending_per_student"] = pending_all
+            save_data(d)
+
+    allowlist, teacher_blocks, current_list, scene_focus = _scene_lists(d, student, shards)
+    focus = focus or scene_focus
 
     # Which policy applies?
     active_policy = _select_active_policy(d, student)
@@ -1518,7 +2550,7 @@ def api_policy():
         "paused": bool(paused),
         "announcement": d.get("announcements", ""),
         "class": {
-            "id": "period1",
+            "id": cls.get("id"),
             "name": cls.get("name", "Period 1"),
             "active": bool(cls.get("active", True)),
         },
@@ -1531,7 +2563,20 @@ def api_policy():
         "bypass_enabled": bool(d.get("settings", {}).get("bypass_enabled", False)),
         "bypass_ttl_minutes": int(d.get("settings", {}).get("bypass_ttl_minutes", 10)),
     }
-    return jsonify(resp)
+
+    # Cacheable until the next schedule boundary that can change this answer
+    # (capped; one-shot pending items are never cached).
+    now = resp["ts"]
+    boundary = _next_policy_boundary(d, _applicable_policy_ids(d, student), now)
+    resp["next_transition"] = boundary
+    resp["policy_version"] = _policy_version(student, b.get("class_id"))
+    out = jsonify(resp)
+    max_age = POLICY_MAX_AGE if boundary is None else min(POLICY_MAX_AGE, max(0, boundary - now))
+    if pending or not max_age:
+        out.headers["Cache-Control"] = "no-store"
+    else:
+        out.headers["Cache-Control"] = f"private, max-age={max_age}"
+    return out
 
 
 @app.route("/api/bypass", methods=["POST"])
@@ -1598,6 +2643,8 @@ def api_policies():
                 assigns[k] = {k2: v2 for k2, v2 in mp.items() if v2 != pid}
             d["policy_assignments"] = assigns
             save_data(d)
+            policy_versions.bump()
+            _schedule_timer.poke()
         return jsonify({"ok": True})
 
     pid = (body.get("id") or "").strip()
@@ -1630,6 +2677,8 @@ def api_policies():
         d["default_policy_id"] = body.get("default_policy_id")
 
     save_data(d)
+    policy_versions.bump()
+    _schedule_timer.poke()
     return jsonify({"ok": True, "id": pid, "policy": policies[pid]})
 
 
@@ -1720,11 +2769,18 @@ def api_policy_assignments():
 
     d["policy_assignments"] = assigns
     save_data(d)
+    policy_versions.bump()
+    _schedule_timer.poke()
     return jsonify({"ok": True, "policy_assignments": assigns, "default_policy_id": d.get("default_policy_id")})
 
 
 @app.route("/api/timeline", methods=["GET"])
 def api_timeline():
+    """
+    Browsing timeline. Default: the legacy point rows (one per 15 s of dwell).
+    mode=intervals: dwell intervals {ts, end, duration, url, title, ...}
+    overlapping `since`, oldest first for one student, newest first otherwise.
+    """
     u = current_user()
     if not u or u["role"] not in ("teacher", "admin"):
         return jsonify({"ok": False, "error": "forbidden"}), 403
@@ -1732,17 +2788,123 @@ def api_timeline():
     student = (request.args.get("student") or "").strip()
     limit = max(1, min(int(request.args.get("limit", 200)), 1000))
     since = int(request.args.get("since", 0))
-    out = []
+    intervals = request.args.get("mode") == "intervals"
+
+    # Rows are generated lazily and only the `limit` that are returned get built:
+    # one student's newest, or the oldest across everyone (kept newest first).
+    def rows(arr, who=None, newest_first=False):
+        for e in (reversed(arr or []) if newest_first else arr or []):
+            if _interval_end(e) < since:
+                continue
+            extra = {"student": who} if who else {}
+            if intervals:
+                yield dict(e, end=_interval_end(e), duration=_interval_end(e) - int(e.get("ts") or 0), **extra)
+            else:
+                for p in _interval_points(e, since, newest_first):
+                    yield dict(p, **extra)
+
     if student:
-        out = [e for e in d.get("history", {}).get(student, []) if e.get("ts", 0) >= since]
-        out.sort(key=lambda x: x.get("ts", 0))
+        out = list(itertools.islice(rows(d.get("history", {}).get(student, []), newest_first=True), limit))
+        out.reverse()
     else:
-        for s, arr in (d.get("history", {}) or {}).items():
-            for e in arr:
-                if e.get("ts", 0) >= since:
-                    out.append(dict(e, student=s))
-        out.sort(key=lambda x: x.get("ts", 0), reverse=True)
-    return jsonify({"ok": True, "items": out[-limit:]})
+        # Ties on ts keep the order of history, as a stable newest-first sort would
+        def keyed(i, arr, who):
+            for r in rows(arr, who):
+                yield (int(r.get("ts") or 0), -i), r
+
+        streams = [keyed(i, arr, s) for i, (s, arr) in enumerate((d.get("history", {}) or {}).items())]
+        out = [r for _, r in itertools.islice(heapq.merge(*streams, key=lambda kr: kr[0]), limit)]
+        out.reverse()
+    return jsonify({"ok": True, "mode": "intervals" if intervals else "points", "items": out})
+
+@app.route("/api/analytics/usage", methods=["GET"])
+def api_analytics_usage():
+    """
+    Time on site per domain, category and student for [since, until) (epoch
+    seconds; default the last 7 days). Optional student= or class_id= narrow
+    the population; limit= caps each ranking (default 50).
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    now = int(time.time())
+    try:
+        until = int(request.args.get("until") or now)
+        since = int(request.args.get("since") or until - 7 * 86400)
+        limit = max(1, min(int(request.args.get("limit", 50)), 1000))
+    except ValueError:
+        return jsonify({"ok": False, "error": "since, until and limit must be integers"}), 400
+    if since >= until:
+        return jsonify({"ok": False, "error": "since must be before until"}), 400
+
+    students = None
+    student = (request.args.get("student") or "").strip()
+    cid = (request.args.get("class_id") or "").strip()
+    if student:
+        students = [student]
+    elif cid:
+        cid = class_store.clean_id(cid)
+        if not class_store.exists(cid):
+            return jsonify({"ok": False, "error": "unknown class"}), 404
+        students = class_store.get(cid).get("students") or []
+
+    d = ensure_keys(load_data())
+    iv = analytics.load(rollups.rows_after, rollups.first_rowid(),
+                        functools.partial(rollups.unrolled, d.get("history", {})))
+    out = analytics.usage(iv, since, until, students=students, categories=d.get("categories"), top=limit,
+                          known=rollups.verdicts(), known_rev=rollups.revision())
+    return jsonify(dict(out, ok=True))
+
+
+@app.route("/api/analytics/rollup", methods=["GET"])
+def api_analytics_rollup():
+    """
+    Minutes per category from the precomputed hourly rollups.
+    student= or class_id= picks one key; otherwise scope=class|student lists
+    every key. hourly=1 adds the per-hour rows; refresh=1 (admin) rolls up
+    newly closed intervals first.
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    now = int(time.time())
+    try:
+        until = int(request.args.get("until") or now)
+        since = int(request.args.get("since") or until - 7 * 86400)
+    except ValueError:
+        return jsonify({"ok": False, "error": "since and until must be integers"}), 400
+
+    student = (request.args.get("student") or "").strip()
+    cid = (request.args.get("class_id") or "").strip()
+    if student:
+        scope, keys = "student", [student]
+    elif cid:
+        scope, keys = "class", [class_store.clean_id(cid)]
+    else:
+        scope, keys = request.args.get("scope") or "class", None
+        if scope not in rollups.SCOPES:
+            return jsonify({"ok": False, "error": "scope must be class or student"}), 400
+
+    if request.args.get("refresh") and u["role"] == "admin":
+        _rollup_tenant()
+
+    rows = rollups.query(scope, keys, since, until)
+    totals = {}
+    for r in rows:
+        totals[r["category"]] = totals.get(r["category"], 0) + r["seconds"]
+    out = {
+        "ok": True,
+        "scope": scope,
+        "since": since,
+        "until": until,
+        "by_category": [{"category": c, "seconds": v, "minutes": round(v / 60.0, 2)}
+                        for c, v in sorted(totals.items(), key=lambda kv: -kv[1])],
+        "rows": rows,
+        "rollup": rollups.state(),
+    }
+    if request.args.get("hourly"):
+        out["by_hour"] = rollups.query(scope, keys, since, until, by_hour=True)
+    return jsonify(out)
 
 @app.route("/api/screenshots", methods=["GET"])
 def api_screenshots():
@@ -1767,6 +2929,166 @@ def api_screenshots():
     return jsonify({"ok": True, "items": items[-limit:]})
 
 
+@app.route("/api/screenshot_filter", methods=["GET", "POST"])
+def api_screenshot_filter():
+    """
+    GET: current frame-suppression config plus suppression statistics.
+    POST: admin only – update `enabled` / `diff_threshold` or reset stats.
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    d = ensure_keys(load_data())
+    cfg = _ensure_screenshot_filter_config(d)
+
+    if request.method == "GET":
+        return jsonify(dict(_screenshot_filter_report(d), ok=True))
+
+    if u["role"] != "admin":
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    body = request.json or {}
+    if "enabled" in body:
+        cfg["enabled"] = bool(body["enabled"])
+    if "diff_threshold" in body:
+        try:
+            cfg["diff_threshold"] = max(0, min(32, int(body["diff_threshold"])))
+        except Exception:
+            pass
+    if body.get("reset_stats"):
+        d["screenshot_filter_stats"] = {"frames": 0, "suppressed": 0}
+
+    save_data(d)
+    log_action({"event": "screenshot_filter_update", "config": cfg})
+    return jsonify(dict(_screenshot_filter_report(d), ok=True))
+
+
+# =========================
+# Audit log
+# =========================
+@app.route("/api/audit", methods=["GET"])
+def api_audit():
+    """
+    Admin: query the audit log, newest first.
+    Params: event, user (actor or subject email), since / until (unix seconds),
+            before (id cursor from a previous page), limit (≤1000, default 200).
+    """
+    u = current_user()
+    if not u or u["role"] != "admin":
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    try:
+        since = int(request.args.get("since") or 0)
+        until = int(request.args.get("until") or 0)
+        before = int(request.args.get("before") or 0)
+        limit = max(1, min(int(request.args.get("limit", 200)), 1000))
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad number"}), 400
+    # Include entries still sitting in the writer queue (e.g. the caller's own last action).
+    audit_log.flush(timeout=1.0)
+    items = audit_log.query(event=request.args.get("event") or None, user=request.args.get("user") or None,
+                            since=since or None, until=until or None, before_id=before or None, limit=limit)
+    next_cursor = str(items[-1]["id"]) if len(items) == limit else None
+    return jsonify({"ok": True, "items": items, "next_cursor": next_cursor})
+
+
+# =========================
+# Search
+# =========================
+@app.route("/api/search", methods=["GET"])
+def api_search():
+    """
+    Ranked full-text search (see search.py). Params: q, sources (comma list
+    of timeline, dm, chat; default timeline), student, since / until (unix
+    seconds), domain (timeline only), offset, limit (≤200, default 50).
+    Timeline rows become searchable once their interval closes and the
+    rollup job stores it. Timeline pages must end within the newest
+    search.CANDIDATES matches; "truncated" is set when older ones exist.
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "q required"}), 400
+    sources = [s.strip() for s in (request.args.get("sources") or "timeline").split(",") if s.strip()]
+    if not sources or any(s not in search.SOURCES for s in sources):
+        return jsonify({"ok": False, "error": "sources must be timeline, dm and/or chat"}), 400
+    try:
+        since = int(request.args.get("since") or 0)
+        until = int(request.args.get("until") or 0)
+        offset = max(0, int(request.args.get("offset") or 0))
+        limit = max(1, min(int(request.args.get("limit", 50)), 200))
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad number"}), 400
+    student = (request.args.get("student") or "").strip()
+    try:
+        with metrics.timed("gschool_search_seconds", "Time spent in full-text search queries"):
+            out = search.search(q, sources, student=student, since=since, until=until,
+                                domain=request.args.get("domain"), offset=offset, limit=limit)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    log_action({"event": "search", "q": q, "sources": sources, "student": student or None})
+    return jsonify(dict(out, ok=True, q=q, sources=sources))
+
+
+# =========================
+# Streaming exports
+# =========================
+@app.route("/api/export/<kind>", methods=["GET"])
+def api_export(kind):
+    """
+    Stream history, alerts or audit rows as NDJSON (default) or CSV; see exports.py.
+    Params: format, since / until (unix seconds), student, cursor (resume
+    after that row), limit (rows in this response, 0 = no limit) and
+    domain (history), kind (alerts), event / user (audit).
+    Teachers may export history and alerts; the audit log is admin only.
+    """
+    u = current_user()
+    if kind not in exports.KINDS:
+        return jsonify({"ok": False, "error": "unknown export"}), 404
+    if not u or u["role"] not in (("admin",) if kind == "audit" else ("teacher", "admin")):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    fmt = (request.args.get("format") or "ndjson").lower()
+    if fmt not in exports.FORMATS:
+        return jsonify({"ok": False, "error": "format must be ndjson or csv"}), 400
+    cursor = request.args.get("cursor") or None
+    try:
+        since = int(request.args.get("since") or 0)
+        until = int(request.args.get("until") or 0)
+        limit = max(0, int(request.args.get("limit") or 0))
+        after = exports.parse_cursor(kind, cursor)
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad number or cursor"}), 400
+    student = (request.args.get("student") or "").strip()
+
+    # Open the source now, while the request's tenant is current; rows are
+    # only pulled from it as the response is written.
+    if kind == "history":
+        d = ensure_keys(load_data())
+        domain = (request.args.get("domain") or "").strip()
+        rows = exports.history_rows(
+            rollups.iter_intervals(since, until, student, domain, after=after),
+            rollups.unrolled(d.get("history", {})), cursor, since, until, student, domain)
+    elif kind == "alerts":
+        d = ensure_keys(load_data())
+        rows = exports.alert_rows(d.get("alerts", []), cursor, since, until, student,
+                                  request.args.get("kind") or None)
+    else:
+        audit_log.flush(timeout=1.0)
+        rows = exports.audit_rows(audit_log.iter_rows(
+            event=request.args.get("event") or None, user=request.args.get("user") or student or None,
+            since=since or None, until=until or None, after_id=after[0] if after else None))
+
+    log_action({"event": "export", "kind": kind, "format": fmt, "student": student or None, "cursor": cursor})
+    body = exports.encode(rows, fmt, exports.COLUMNS[kind], cursor=cursor, limit=limit)
+    resp = Response(stream_with_context(body), mimetype=exports.FORMATS[fmt])
+    resp.headers["Content-Disposition"] = f'attachment; filename="{kind}-{since}-{until or "now"}.{fmt}"'
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
 # =========================
 # Alerts (Off-task)
 # =========================
@@ -1786,6 +3108,7 @@ def api_alerts():
             "score": float(b.get("score") or 0.0),
             "title": (b.get("title") or ""),
             "url": (b.get("url") or ""),
+            "domain": domains.domain_of(b.get("url") or ""),
             "note": (b.get("note") or "")
         }
         d.setdefault("alerts", []).append(item)
@@ -1846,7 +3169,7 @@ def api_engagement():
 
     students = set(presence.keys())
     for student, arr in history.items():
-        if any((e.get("ts") or 0) >= since for e in (arr or [])):
+        if any(_interval_end(e) >= since for e in (arr or [])):
             students.add(student)
 
     results = []
@@ -1854,8 +3177,8 @@ def api_engagement():
         if not student:
             continue
 
-        hist = [e for e in (history.get(student) or []) if (e.get("ts") or 0) >= since]
-        total_events = len(hist)
+        # Page-view samples in the window (15 s of dwell each, as heartbeats used to log them)
+        total_events = sum(_interval_samples(e, since) for e in (history.get(student) or []))
 
         student_off = [
             e for e in off_events
@@ -1899,7 +3222,10 @@ def api_engagement():
 # =========================
 @app.route("/api/scenes", methods=["GET"])
 def api_scenes_list():
-    return jsonify(_load_scenes())
+    """Scene library plus the class's current scenes (?class_id=, default class otherwise)."""
+    store = _load_scenes()
+    store["current"] = class_store.get(_class_id_arg()).get("scenes_current") or []
+    return jsonify(store)
 
 @app.route("/api/scenes", methods=["POST"])
 def api_scenes_create():
@@ -1948,17 +3274,15 @@ def api_scenes_delete(sid):
     for bucket in ("allowed", "blocked"):
         scenes[bucket] = [s for s in scenes.get(bucket, []) if s.get("id") != sid]
 
-    cur = scenes.get("current") or []
-    if isinstance(cur, dict):
-        cur_list = [cur]
-    elif isinstance(cur, list):
-        cur_list = [c for c in cur if c]
-    else:
-        cur_list = []
-
-    cur_list = [c for c in cur_list if str(c.get("id")) != str(sid)]
-    scenes["current"] = cur_list
     _save_scenes(scenes)
+
+    # Drop the deleted scene from any class that has it applied
+    def drop(c):
+        c["scenes_current"] = [x for x in (c.get("scenes_current") or []) if str(x.get("id")) != str(sid)]
+
+    for cid in class_store.list_ids():
+        if any(str(x.get("id")) == str(sid) for x in (class_store.get(cid).get("scenes_current") or [])):
+            class_store.update(cid, drop)
     log_action({"event": "scene_delete", "id": sid})
     return jsonify({"ok": True})
 
@@ -2012,6 +3336,7 @@ def api_scenes_apply():
       - replace: bool – if true, replaces current scenes instead of appending.
       - students: optional list of student emails – if present, the scene is applied
                   only to those students; otherwise it's applied class‑wide.
+      - class_id: class to apply to (default class when omitted).
     """
     u = current_user()
     if not u or u["role"] not in ("teacher", "admin"):
@@ -2022,21 +3347,22 @@ def api_scenes_apply():
     disable = bool(body.get("disable", False))
     replace_mode = bool(body.get("replace", False))
 
+    cid = _class_id_arg(body)
     store = _load_scenes()
 
-    # Disable all scenes – clear both global and per‑student assignment.
+    # Disable all scenes – clear both class and per‑student assignment.
     if disable:
-        store["current"] = []
-        _save_scenes(store)
+        def clear(c):
+            c["scenes_current"] = []
+
+        class_store.update(cid, clear)
 
         d = ensure_keys(load_data())
         # Clear per‑student scene assignments as well
         d["student_scenes"] = {}
-        d.setdefault("pending_commands", {}).setdefault("*", []).append(
-            {"type": "policy_refresh"}
-        )
         save_data(d)
-        log_action({"event": "scene_disabled"})
+        policy_versions.bump()
+        log_action({"event": "scene_disabled", "class_id": cid})
         return jsonify({"ok": True, "current": []})
 
     if not sid:
@@ -2065,9 +3391,8 @@ def api_scenes_apply():
         students = [students]
     students = [s for s in students if s]
 
-    d = ensure_keys(load_data())
-
     if students:
+        d = ensure_keys(load_data())
         # Apply only to specific students – store in data.json so /api/policy can merge.
         student_scenes = d.setdefault("student_scenes", {})
 
@@ -2082,57 +3407,44 @@ def api_scenes_apply():
                     cur_list.append(found)
             student_scenes[stu] = cur_list
 
-            # Push a per‑student policy refresh so the extension re‑loads policy.
-            d.setdefault("pending_per_student", {}).setdefault(stu, []).append(
-                {"type": "policy_refresh"}
-            )
-
         save_data(d)
+        # Per‑student policy refresh so those extensions re‑load policy.
+        policy_versions.bump_many("student", students)
         log_action(
             {"event": "scene_applied_students", "scene": found, "students": students}
         )
-        # For teacher UI we still return the global "current" list.
-        return jsonify({"ok": True, "current": store.get("current") or []})
-
-    # No explicit students → class‑wide behaviour (existing behaviour).
-    current_raw = store.get("current") or []
-    if isinstance(current_raw, dict):
-        current_list = [current_raw]
-    elif isinstance(current_raw, list):
-        current_list = [c for c in current_raw if c]
-    else:
-        current_list = []
-
-    if replace_mode:
-        current_list = [found]
-    else:
-        existing_ids = {str(c.get("id")) for c in current_list}
-        if str(found.get("id")) not in existing_ids:
-            current_list.append(found)
-
-    store["current"] = current_list
-    _save_scenes(store)
+        # For teacher UI we still return the class "current" list.
+        return jsonify({"ok": True, "current": class_store.get(cid).get("scenes_current") or []})
+
+    # No explicit students → class‑wide behaviour, stored in the class shard.
+    def apply(c):
+        current_list = [x for x in (c.get("scenes_current") or []) if x]
+        if replace_mode:
+            current_list = [found]
+        else:
+            existing_ids = {str(x.get("id")) for x in current_list}
+            if str(found.get("id")) not in existing_ids:
+                current_list.append(found)
+        c["scenes_current"] = current_list
 
+    cls = class_store.update(cid, apply)
     # class‑wide policy refresh
-    d.setdefault("pending_commands", {}).setdefault("*", []).append(
-        {"type": "policy_refresh"}
-    )
-    save_data(d)
+    policy_versions.bump("class", cid)
 
-    log_action({"event": "scene_applied", "scene": found})
-    return jsonify({"ok": True, "current": current_list})
+    log_action({"event": "scene_applied", "scene": found, "class_id": cid})
+    return jsonify({"ok": True, "current": cls["scenes_current"]})
 
 @app.route("/api/scenes/clear", methods=["POST"])
 @app.route("/api/scenes/clear", methods=["POST"])
 def api_scenes_clear():
-    scenes = _load_scenes()
-    scenes["current"] = []
-    _save_scenes(scenes)
-    log_action({"event": "scene_clear"})
+    cid = _class_id_arg(request.get_json(silent=True))
 
-    d = ensure_keys(load_data())
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({"type": "policy_refresh"})
-    save_data(d)
+    def clear(c):
+        c["scenes_current"] = []
+
+    class_store.update(cid, clear)
+    policy_versions.bump("class", cid)
+    log_action({"event": "scene_clear", "class_id": cid})
     return jsonify({"ok": True})
 
 @app.route("/api/scenes/set_default", methods=["POST"])
@@ -2197,13 +3509,26 @@ def api_dm_send():
     else:
         return jsonify({"ok": False, "error": "forbidden"}), 403
 
-    con = db(); cur = con.cursor()
-    cur.execute(
-        "INSERT INTO chat_messages(room,user_id,role,text,ts) VALUES(?,?,?,?,?)",
-        (room, user_id, role, text, int(time.time())),
-    )
-    con.commit(); con.close()
-    return jsonify({"ok": True})
+    msg = chat_store.send_dm(room[len("dm:"):], user_id, role, text)
+    return jsonify({"ok": True, "id": msg["id"]})
+
+
+def _dm_page_args():
+    """(after_id, limit) from ?since=<id> / ?after=<id> and ?limit= (max 500)."""
+    try:
+        after_id = int(request.args.get("since") or request.args.get("after") or 0)
+    except Exception:
+        after_id = 0
+    try:
+        limit = max(1, min(int(request.args.get("limit", 200)), 500))
+    except Exception:
+        limit = 200
+    return after_id, limit
+
+
+def _dm_out(m):
+    # DM timestamps are reported in seconds, chat_store keeps milliseconds
+    return {"id": m["id"], "from": m["role"], "user": m["user_id"], "text": m["text"], "ts": m["ts"] // 1000}
 
 @app.route("/api/dm/me", methods=["GET"])
 def api_dm_me():
@@ -2218,39 +3543,33 @@ def api_dm_me():
     if not student:
         return jsonify({"ok": False, "error": "forbidden"}), 403
 
-    con = db(); cur = con.cursor()
-    cur.execute("SELECT user_id,role,text,ts FROM chat_messages WHERE room=? ORDER BY ts ASC", (f"dm:{student}",))
-    msgs = [{"from": r[1], "user": r[0], "text": r[2], "ts": r[3]} for r in cur.fetchall()]
-    con.close()
-    return jsonify(msgs)
+    # Newest page by default; ?since=<id> pages forward. The body stays a
+    # plain list for existing clients, the next cursor goes in a header.
+    after_id, limit = _dm_page_args()
+    msgs = [_dm_out(m) for m in chat_store.dm_history(student, after_id, limit)]
+    resp = jsonify(msgs)
+    resp.headers["X-DM-Cursor"] = str(msgs[-1]["id"] if msgs else after_id)
+    return resp
 
 @app.route("/api/dm/<student>", methods=["GET"])
 def api_dm_get(student):
     u = current_user()
     if not u:
         return jsonify({"ok": False, "error": "forbidden"}), 403
-    d = ensure_keys(load_data())
-    msgs = d.get("dm", {}).get(student, [])[-200:]
-    return jsonify({"messages": msgs})
+    after_id, limit = _dm_page_args()
+    msgs = [_dm_out(m) for m in chat_store.dm_history(student, after_id, limit)]
+    return jsonify({"messages": msgs, "cursor": msgs[-1]["id"] if msgs else after_id})
 
 @app.route("/api/dm/unread", methods=["GET"])
 def api_dm_unread():
-    d = ensure_keys(load_data())
-    out = {}
-    for student, msgs in d.get("dm", {}).items():
-        out[student] = sum(1 for m in msgs if m.get("from") == "student" and m.get("unread", True))
-    return jsonify(out)
+    return jsonify(chat_store.dm_unread_summary())
 
 @app.route("/api/dm/mark_read", methods=["POST"])
 def api_dm_mark_read():
     body = request.json or {}
     student = body.get("student")
-    d = ensure_keys(load_data())
-    if student in d.get("dm", {}):
-        for m in d["dm"][student]:
-            if m.get("from") == "student":
-                m["unread"] = False
-        save_data(d)
+    if student:
+        chat_store.mark_dm_read(student)
     return jsonify({"ok": True})
 
 
@@ -2262,37 +3581,58 @@ def api_attention_check():
     body = request.json or {}
     title = body.get("title", "Are you paying attention?")
     timeout = int(body.get("timeout", 30))
+    now = int(time.time())
+    check_id = "att_" + str(int(time.time() * 1000))
 
     d = ensure_keys(load_data())
-    d["attention_check"] = {"title": title, "timeout": timeout, "ts": int(time.time()), "responses": {}}
+    d["attention_check"] = {"id": check_id, "title": title, "timeout": timeout, "ts": now}
+    live_tally.open_check("attention", check_id, {"title": title, "timeout": timeout}, started=now)
 
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
+    _queue_command(d, "*", {
         "type": "attention_check",
         "title": title,
         "timeout": timeout
     })
     save_data(d)
     log_action({"event": "attention_check_start", "title": title})
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "id": check_id})
 
 @app.route("/api/attention_response", methods=["POST"])
 def api_attention_response():
+    """O(1): updates the live aggregator and one SQLite row, never data.json."""
     b = request.json or {}
     student = (b.get("student") or "").strip()
     response = b.get("response", "")
-    d = ensure_keys(load_data())
-    check = d.get("attention_check")
-    if not check:
+    agg = live_tally.current("attention")
+    if not agg:
         return jsonify({"ok": False, "error": "no active check"}), 400
-    check["responses"][student] = {"response": response, "ts": int(time.time())}
-    save_data(d)
-    log_action({"event": "attention_response", "student": student, "response": response})
+    now = int(time.time())
+    summary = live_tally.record("attention", agg.ref_id, student, response, now)
+    summary["last"] = {"student": student, "response": response, "ts": now}
+    event_bus.publish("attention", summary)
     return jsonify({"ok": True})
 
 @app.route("/api/attention_results")
 def api_attention_results():
-    d = ensure_keys(load_data())
-    return jsonify(d.get("attention_check", {}))
+    """
+    Current attention check: running summary (tally, respondent count,
+    latency histogram) plus the respondent set. ?responses=0 omits the set.
+    """
+    agg = live_tally.current("attention")
+    if not agg:
+        return jsonify({})
+    out = {
+        "id": agg.ref_id,
+        "title": agg.meta.get("title"),
+        "timeout": agg.meta.get("timeout"),
+        "ts": agg.started,
+        "summary": agg.summary(),
+    }
+    if request.args.get("responses", "1") != "0":
+        out["responses"] = {
+            s: {"response": r["answer"], "ts": r["ts"]} for s, r in agg.responses().items()
+        }
+    return jsonify(out)
 
 
 # =========================
@@ -2314,6 +3654,7 @@ def api_student_set():
     if "paused" in b:
         ov["paused"] = bool(b.get("paused"))
     save_data(d)
+    policy_versions.bump("student", student)
     log_action({"event": "student_set", "student": student, "focus_mode": ov.get("focus_mode"), "paused": ov.get("paused")})
     return jsonify({"ok": True, "overrides": ov})
 
@@ -2334,9 +3675,12 @@ def api_open_tabs_alias():
         arr[:] = arr[-50:]
         log_action({"event": "student_tabs", "student": student, "type": "open_tabs", "count": len(urls)})
     else:
-        d["pending_commands"].setdefault("*", []).append({"type": "open_tabs", "urls": urls, "ts": int(time.time())})
+        _queue_command(d, "*", {"type": "open_tabs", "urls": urls, "ts": int(time.time())})
         log_action({"event": "class_tabs", "target": "*", "type": "open_tabs", "count": len(urls)})
     save_data(d)
+    if student:
+        # pending_per_student items ride on the next /api/policy response
+        policy_versions.bump("student", student)
     return jsonify({"ok": True})
 
 @app.route("/api/student/tabs_action", methods=["POST"])
@@ -2355,6 +3699,7 @@ def api_student_tabs_action():
     arr.append({"type": action, "ts": int(time.time())})
     arr[:] = arr[-50:]
     save_data(d)
+    policy_versions.bump("student", student)
     log_action({"event": "student_tabs", "student": student, "type": action})
     return jsonify({"ok": True})
 
@@ -2364,19 +3709,24 @@ def api_student_tabs_action():
 # =========================
 @app.route("/api/chat/<class_id>", methods=["GET", "POST"])
 def api_chat(class_id):
-    d = ensure_keys(load_data())
-    d.setdefault("chat", {}).setdefault(class_id, [])
+    cid = class_store.clean_id(class_id)
+    if not class_store.exists(cid) and cid != class_store.DEFAULT_CLASS_ID:
+        return jsonify({"ok": False, "error": "unknown class"}), 404
     if request.method == "POST":
         b = request.json or {}
         txt = (b.get("text") or "")[:500]
         sender = b.get("from") or "student"
         if not txt:
             return jsonify({"ok": False, "error": "empty"}), 400
-        d["chat"][class_id].append({"from": sender, "text": txt, "ts": int(time.time())})
-        d["chat"][class_id] = d["chat"][class_id][-200:]
-        save_data(d)
+
+        def post(c):
+            c["chat"] = (c.get("chat") or [])[-199:] + [{"from": sender, "text": txt, "ts": int(time.time())}]
+
+        class_store.update(cid, post)
         return jsonify({"ok": True})
-    return jsonify({"enabled": d.get("settings", {}).get("chat_enabled", False), "messages": d["chat"][class_id][-100:]})
+    d = ensure_keys(load_data())
+    return jsonify({"enabled": d.get("settings", {}).get("chat_enabled", False),
+                    "messages": (class_store.get(cid).get("chat") or [])[-100:]})
 
 
 # =========================
@@ -2429,7 +3779,7 @@ def api_youtube_rules():
 
         # Broadcast an update command to all present students
         d = ensure_keys(load_data())
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({
+        _queue_command(d, "*", {
             "type": "update_youtube_rules",
             "rules": {
                 "block_keywords": body.get("block_keywords", []),
@@ -2439,6 +3789,7 @@ def api_youtube_rules():
             }
         })
         save_data(d)
+        policy_versions.bump("config", "youtube_rules")
 
         log_action({"event": "youtube_rules_update"})
         return jsonify({"ok": True})
@@ -2457,6 +3808,7 @@ def api_doodle_block():
         body = request.json or {}
         enabled = bool(body.get("enabled", False))
         set_setting("block_google_doodles", enabled)
+        policy_versions.bump("config", "doodle_block")
         log_action({"event": "doodle_block_update", "enabled": enabled})
         return jsonify({"ok": True, "enabled": enabled})
     return jsonify({"enabled": bool(get_setting("block_google_doodles", False))})
@@ -2482,13 +3834,10 @@ def api_save_overrides():
     b = request.json or {}
     d["allowlist"] = b.get("allowlist", [])
     d["teacher_blocks"] = b.get("teacher_blocks", [])
+    save_data(d)
 
     # Policy changed → force refresh for all students
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
-        "type": "policy_refresh"
-    })
-
-    save_data(d)
+    policy_versions.bump()
     log_action({"event": "overrides_save"})
     return jsonify({"ok": True})
 
@@ -2508,8 +3857,10 @@ def api_poll():
         return jsonify({"ok": False, "error": "question and options required"}), 400
     poll_id = "poll_" + str(int(time.time() * 1000))
     d = ensure_keys(load_data())
-    d.setdefault("polls", {})[poll_id] = {"question": q, "options": opts, "responses": []}
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
+    # Responses are aggregated by live_tally; data.json only keeps the definition
+    d.setdefault("polls", {})[poll_id] = {"question": q, "options": opts, "ts": int(time.time())}
+    live_tally.open_check("poll", poll_id, {"question": q, "options": opts})
+    _queue_command(d, "*", {
         "type": "poll", "id": poll_id, "question": q, "options": opts
     })
     save_data(d)
@@ -2524,24 +3875,88 @@ def api_poll_response():
     student = (b.get("student") or "").strip()
     if not poll_id:
         return jsonify({"ok": False, "error": "no poll id"}), 400
-    d = ensure_keys(load_data())
-    if poll_id not in d.get("polls", {}):
+    now = int(time.time())
+    summary = live_tally.record("poll", poll_id, student, answer, now)
+    if summary is None:
         return jsonify({"ok": False, "error": "unknown poll"}), 404
-    d["polls"][poll_id].setdefault("responses", []).append({
-        "student": student,
-        "answer": answer,
-        "ts": int(time.time())
-    })
-    save_data(d)
-    log_action({"event": "poll_response", "poll_id": poll_id, "student": student})
+    summary["last"] = {"student": student, "answer": answer, "ts": now}
+    event_bus.publish("poll", summary)
     return jsonify({"ok": True})
 
+@app.route("/api/poll/<poll_id>/results", methods=["GET"])
+def api_poll_results(poll_id):
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    agg = live_tally.get("poll", poll_id)
+    if not agg:
+        return jsonify({"ok": False, "error": "unknown poll"}), 404
+    out = {"ok": True, "summary": agg.summary()}
+    if request.args.get("responses") == "1":
+        out["responses"] = agg.responses()
+    return jsonify(out)
+
+
+# =========================
+# Live events (Server-Sent Events)
+# =========================
+@app.route("/api/events/stream")
+def api_events_stream():
+    """
+    Teacher dashboard push channel.
+    Query param: topics=poll,attention,offtask (comma-separated; default all).
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    topics = [t.strip() for t in (request.args.get("topics") or "").split(",") if t.strip()]
+    sub = event_bus.subscribe(topics or None)
+    return Response(
+        event_bus.sse_stream(sub),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # =========================
 # State (feature flags bucket)
 # =========================
+
+# Fields returned by /api/state when no `fields=` projection is given.
+_STATE_DEFAULT_FIELDS = (
+    "settings",
+    "extension_enabled",
+    "announcements",
+    "exam_state",
+    "image_filter",
+    "default_policy_id",
+)
+
+# Large collections are never inlined by a projection; they are served
+# page by page from /api/state/<key> instead.
+_STATE_LIST_COLLECTIONS = (
+    "alerts", "image_filter_events", "offtask_events", "raises", "exam_violations",
+)
+_STATE_DICT_COLLECTIONS = (
+    "presence", "history", "screenshots", "dm", "polls", "chat",
+    "pending_commands", "pending_per_student", "student_scenes", "student_overrides",
+)
+
+
+def _state_collection_stub(key, value):
+    return {"count": len(value or []), "href": f"/api/state/{key}"}
+
+
 @app.route("/api/state")
 def api_state():
+    """
+    Feature-flag view of data.json for the extension.
+
+    Query params:
+      fields: comma-separated top-level keys (dotted paths allowed, e.g.
+              "settings.features"). "*" returns the whole document.
+              Defaults to a lean feature-flag view.
+    """
     d = ensure_keys(load_data())
     yt_rules = {
         "block": get_setting("yt_block_keywords", []),
@@ -2551,7 +3966,99 @@ def api_state():
     features = d.setdefault("settings", {}).setdefault("features", {})
     features["youtube_rules"] = yt_rules
     features.setdefault("youtube_filter", True)
-    return jsonify(d)
+
+    raw_fields = (request.args.get("fields") or "").strip()
+    if raw_fields == "*":
+        return jsonify(d)
+
+    fields = [f.strip() for f in raw_fields.split(",") if f.strip()] or list(_STATE_DEFAULT_FIELDS)
+    out = {}
+    for f in fields:
+        key, _, sub = f.partition(".")
+        if key not in d:
+            continue
+        val = d[key]
+        if key in _STATE_LIST_COLLECTIONS or key in _STATE_DICT_COLLECTIONS:
+            out[key] = _state_collection_stub(key, val)
+            continue
+        if sub:
+            if not isinstance(val, dict) or sub not in val:
+                continue
+            out.setdefault(key, {})[sub] = val[sub]
+        else:
+            out[key] = val
+    return jsonify(out)
+
+
+@app.route("/api/state/<key>")
+def api_state_collection(key):
+    """
+    Cursor-paginated access to one large data.json collection.
+
+    Lists are returned newest first; the cursor is "<ts>.<skip>" so it stays
+    valid while new rows are appended and old rows are trimmed.
+    Dicts are returned in key order; the cursor is the last key returned.
+    """
+    u = current_user()
+    if not u or u["role"] not in ("teacher", "admin"):
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    if key not in _STATE_LIST_COLLECTIONS and key not in _STATE_DICT_COLLECTIONS:
+        return jsonify({"ok": False, "error": "unknown collection"}), 404
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 500))
+    except Exception:
+        limit = 100
+    cursor = (request.args.get("cursor") or "").strip()
+
+    d = ensure_keys(load_data())
+    val = d.get(key)
+
+    if key in _STATE_DICT_COLLECTIONS:
+        val = val if isinstance(val, dict) else {}
+        keys = sorted(k for k in val.keys() if k > cursor) if cursor else sorted(val.keys())
+        page = keys[:limit]
+        items = [{"key": k, "value": val[k]} for k in page]
+        next_cursor = page[-1] if len(keys) > limit else None
+        return jsonify({"ok": True, "items": items, "next_cursor": next_cursor, "total": len(val)})
+
+    val = val if isinstance(val, list) else []
+    cur_ts, skip = None, 0
+    if cursor:
+        try:
+            ts_part, _, skip_part = cursor.partition(".")
+            cur_ts, skip = int(ts_part), int(skip_part or 0)
+        except Exception:
+            return jsonify({"ok": False, "error": "bad cursor"}), 400
+
+    items = []
+    last_ts, same_ts = None, 0
+    has_more = False
+    for e in reversed(val):
+        ts = int((e or {}).get("ts", 0) or 0) if isinstance(e, dict) else 0
+        if cur_ts is not None:
+            if ts > cur_ts:
+                continue
+            if ts == cur_ts and skip > 0:
+                skip -= 1
+                continue
+        if len(items) >= limit:
+            has_more = True
+            break
+        items.append(e)
+        if ts == last_ts:
+            same_ts += 1
+        else:
+            last_ts, same_ts = ts, 1
+
+    next_cursor = None
+    if has_more and items:
+        # Rows sharing the boundary ts that were already returned on earlier pages
+        already = same_ts
+        if cur_ts is not None and last_ts == cur_ts:
+            already += int(cursor.partition(".")[2] or 0)
+        next_cursor = f"{last_ts}.{already}"
+    return jsonify({"ok": True, "items": items, "next_cursor": next_cursor, "total": len(val)})
 
 
 # =========================
@@ -2575,6 +4082,7 @@ def api_student_open_tabs():
     arr.append({"type": "open_tabs", "urls": urls, "ts": int(time.time())})
     arr[:] = arr[-50:]
     save_data(d)
+    policy_versions.bump("student", student)
     return jsonify({"ok": True})
 
 
@@ -2593,14 +4101,14 @@ def api_exam():
     if action == "start":
         if not url:
             return jsonify({"ok": False, "error": "url required"}), 400
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({"type": "exam_start", "url": url})
+        _queue_command(d, "*", {"type": "exam_start", "url": url})
         d.setdefault("exam_state", {})["active"] = True
         d["exam_state"]["url"] = url
         save_data(d)
         log_action({"event": "exam", "action": "start", "url": url})
         return jsonify({"ok": True})
     elif action == "end":
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({"type": "exam_end"})
+        _queue_command(d, "*", {"type": "exam_end"})
         d.setdefault("exam_state", {})["active"] = False
         save_data(d)
         log_action({"event": "exam", "action": "end"})
@@ -2661,7 +4169,7 @@ def api_notify():
     title = (b.get("title") or "G School")[:120]
     message = (b.get("message") or "")[:500]
     d = ensure_keys(load_data())
-    d.setdefault("pending_commands", {}).setdefault("*", []).append({
+    _queue_command(d, "*", {
         "type": "notify", "title": title, "message": message
     })
     save_data(d)
@@ -2735,6 +4243,7 @@ def api_image_filter_config():
 
     d["image_filter"] = cfg
     save_data(d)
+    policy_versions.bump("config", "image_filter")
     log_action({"event": "image_filter_config_update", "config": cfg})
     return jsonify({"ok": True, "config": cfg})
 
@@ -2760,25 +4269,49 @@ def api_image_filter_evaluate():
         "scores": {label: score}
       }
     """
-    d = ensure_keys(load_data())
-    cfg = _ensure_image_filter_config(d)
-
     body = request.json or {}
     thumbnail = body.get("thumbnail") or body.get("image") or ""
     src = (body.get("src") or "").strip()
     page_url = (body.get("page_url") or "").strip()
     student = (body.get("student") or "").strip()
+    return jsonify(_image_filter_evaluate(thumbnail or None, src, page_url, student))
+
+
+@app.route("/api/image_filter/evaluate/binary", methods=["POST"])
+def api_image_filter_evaluate_binary():
+    """
+    Same as /api/image_filter/evaluate, with the thumbnail as the raw request
+    body (Content-Type: image/*) or a multipart "file" field; src, page_url
+    and student go in the query string / form. At most MAX_THUMBNAIL_BYTES.
+    """
+    if _too_large(MAX_THUMBNAIL_BYTES):
+        return _upload_too_large()
+    stream, meta = _upload_source()
+    image = _read_bounded(stream, MAX_THUMBNAIL_BYTES) if stream is not None else b""
+    if image is None:
+        return _upload_too_large()
+    metrics.observe("gschool_upload_bytes", len(image), "Binary upload sizes", buckets=_UPLOAD_BUCKETS,
+                    kind="thumbnail")
+    return jsonify(_image_filter_evaluate(image or None, (meta.get("src") or "").strip(),
+                                          (meta.get("page_url") or "").strip(), (meta.get("student") or "").strip()))
+
+
+def _image_filter_evaluate(image, src, page_url, student):
+    """Classify one image (data URL or raw bytes), log the decision and alert on blocks."""
+    d = ensure_keys(load_data())
+    cfg = _ensure_image_filter_config(d)
 
     # If disabled, always allow (but still respond).
     if not cfg.get("enabled", False):
-        return jsonify({"ok": True, "action": "allow", "reason": "disabled", "scores": {}})
+        return {"ok": True, "action": "allow", "reason": "disabled", "scores": {}}
 
     # Run lightweight classifier
     try:
-        scores = _gschool_classify_image(thumbnail or None, src=src, page_url=page_url)
+        with metrics.timed("gschool_image_filter_seconds", "Time spent in the image classifier"):
+            scores = _gschool_classify_image(image, src=src, page_url=page_url)
     except Exception as e:
         log_action({"event": "image_filter_error", "error": str(e)})
-        return jsonify({"ok": True, "action": "allow", "reason": "error", "scores": {}})
+        return {"ok": True, "action": "allow", "reason": "error", "scores": {}}
 
     # Decide based on highest concerning label
     block_threshold = float(cfg.get("block_threshold", 0.6))
@@ -2830,6 +4363,7 @@ def api_image_filter_evaluate():
                 "score": float(best_score),
                 "title": best_label,
                 "url": page_url or src,
+                "domain": domains.domain_of(page_url or ""),
                 "note": src,
             })
             d2["alerts"] = alerts[-500:]
@@ -2845,12 +4379,12 @@ def api_image_filter_evaluate():
         except Exception:
             pass
 
-    return jsonify({
+    return {
         "ok": True,
         "action": action,
         "reason": best_label,
         "scores": scores,
-    })
+    }
 
 
 @app.route("/api/image_filter/logs", methods=["GET"])
@@ -2879,7 +4413,7 @@ def api_off_task():
         reason = (b.get("reason") or "blocked_visit")
         log_action({"event": "off_task", "student": student, "url": url, "reason": reason, "ts": int(time.time())})
         d = ensure_keys(load_data())
-        d.setdefault("pending_commands", {}).setdefault("*", []).append({
+        _queue_command(d, "*", {
             "type": "notify",
             "title": "Off-task detected",
             "message": f"{student or 'Student'} visited a blocked page."
@@ -2897,7 +4431,82 @@ def api_off_task():
 # =========================
 # Run
 # =========================
+def _profile_startup():
+    """Print a breakdown of time-to-first-request, measured in a fresh interpreter.
+
+    Runs against a scratch copy of the data files so nothing real is migrated.
+    """
+    import shutil, subprocess, sys, tempfile
+    scratch = tempfile.mkdtemp(prefix="gschool-startup-")
+    for name in ("data.json", "scenes.json", "gschool.db"):
+        if os.path.exists(tenancy.path(name)):
+            shutil.copy(tenancy.path(name), scratch)
+    probe = (
+        "import json, sys, time\n"
+        "t0 = time.perf_counter()\n"
+        "import app\n"
+        "t1 = time.perf_counter()\n"
+        "c = app.app.test_client()\n"
+        "c.post('/api/policy', json={'student': 'startup@profile'})\n"
+        "t2 = time.perf_counter()\n"
+        "c.post('/api/policy', json={'student': 'startup@profile'})\n"
+        "t3 = time.perf_counter()\n"
+        "print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_request_ms': (t2 - t1) * 1000,\n"
+        "                  'warm_request_ms': (t3 - t2) * 1000,\n"
+        "                  'tenant_prepare_ms': app._startup_stats.get('default')}))\n"
+    )
+    env = dict(os.environ, GSCHOOL_DATA_DIR=scratch)
+    try:
+        t0 = time.perf_counter()
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                           cwd=ROOT, env=env, capture_output=True, text=True)
+        total = (time.perf_counter() - t0) * 1000.0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if p.returncode != 0:
+        print(p.stderr)
+        return p.returncode
+    timings = json.loads(p.stdout.strip().splitlines()[-1])
+
+    # -X importtime lines: "import time: self | cumulative | <indent>module".
+    # Children are printed before their parent, so collect the direct imports
+    # of each top-level module and keep the ones that belong to app.
+    modules, pending = [], []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1]) / 1000.0
+        except ValueError:
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            pending.append((cumulative, name.strip()))
+        elif depth == 0:
+            if name.strip() == "app":
+                modules = pending
+            pending = []
+    modules.sort(reverse=True)
+
+    print("Startup profile (time to first request)")
+    print(f"  interpreter + import + first request  {total:9.1f} ms")
+    print(f"  import app                            {timings['import_ms']:9.1f} ms")
+    for ms, name in modules[:12]:
+        print(f"    {name:<36}{ms:9.1f} ms")
+    print(f"  first request                         {timings['first_request_ms']:9.1f} ms")
+    print(f"    schema + migrations (default)       {timings['tenant_prepare_ms'] or 0:9.1f} ms")
+    print(f"  warm request                          {timings['warm_request_ms']:9.1f} ms")
+    return 0
+
+
 if __name__ == "__main__":
-    # Ensure data.json exists and is sane on boot
-    save_data(ensure_keys(load_data()))
+    import argparse, sys
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profile-startup", action="store_true", help="report time-to-first-request and exit")
+    args = ap.parse_args()
+    if args.profile_startup:
+        sys.exit(_profile_startup())
+    # data.json is created/repaired lazily by load_data on first use
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,270 @@
+"""
+Append-only audit log in SQLite, written by a background thread.
+
+log() only puts the entry on an in-memory queue, so recording an action
+never touches data.json or waits on disk. A writer thread drains the queue
+in batches (up to BATCH_SIZE rows or every FLUSH_SECONDS), one transaction
+per tenant per batch, and prunes rows older than RETENTION_DAYS about once
+an hour. If the queue is ever full the entry is dropped and counted rather
+than blocking the request. Whatever is still queued at interpreter exit
+(a restart or deploy) is flushed by an atexit hook.
+
+Interface:
+    ensure_schema()
+    log(entry, user=None)                 # entry: {"event": ..., ...}; never blocks
+    flush(timeout=2.0) -> bool            # wait until everything queued so far is written
+    query(event=None, user=None, since=None, until=None, before_id=None, limit=200) -> list[dict]
+    iter_rows(event=None, user=None, since=None, until=None, after_id=None) -> iterator of dicts, oldest first
+    import_entries(entries)               # one-off migration from data.json["audit"]
+    prune(retention_days=RETENTION_DAYS) -> int
+    stats() -> dict
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import tenancy
+
+RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", "180") or 0)
+BATCH_SIZE = 500
+FLUSH_SECONDS = 0.5
+MAX_QUEUE = 50000
+PRUNE_INTERVAL_SECONDS = 3600
+
+_queue = queue.Queue(maxsize=MAX_QUEUE)
+_done = threading.Condition()
+_enqueued = 0
+_written = 0
+_dropped = 0
+_writer = None
+_writer_lock = threading.Lock()
+_schema_ready = set()
+_last_prune = {}
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def ensure_schema():
+    tid = tenancy.current()
+    if tid in _schema_ready:
+        return
+    with _db() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS audit_log(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER,
+            event TEXT,
+            user TEXT,
+            subject TEXT,
+            data_json TEXT
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_ts ON audit_log(ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_event_ts ON audit_log(event, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_user_ts ON audit_log(user, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_subject_ts ON audit_log(subject, ts)")
+        conn.commit()
+    _schema_ready.add(tid)
+
+
+def _subject(entry):
+    for k in ("student", "to", "email", "user"):
+        v = entry.get(k)
+        if isinstance(v, str) and v:
+            return v.strip().lower()
+    return None
+
+
+def _row(entry, user):
+    entry = dict(entry or {})
+    ts = int(entry.pop("ts", None) or time.time())
+    event = str(entry.get("event") or "")
+    return (ts, event, (user or "").strip().lower() or None, _subject(entry), json.dumps(entry, default=str))
+
+
+def log(entry, user=None):
+    """Queue one audit entry for the current tenant."""
+    global _enqueued, _dropped
+    item = (tenancy.current(), _row(entry, user))
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        with _done:
+            _dropped += 1
+        return
+    with _done:
+        _enqueued += 1
+    _ensure_writer()
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name="gschool-audit-writer", daemon=True)
+            _writer.start()
+
+
+def _write_batch(batch):
+    global _written
+    by_tenant = {}
+    for tid, row in batch:
+        by_tenant.setdefault(tid, []).append(row)
+    for tid, rows in by_tenant.items():
+        try:
+            with tenancy.activate(tid):
+                ensure_schema()
+                with _db() as conn:
+                    conn.executemany(
+                        "INSERT INTO audit_log(ts, event, user, subject, data_json) VALUES(?,?,?,?,?)", rows)
+                    conn.commit()
+                _maybe_prune()
+        except Exception as e:
+            print(f"[WARN] audit write failed for tenant {tid}:", e)
+    with _done:
+        _written += len(batch)
+        _done.notify_all()
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_SECONDS
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_batch(batch)
+
+
+def flush(timeout=2.0):
+    """Wait until every entry queued before this call has been written."""
+    with _done:
+        target = _enqueued
+        end = time.monotonic() + timeout
+        while _written < target:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            _done.wait(remaining)
+    return True
+
+
+atexit.register(flush)
+
+
+def query(event=None, user=None, since=None, until=None, before_id=None, limit=200):
+    """Newest-first audit rows; `user` matches the actor or the subject of the action."""
+    ensure_schema()
+    sql = ["SELECT id, ts, event, user, subject, data_json FROM audit_log WHERE 1=1"]
+    params = []
+    if event:
+        sql.append("AND event = ?")
+        params.append(event)
+    if user:
+        u = user.strip().lower()
+        sql.append("AND (user = ? OR subject = ?)")
+        params += [u, u]
+    if since:
+        sql.append("AND ts >= ?")
+        params.append(int(since))
+    if until:
+        sql.append("AND ts < ?")
+        params.append(int(until))
+    if before_id:
+        sql.append("AND id < ?")
+        params.append(int(before_id))
+    sql.append("ORDER BY id DESC LIMIT ?")
+    params.append(max(1, min(int(limit), 1000)))
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(" ".join(sql), params)
+        rows = cur.fetchall()
+    out = []
+    for rid, ts, ev, actor, subject, data_json in rows:
+        item = json.loads(data_json or "{}")
+        item.update(id=rid, ts=ts, event=ev, user=actor, subject=subject)
+        out.append(item)
+    return out
+
+
+def iter_rows(event=None, user=None, since=None, until=None, after_id=None):
+    """Oldest-first audit rows read off one cursor (for exports); the query runs before this returns."""
+    ensure_schema()
+    sql = ["SELECT id, ts, event, user, subject, data_json FROM audit_log WHERE id > ?"]
+    params = [int(after_id or 0)]
+    if event:
+        sql.append("AND event = ?")
+        params.append(event)
+    if user:
+        u = user.strip().lower()
+        sql.append("AND (user = ? OR subject = ?)")
+        params += [u, u]
+    if since:
+        sql.append("AND ts >= ?")
+        params.append(int(since))
+    if until:
+        sql.append("AND ts < ?")
+        params.append(int(until))
+    sql.append("ORDER BY id")
+    conn = _db()
+    cur = conn.execute(" ".join(sql), params)
+
+    def rows():
+        try:
+            for rid, ts, ev, actor, subject, data_json in cur:
+                yield {"id": rid, "ts": ts, "event": ev, "user": actor, "subject": subject,
+                       "data": json.loads(data_json or "{}")}
+        finally:
+            conn.close()
+    return rows()
+
+
+def import_entries(entries):
+    """Copy legacy data.json audit rows into the table (oldest first)."""
+    ensure_schema()
+    rows = [_row(e, e.get("by") if isinstance(e, dict) else None) for e in entries if isinstance(e, dict)]
+    rows.sort(key=lambda r: r[0])
+    with _db() as conn:
+        conn.executemany("INSERT INTO audit_log(ts, event, user, subject, data_json) VALUES(?,?,?,?,?)", rows)
+        conn.commit()
+    return len(rows)
+
+
+def prune(retention_days=RETENTION_DAYS):
+    if not retention_days:
+        return 0
+    ensure_schema()
+    cutoff = int(time.time()) - int(retention_days) * 86400
+    with _db() as conn:
+        cur = conn.execute("DELETE FROM audit_log WHERE ts < ?", (cutoff,))
+        conn.commit()
+        return cur.rowcount
+
+
+def _maybe_prune():
+    tid = tenancy.current()
+    now = time.time()
+    if now - _last_prune.get(tid, 0.0) < PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune[tid] = now
+    try:
+        prune()
+    except Exception as e:
+        print("[WARN] audit prune failed:", e)
+
+
+def stats():
+    with _done:
+        return {"queued": _queue.qsize(), "enqueued": _enqueued, "written": _written, "dropped": _dropped}
@@ -0,0 +1,129 @@
+"""
+Time-on-site aggregation over a synthetic school week.
+
+Builds a history of dwell intervals (students x school days x visits per
+day, Zipf-distributed domains, 8:00-15:00 school hours), loads it into the
+columnar analytics.Intervals and times per-domain / per-category /
+per-student aggregates for the whole week, a single day and one class-sized
+roster, next to a plain-Python loop over the same rows for reference. The
+same rows are also fed through analytics.Store the way /api/analytics/usage
+reads timeline_intervals: a full first load, then one heartbeat-minute of
+new rows appended, and the week queried with the store's cached categories.
+
+    python benchmarks/bench_analytics.py --students 1000 --days 5 --visits 100
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import analytics  # noqa: E402
+
+SITES = ["khanacademy.org", "docs.google.com", "wikipedia.org", "youtube.com", "roblox.com", "quizlet.com",
+         "instructure.com", "desmos.com", "tiktok.com", "netflix.com", "espn.com", "amazon.com"]
+WEEK_START = 1_700_000_000 - 1_700_000_000 % 86400
+
+
+def make_history(students, days, visits, seed=11):
+    rnd = random.Random(seed)
+    sites = SITES + [f"site{i}.example.org" for i in range(2000)]
+    weights = [1.0 / (i + 1) for i in range(len(sites))]
+    history = {}
+    for s in range(students):
+        rows = []
+        for day in range(days):
+            t = WEEK_START + day * 86400 + 8 * 3600 + rnd.randrange(600)
+            for dom in rnd.choices(sites, weights=weights, k=visits):
+                dur = rnd.randrange(15, 400)
+                rows.append({"ts": t, "end": t + dur, "domain": dom, "url": f"https://{dom}/", "title": dom})
+                t += dur + rnd.randrange(0, 60)
+        history[f"student{s}@bench.test"] = rows
+    return history
+
+
+def naive(history, since, until):
+    by_domain, by_student = defaultdict(int), defaultdict(int)
+    for student, rows in history.items():
+        for e in rows:
+            secs = min(e["end"], until) - max(e["ts"], since)
+            if secs > 0:
+                by_domain[e["domain"]] += secs
+                by_student[student] += secs
+    return by_domain, by_student
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return out, round(statistics.median(times) * 1000, 2)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--students", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=5)
+    ap.add_argument("--visits", type=int, default=100, help="intervals per student per day")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", help="also write the JSON results here")
+    args = ap.parse_args(argv)
+
+    history = make_history(args.students, args.days, args.visits)
+    iv, build_ms = timed(lambda: analytics.Intervals.from_history(history), 1)
+    analytics.category_map(iv.domains)  # warm the per-domain classifier cache
+
+    week = (WEEK_START, WEEK_START + args.days * 86400)
+    day = (WEEK_START + 86400, WEEK_START + 2 * 86400)
+    roster = sorted(history)[:30]
+
+    week_out, week_ms = timed(lambda: analytics.usage(iv, *week), args.repeat)
+    _, day_ms = timed(lambda: analytics.usage(iv, *day), args.repeat)
+    _, roster_ms = timed(lambda: analytics.usage(iv, *week, students=roster), args.repeat)
+    (ref_domain, _), naive_ms = timed(lambda: naive(history, *week), 1)
+
+    assert week_out["total_seconds"] == sum(ref_domain.values())
+
+    rows = [(i + 1, student, e["domain"], e["ts"], e["end"])
+            for i, (student, e) in enumerate((s, e) for s, arr in sorted(history.items()) for e in arr)]
+    tail = min(len(rows), args.students)
+    store = analytics.Store(first_rowid=1)
+    _, store_load_ms = timed(lambda: store.append(rows[:-tail]), 1)
+    _, store_append_ms = timed(lambda: store.append(rows[-tail:]), 1)
+    sv = store.view()
+    store_out, store_week_ms = timed(lambda: analytics.usage(sv, *week, known_rev=0), args.repeat)
+    assert store_out["total_seconds"] == week_out["total_seconds"]
+    report = {
+        "intervals": len(iv),
+        "students": len(iv.students),
+        "domains": len(iv.domains),
+        "build_ms": build_ms,
+        "week_ms": week_ms,
+        "day_ms": day_ms,
+        "class_roster_week_ms": roster_ms,
+        "python_loop_week_ms": naive_ms,
+        "store_first_load_ms": store_load_ms,
+        "store_append_ms": store_append_ms,
+        "store_week_ms": store_week_ms,
+        "week_total_hours": round(week_out["total_seconds"] / 3600, 1),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Micro-benchmarks for the pure decision functions on the request hot path.
+
+Covers _select_active_policy, _apply_policy_to_lists,
+_is_policy_schedule_active, ai_classifier.classify,
+image_filter_ai.classify_image and image_filter_ai._keyword_boost against
+synthetic fixtures (large policy sets, many assignments, big HTML bodies,
+thumbnail corpora). Each case is calibrated to run for roughly --min-time
+seconds per round, pytest-benchmark style, and results are written as JSON
+so releases can be compared:
+
+    python benchmarks/bench_decisions.py --out before.json
+    python benchmarks/bench_decisions.py --compare before.json --tolerance 0.25
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+
+# ---------------------------
+# Fixture generators
+# ---------------------------
+def make_policies(n, rnd):
+    policies = {}
+    for i in range(n):
+        sched = {"enabled": rnd.random() < 0.7, "start": f"{rnd.randrange(6, 12):02d}:00",
+                 "end": f"{rnd.randrange(12, 23):02d}:30", "weekdays_only": rnd.random() < 0.5}
+        policies[f"p{i}"] = {
+            "id": f"p{i}",
+            "name": f"Policy {i}",
+            "priority": rnd.randrange(0, 100),
+            "active": rnd.random() < 0.95,
+            "schedule": sched,
+            "allow_urls": [f"*://*.allow{i}-{k}.org/*" for k in range(rnd.randrange(0, 20))],
+            "block_urls": [f"*://*.block{i}-{k}.com/*" for k in range(rnd.randrange(0, 40))],
+            "blocked_categories": rnd.sample(CATEGORY_NAMES, 4),
+            "allowed_categories": rnd.sample(CATEGORY_NAMES, 2),
+        }
+    return policies
+
+
+def make_assignments(policies, n_users, n_groups, rnd):
+    ids = list(policies)
+    users = {f"s{i}@school.test": rnd.sample(ids, min(len(ids), rnd.randrange(1, 4))) for i in range(n_users)}
+    groups = {f"class{i}": rnd.sample(ids, min(len(ids), 2)) for i in range(n_groups)}
+    return {"users": users, "groups": groups}
+
+
+def make_categories(rnd):
+    return {name: {"name": name, "blocked": rnd.random() < 0.3, "urls": [f"{name.lower()[:6]}{k}.com" for k in range(25)]}
+            for name in CATEGORY_NAMES}
+
+
+def make_html(kb, rnd):
+    words = ("lesson homework quiz algebra photosynthesis history essay reading chapter science "
+             "gaming roblox chat stream video casino news wikipedia canvas").split()
+    parts = ["<html><head><title>Page</title><style>body{color:red}</style>"
+             "<script>var x = 1;</script></head><body>"]
+    size = 0
+    while size < kb * 1024:
+        para = "<p>" + " ".join(rnd.choice(words) for _ in range(40)) + "</p>"
+        parts.append(para)
+        size += len(para)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def make_thumbnails(n, size, rnd):
+    try:
+        from PIL import Image
+    except ImportError:
+        return []
+    out = []
+    for _ in range(n):
+        img = Image.new("RGB", size, tuple(rnd.randrange(256) for _ in range(3)))
+        px = img.load()
+        for x in range(size[0]):
+            for y in range(0, size[1], 3):
+                px[x, y] = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=70)
+        out.append(buf.getvalue())
+    return out
+
+
+CATEGORY_NAMES = ["Advertising", "Blogs", "Collaboration", "Ecommerce", "Entertainment", "Gambling", "Games",
+                  "General / Education", "Social Media", "Sports & Hobbies", "Streaming Services", "Weapons"]
+
+
+# ---------------------------
+# Harness
+# ---------------------------
+def bench(name, fn, min_time, rounds):
+    """Calibrate iterations so one round takes ~min_time, then time `rounds` rounds."""
+    fn()  # warm caches / lazy imports outside the timing
+    iters = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            fn()
+        dt = time.perf_counter() - t0
+        if dt >= min_time or iters >= 1 << 24:
+            break
+        iters = max(iters * 2, int(iters * min_time / max(dt, 1e-9)))
+    per_call = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            fn()
+        per_call.append((time.perf_counter() - t0) / iters)
+    med = statistics.median(per_call)
+    return {
+        "name": name,
+        "iterations": iters,
+        "rounds": rounds,
+        "min_us": round(min(per_call) * 1e6, 3),
+        "median_us": round(med * 1e6, 3),
+        "mean_us": round(statistics.fmean(per_call) * 1e6, 3),
+        "stddev_us": round(statistics.pstdev(per_call) * 1e6, 3),
+        "ops_per_s": round(1.0 / med, 1) if med else None,
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        b = base.get(r["name"])
+        if not b or not b.get("median_us"):
+            continue
+        ratio = r["median_us"] / b["median_us"]
+        r["baseline_median_us"] = b["median_us"]
+        r["ratio"] = round(ratio, 3)
+        if ratio > 1.0 + tolerance:
+            regressions.append(r["name"])
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--policies", type=int, default=500)
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--groups", type=int, default=200)
+    ap.add_argument("--html-kb", type=int, default=256)
+    ap.add_argument("--thumbnails", type=int, default=32)
+    ap.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--only", help="comma-separated substrings; run matching cases only")
+    ap.add_argument("--out", default="bench_decisions.json")
+    ap.add_argument("--compare", help="previous results JSON; exit 1 if a case got slower than --tolerance")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="gschool-bench-decisions-")
+    os.environ["GSCHOOL_DATA_DIR"] = scratch
+    sys.path.insert(0, REPO)
+    import app as gschool  # noqa: E402  (must import after GSCHOOL_DATA_DIR is set)
+    import ai_classifier  # noqa: E402
+    import image_filter_ai  # noqa: E402
+
+    rnd = random.Random(38)
+    policies = make_policies(args.policies, rnd)
+    assigns = make_assignments(policies, args.users, args.groups, rnd)
+    data = {"policies": policies, "policy_assignments": assigns, "default_policy_id": "p0"}
+    categories = make_categories(rnd)
+    html = make_html(args.html_kb, rnd)
+    thumbs = make_thumbnails(args.thumbnails, (96, 96), rnd)
+    scheduled = [p for p in policies.values() if p["schedule"]["enabled"]]
+    students = list(assigns["users"])
+
+    # Roster a student into a few classes so the group-assignment path is exercised.
+    with gschool.app.test_request_context():
+        gschool._prepare_tenant()
+        for cid in list(assigns["groups"])[:3]:
+            gschool.class_store.update(cid, lambda c: c.__setitem__("students", [students[0]]))
+
+    it = {"i": 0}
+
+    def next_student():
+        it["i"] = (it["i"] + 1) % len(students)
+        return students[it["i"]]
+
+    def next_thumb():
+        it["i"] = (it["i"] + 1) % max(1, len(thumbs))
+        return thumbs[it["i"]] if thumbs else None
+
+    top = max(policies.values(), key=lambda p: len(p["block_urls"]))
+    base_allow = [f"*://*.class-allow{k}.org/*" for k in range(50)]
+    base_blocks = [f"*://*.class-block{k}.com/*" for k in range(200)]
+    caption = " ".join(["school photo of the science fair"] * 20)
+
+    cases = [
+        ("select_active_policy/user_assigned", lambda: gschool._select_active_policy(data, next_student())),
+        ("select_active_policy/rostered", lambda: gschool._select_active_policy(data, students[0])),
+        ("select_active_policy/default", lambda: gschool._select_active_policy(data, "nobody@school.test")),
+        ("apply_policy_to_lists/largest", lambda: gschool._apply_policy_to_lists(base_allow, base_blocks, categories, top)),
+        ("is_policy_schedule_active/all", lambda: [gschool._is_policy_schedule_active(p) for p in scheduled]),
+        ("classify/short_html", lambda: ai_classifier.classify("https://www.khanacademy.org/math", html="<p>algebra</p>")),
+        (f"classify/html_{args.html_kb}kb", lambda: ai_classifier.classify("https://news.example.com/a", html=html)),
+        ("classify_image/thumbnail", lambda: image_filter_ai.classify_image(next_thumb(), src="https://img.test/a.jpg",
+                                                                            page_url="https://example.com/")),
+        ("classify_image/url_only", lambda: image_filter_ai.classify_image(None, src="https://img.test/casino-gun.jpg")),
+        ("keyword_boost/caption", lambda: image_filter_ai._keyword_boost(caption)),
+    ]
+    if args.only:
+        wanted = [w.strip() for w in args.only.split(",") if w.strip()]
+        cases = [c for c in cases if any(w in c[0] for w in wanted)]
+
+    try:
+        results = [bench(name, fn, args.min_time, args.rounds) for name, fn in cases]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else []
+    doc = {
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixtures": {"policies": args.policies, "users": args.users, "groups": args.groups,
+                     "html_kb": args.html_kb, "thumbnails": len(thumbs)},
+        "results": results,
+        "regressions": regressions,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+
+    for r in results:
+        extra = f"  x{r['ratio']}" if "ratio" in r else ""
+        print(f"{r['name']:<40}{r['median_us']:>12.2f} us{extra}")
+    print(f"results written to {args.out}")
+    if regressions:
+        print("REGRESSIONS:", ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
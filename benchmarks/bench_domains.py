@@ -0,0 +1,111 @@
+"""
+Throughput of domains.py on a synthetic million-host corpus.
+
+The corpus mixes a Zipf-distributed set of popular sites (what a classroom
+mostly visits, so the LRU cache gets hits) with unique long-tail hosts
+across many public suffixes. Reports cold (cache cleared, every host
+unique) and warm throughput, and, when tldextract is installed, its speed
+and how often the two agree on a sample.
+
+    python benchmarks/bench_domains.py --hosts 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import domains  # noqa: E402
+
+SUFFIXES = ["com", "org", "net", "edu", "gov", "io", "co.uk", "ac.uk", "com.au", "co.jp",
+            "k12.ca.us", "de", "fr", "ca", "us", "blogspot.com", "github.io", "ck", "kawasaki.jp"]
+WORDS = ["khan", "academy", "wiki", "news", "games", "math", "cool", "class", "school", "video",
+         "docs", "mail", "drive", "quiz", "learn", "play", "shop", "store", "cloud", "live"]
+
+
+def make_corpus(n, seed=7):
+    rnd = random.Random(seed)
+    popular = []
+    for _ in range(2000):
+        sub = rnd.choice(["www", "m", "docs", "", "app", "cdn"])
+        name = rnd.choice(WORDS) + rnd.choice(WORDS)
+        host = ".".join(p for p in (sub, name, rnd.choice(SUFFIXES)) if p)
+        popular.append(host)
+    weights = [1.0 / (i + 1) for i in range(len(popular))]
+    hosts = rnd.choices(popular, weights=weights, k=n // 2)
+    for i in range(n - len(hosts)):
+        depth = rnd.randint(0, 3)
+        subs = [rnd.choice(WORDS) + str(rnd.randint(0, 99)) for _ in range(depth)]
+        hosts.append(".".join(subs + [f"site{i}", rnd.choice(SUFFIXES)]))
+    rnd.shuffle(hosts)
+    return hosts
+
+
+def _rate(fn, items):
+    t0 = time.perf_counter()
+    for h in items:
+        fn(h)
+    wall = time.perf_counter() - t0
+    return {"hosts": len(items), "wall_s": round(wall, 3), "hosts_per_s": round(len(items) / wall) if wall else None}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--hosts", type=int, default=1_000_000)
+    ap.add_argument("--compare-sample", type=int, default=100_000,
+                    help="hosts to run through tldextract for speed/agreement (0 to skip)")
+    args = ap.parse_args(argv)
+
+    corpus = make_corpus(args.hosts)
+
+    t0 = time.perf_counter()
+    domains._get_trie()
+    compile_ms = (time.perf_counter() - t0) * 1000.0
+
+    unique = list(dict.fromkeys(corpus))
+    domains.split_host.cache_clear()
+    cold = _rate(domains.split_host, unique)
+    domains.split_host.cache_clear()
+    mixed = _rate(domains.split_host, corpus)
+    warm_info = domains.split_host.cache_info()
+
+    report = {
+        "corpus_hosts": len(corpus),
+        "unique_hosts": len(unique),
+        "trie_compile_ms": round(compile_ms, 1),
+        "cold_unique": cold,
+        "corpus_with_lru": mixed,
+        "lru": {"hits": warm_info.hits, "misses": warm_info.misses, "maxsize": warm_info.maxsize},
+    }
+
+    if args.compare_sample:
+        try:
+            import pathlib
+            import tldextract
+        except ImportError:
+            report["tldextract"] = "not installed"
+        else:
+            ex = tldextract.TLDExtract(suffix_list_urls=(pathlib.Path(domains.PSL_PATH).as_uri(),), cache_dir=None)
+            sample = corpus[:args.compare_sample]
+            ex(sample[0])  # load the list outside the timed loop
+            report["tldextract"] = _rate(ex, sample)
+            domains.split_host.cache_clear()
+            report["domains_same_sample"] = _rate(domains.split_host, sample)
+            agree = 0
+            for h in sample:
+                r = ex(h)
+                agree += (r.subdomain, r.domain, r.suffix) == domains.split_host(h)
+            report["tldextract"]["agreement"] = round(agree / len(sample), 6)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Latency of search.py over a semester-sized timeline.
+
+Fills timeline_intervals in a scratch gschool.db with synthetic closed
+intervals (students x school days x visits per day, Zipf-distributed sites
+with varied page titles) - the FTS triggers index them as they are stored,
+just as the rollup job's inserts are - and times typical investigation
+queries: a rare word, a common word, a word plus a prefix, a phrase,
+and the same with student / week / domain filters.
+
+    python benchmarks/bench_search.py --students 500 --days 90 --visits 40
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+SITES = ["khanacademy.org", "docs.google.com", "en.wikipedia.org", "youtube.com", "roblox.com", "quizlet.com",
+         "coolmathgames.com", "desmos.com", "tiktok.com", "netflix.com", "espn.com", "amazon.com"]
+WORDS = ["algebra", "biology", "history", "essay", "minecraft", "music", "video", "game", "lesson", "quiz",
+         "chapter", "review", "practice", "fractions", "chemistry", "poem", "map", "world", "war", "cell",
+         "funny", "cats", "trailer", "episode", "score", "news", "recipe", "drawing", "python", "notes"]
+START = 1_693_000_000
+
+
+def fill(db_path, students, days, visits, seed=5):
+    rnd = random.Random(seed)
+    sites = SITES + [f"site{i}.example.org" for i in range(3000)]
+    weights = [1.0 / (i + 1) for i in range(len(sites))]
+    rows = 0
+    with sqlite3.connect(db_path) as conn:
+        for day in range(days):
+            batch = []
+            for s in range(students):
+                t = START + day * 86400 + 8 * 3600 + rnd.randrange(600)
+                for dom in rnd.choices(sites, weights=weights, k=visits):
+                    title = " ".join(rnd.choices(WORDS, k=rnd.randint(2, 6))).title()
+                    slug = "-".join(title.lower().split()[:3])
+                    dur = rnd.randrange(15, 600)
+                    batch.append((f"student{s}@bench.test", t, t + dur, dom, f"https://{dom}/{slug}/{rnd.randrange(10**6)}",
+                                  title, None))
+                    t += dur + rnd.randrange(0, 60)
+            conn.executemany("INSERT OR IGNORE INTO timeline_intervals(student, ts, end_ts, domain, url, title, category) "
+                             "VALUES(?,?,?,?,?,?,?)", batch)
+            conn.commit()
+            rows += len(batch)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--students", type=int, default=500)
+    ap.add_argument("--days", type=int, default=90)
+    ap.add_argument("--visits", type=int, default=40, help="intervals per student per day")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", help="also write the JSON results here")
+    args = ap.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="gschool-bench-search-")
+    os.environ["GSCHOOL_DATA_DIR"] = scratch
+    sys.path.insert(0, REPO)
+    import search  # noqa: E402  (must import after GSCHOOL_DATA_DIR is set)
+    import tenancy  # noqa: E402
+
+    try:
+        search.ensure_schema()
+        t0 = time.perf_counter()
+        rows = fill(tenancy.path("gschool.db"), args.students, args.days, args.visits)
+        fill_s = time.perf_counter() - t0
+
+        week = (START + 30 * 86400, START + 37 * 86400)
+        cases = {
+            "rare_word": dict(text="minecraft"),
+            "common_word": dict(text="video"),
+            "prefix": dict(text="chemistry rev"),
+            "phrase": dict(text='"funny cats"'),
+            "url_word": dict(text="coolmathgames"),
+            "student_filter": dict(text="video", student="student7@bench.test"),
+            "week_filter": dict(text="minecraft", since=week[0], until=week[1]),
+            "domain_filter": dict(text="minecraft", domain="youtube.com"),
+            "page_3": dict(text="minecraft", offset=100, limit=50),
+        }
+        report = {"intervals": rows, "fill_s": round(fill_s, 1),
+                  "db_mib": round(os.path.getsize(tenancy.path("gschool.db")) / 2**20, 1), "queries": {}}
+        for name, kw in cases.items():
+            times, out = [], None
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                out = search.search(**kw)
+                times.append(time.perf_counter() - t0)
+            report["queries"][name] = {"median_ms": round(statistics.median(times) * 1000, 2),
+                                       "hits_on_page": len(out["items"])}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Peak memory and wire size: base64-in-JSON uploads vs the binary endpoints.
+
+For each screenshot size, posts the same JPEG through
+  * /api/heartbeat with a data URL screenshot      vs  /api/heartbeat/screenshot (raw body)
+  * /api/image_filter/evaluate with a data URL     vs  /api/image_filter/evaluate/binary
+and records request bytes, latency and the tracemalloc peak of the request
+(allocations made while the app handles it, on top of the request body the
+client already holds). Presence and screenshot history are emptied before
+each case so data.json size does not leak from one case into the next.
+Before measuring, it checks that a plain heartbeat after a binary upload
+leaves the uploaded frame in presence:
+
+    python benchmarks/bench_uploads.py --sizes 640x360,1280x720,1920x1080
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+
+def make_jpeg(w, h, seed, quality=80):
+    from PIL import Image
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (w, h))
+    px = img.load()
+    for y in range(0, h, 2):
+        for x in range(0, w, 2):
+            c = (x * 7 % 256, y * 3 % 256, rnd.randrange(256))
+            px[x, y] = c
+            if x + 1 < w:
+                px[x + 1, y] = c
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def measure(fn, repeat, reset):
+    peaks, times = [], []
+    for _ in range(repeat):
+        reset()
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        status = fn()
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        if status >= 400:
+            raise SystemExit(f"request failed with {status}")
+    return {"peak_kib": round(max(peaks) / 1024, 1), "median_ms": round(statistics.median(times) * 1000, 2)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="640x360,1280x720,1920x1080")
+    ap.add_argument("--thumbnail", default="96x96")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", help="also write the JSON results here")
+    args = ap.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="gschool-bench-uploads-")
+    os.environ["GSCHOOL_DATA_DIR"] = scratch
+    sys.path.insert(0, REPO)
+    import app as gschool  # noqa: E402  (must import after GSCHOOL_DATA_DIR is set)
+
+    client = gschool.app.test_client()
+    with gschool.app.test_request_context():
+        gschool._prepare_tenant()
+        d = gschool.load_data()
+        gschool._ensure_image_filter_config(d)["enabled"] = True
+        gschool.save_data(d)
+
+    def reset():
+        with gschool.app.test_request_context():
+            d = gschool.load_data()
+            d["presence"], d["screenshots"], d["image_filter_events"], d["alerts"] = {}, {}, [], []
+            gschool.save_data(d)
+
+    def check_binary_frame_kept(shot):
+        """A plain heartbeat after a binary upload must keep the uploaded frame in presence."""
+        reset()
+        student = "keep@load.test"
+        client.post(f"/api/heartbeat/screenshot?student={student}", data=shot, content_type="image/jpeg")
+        client.post("/api/heartbeat", json={"student": student, "tab": {"id": 1, "url": "https://example.org/"}})
+        with gschool.app.test_request_context():
+            url = (gschool.load_data().get("presence", {}).get(student) or {}).get("screenshot") or ""
+        if not url.startswith("/api/blob/"):
+            raise SystemExit(f"plain heartbeat dropped the binary frame (presence screenshot={url!r})")
+
+    results = []
+    try:
+        check_binary_frame_kept(make_jpeg(64, 64, seed=99))
+        tw, th = (int(v) for v in args.thumbnail.split("x"))
+        thumb = make_jpeg(tw, th, seed=0)
+        thumb_url = "data:image/jpeg;base64," + base64.b64encode(thumb).decode("ascii")
+        for n, size in enumerate(s for s in args.sizes.split(",") if s.strip()):
+            w, h = (int(v) for v in size.split("x"))
+            shot = make_jpeg(w, h, seed=n + 1)
+            shot_url = "data:image/jpeg;base64," + base64.b64encode(shot).decode("ascii")
+            student = f"bench{n}@load.test"
+            body = json.dumps({"student": student, "tab": {"id": 1, "url": "https://example.org/"},
+                               "screenshot": shot_url}).encode("utf-8")
+            row = {"size": size, "jpeg_bytes": len(shot)}
+            row["json_heartbeat"] = dict(measure(lambda: client.post(
+                "/api/heartbeat", data=body, content_type="application/json").status_code, args.repeat, reset),
+                request_bytes=len(body))
+            row["binary_screenshot"] = dict(measure(lambda: client.post(
+                f"/api/heartbeat/screenshot?student={student}", data=shot,
+                content_type="image/jpeg").status_code, args.repeat, reset), request_bytes=len(shot))
+            results.append(row)
+
+        ev = json.dumps({"student": "t@load.test", "thumbnail": thumb_url, "src": "https://img.test/a.jpg",
+                         "page_url": "https://example.org/"}).encode("utf-8")
+        results.append({
+            "size": args.thumbnail, "jpeg_bytes": len(thumb),
+            "json_evaluate": dict(measure(lambda: client.post(
+                "/api/image_filter/evaluate", data=ev, content_type="application/json").status_code, args.repeat, reset),
+                request_bytes=len(ev)),
+            "binary_evaluate": dict(measure(lambda: client.post(
+                "/api/image_filter/evaluate/binary?student=t@load.test&src=https://img.test/a.jpg",
+                data=thumb, content_type="image/jpeg").status_code, args.repeat, reset), request_bytes=len(thumb)),
+        })
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
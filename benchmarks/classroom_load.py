@@ -0,0 +1,312 @@
+"""
+Load simulation: N students running the extension loop while M teachers watch.
+
+Each simulated student runs `--rounds` iterations of what the extension does:
+heartbeat (tabs + screenshot), /api/policy, /api/commands, a few image
+filter evaluations and an off-task check, occasionally raising a hand.
+Teachers poll presence, raised hands and engagement until the students are
+done. Every class size runs in its own tenant seeded with a copy of
+data.json, so sizes can be swept in one go:
+
+    python benchmarks/classroom_load.py --sizes 25,50,100,200 --teachers 2
+    python benchmarks/classroom_load.py --sizes 100 --http      # through a real local HTTP server
+    python benchmarks/classroom_load.py --sizes 100 --sync      # heartbeat piggyback instead of polling
+
+Reports throughput, p50/p95/p99 latency per route and data.json growth.
+"""
+
+import argparse
+import base64
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+
+def _percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def _jpeg_pool(n, size, seed):
+    """Small solid/gradient JPEG data URLs; falls back to one tiny constant image without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return ["data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAP//////////////////////////////////////"
+                "////////////////////////////////////////////////wAALCAABAAEBAREA/8QAFAABAAAAAAAAAAAAAAAAAAAACf/E"
+                "ABQQAQAAAAAAAAAAAAAAAAAAAAD/2gAIAQEAAD8AKp//2Q=="]
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        img = Image.new("RGB", size, tuple(rnd.randrange(256) for _ in range(3)))
+        px = img.load()
+        for x in range(0, size[0], 4):
+            for y in range(size[1]):
+                px[x, y] = (x * 3 % 256, y * 5 % 256, rnd.randrange(256))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=60)
+        out.append("data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii"))
+    return out
+
+
+SITES = ["https://www.khanacademy.org/math", "https://docs.google.com/document/d/1", "https://en.wikipedia.org/wiki/Cell",
+         "https://www.youtube.com/watch?v=abc", "https://www.coolmathgames.com/", "https://classroom.google.com/",
+         "https://www.roblox.com/games", "https://quizlet.com/123/flashcards"]
+
+
+# ---------------------------
+# Transports
+# ---------------------------
+class TestClientTransport:
+    def __init__(self, app, headers):
+        self.app = app
+        self.headers = headers
+        self.local = threading.local()
+
+    def client(self, teacher=None):
+        cl = self.app.test_client()
+        if teacher:
+            with cl.session_transaction() as s:
+                s["user"] = teacher
+        return cl
+
+    def request(self, cl, method, path, body=None):
+        if cl is None:
+            cl = getattr(self.local, "client", None)
+            if cl is None:
+                cl = self.local.client = self.app.test_client()
+        r = cl.open(path, method=method, json=body, headers=self.headers)
+        return r.status_code, len(r.data), r.get_json(silent=True)
+
+
+class HttpTransport:
+    """Real sockets through werkzeug's threaded server on 127.0.0.1."""
+
+    def __init__(self, app, headers):
+        from werkzeug.serving import make_server
+        self.app = app
+        self.headers = headers
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.local = threading.local()
+
+    def client(self, teacher=None):
+        cookie = None
+        if teacher:
+            cl = self.app.test_client()
+            with cl.session_transaction() as s:
+                s["user"] = teacher
+            cookie = "session=" + cl.get_cookie("session").value
+        return {"cookie": cookie}
+
+    def request(self, cl, method, path, body=None):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        headers = dict(self.headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if cl and cl.get("cookie"):
+            headers["Cookie"] = cl["cookie"]
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            resp = conn.getresponse()
+            payload = resp.read()
+        except (http.client.HTTPException, OSError):
+            self.local.conn = None
+            raise
+        try:
+            doc = json.loads(payload) if payload else None
+        except ValueError:
+            doc = None
+        return resp.status, len(payload), doc
+
+    def close(self):
+        self.server.shutdown()
+
+
+# ---------------------------
+# Simulation
+# ---------------------------
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat = {}
+        self.errors = {}
+        self.bytes_out = 0
+
+    def call(self, transport, cl, method, route, path, body=None):
+        t0 = time.perf_counter()
+        try:
+            status, n, doc = transport.request(cl, method, path, body)
+        except Exception:
+            status, n, doc = 599, 0, None
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self.lock:
+            self.lat.setdefault(route, []).append(ms)
+            self.bytes_out += n
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, doc
+
+    def report(self, wall):
+        routes = {}
+        total = 0
+        for route, vals in sorted(self.lat.items()):
+            vals.sort()
+            total += len(vals)
+            routes[route] = {
+                "count": len(vals),
+                "errors": self.errors.get(route, 0),
+                "p50_ms": round(_percentile(vals, 50), 2),
+                "p95_ms": round(_percentile(vals, 95), 2),
+                "p99_ms": round(_percentile(vals, 99), 2),
+                "max_ms": round(vals[-1], 2),
+            }
+        return {"requests": total, "requests_per_s": round(total / wall, 1) if wall else None,
+                "response_bytes": self.bytes_out, "routes": routes}
+
+
+def run_size(gschool, args, n_students, shots, thumbs):
+    tid = f"load{n_students}x{args.teachers}"
+    token = f"bench-{tid}-{os.getpid()}"
+    gschool.tenancy.save_tenant(tid, name=f"Load test {n_students}", tokens=[token])
+    data_path = gschool.tenancy.path("data.json", tid)
+    for name in ("data.json", "scenes.json"):
+        src = os.path.join(REPO, name)
+        if os.path.exists(src):
+            shutil.copy(src, gschool.tenancy.path(name, tid))
+    headers = {"X-Tenant-Token": token}
+    transport = (HttpTransport if args.http else TestClientTransport)(gschool.app, headers)
+    rec = Recorder()
+    rnd = random.Random(n_students)
+
+    # First request prepares the tenant (schema + migrations); keep it out of the numbers.
+    transport.request(None, "POST", "/api/policy", {"student": "warmup@load.test"})
+    data_before = os.path.getsize(data_path)
+
+    def student(i):
+        email = f"s{i}@load.test"
+        cursor, applied = 0, None
+        for r in range(args.rounds):
+            url = SITES[(i + r) % len(SITES)]
+            tabs = [{"id": k, "url": SITES[(i + k) % len(SITES)], "title": f"Tab {k}"} for k in range(args.tabs)]
+            shot = shots[(i + r // 2) % len(shots)]
+            hb = {
+                "student": email, "student_name": f"Student {i}",
+                "tab": {"id": 0, "url": url, "title": "Active", "favIconUrl": ""},
+                "tabs": tabs, "screenshot": shot,
+            }
+            if args.sync:
+                hb["sync"] = {"ack": cursor}
+            _, doc = rec.call(transport, None, "POST", "/api/heartbeat", "/api/heartbeat", hb)
+            sync = (doc or {}).get("sync")
+            if sync:
+                # Piggybacked: only re-fetch policy when its version moved
+                cursor = sync.get("cursor", cursor)
+                if sync.get("policy_version") != applied:
+                    rec.call(transport, None, "POST", "/api/policy", "/api/policy", {"student": email})
+                    applied = sync.get("policy_version")
+            else:
+                rec.call(transport, None, "POST", "/api/policy", "/api/policy", {"student": email})
+                rec.call(transport, None, "GET", "/api/commands/<student>", f"/api/commands/{email}")
+            for k in range(args.images):
+                rec.call(transport, None, "POST", "/api/image_filter/evaluate", "/api/image_filter/evaluate", {
+                    "student": email, "thumbnail": thumbs[(i + k) % len(thumbs)],
+                    "src": f"https://img.example.com/{i}/{k}.jpg", "page_url": url,
+                })
+            rec.call(transport, None, "POST", "/api/offtask/check", "/api/offtask/check", {"student": email, "url": url})
+            if rnd.random() < args.raise_rate:
+                rec.call(transport, None, "POST", "/api/raise_hand", "/api/raise_hand", {"student": email, "note": "help"})
+            if args.interval:
+                time.sleep(args.interval)
+
+    done = threading.Event()
+
+    def teacher(j):
+        cl = transport.client({"email": f"t{j}@load.test", "role": "teacher", "tenant": tid})
+        while not done.is_set():
+            rec.call(transport, cl, "GET", "/api/presence", "/api/presence")
+            rec.call(transport, cl, "GET", "/api/raise_hand", "/api/raise_hand")
+            rec.call(transport, cl, "GET", "/api/engagement", "/api/engagement")
+            done.wait(args.teacher_interval)
+
+    teachers = [threading.Thread(target=teacher, args=(j,), daemon=True) for j in range(args.teachers)]
+    t0 = time.perf_counter()
+    for t in teachers:
+        t.start()
+    with ThreadPoolExecutor(max_workers=min(args.threads, n_students)) as pool:
+        list(pool.map(student, range(n_students)))
+    done.set()
+    for t in teachers:
+        t.join()
+    wall = time.perf_counter() - t0
+    if args.http:
+        transport.close()
+
+    out = {"students": n_students, "teachers": args.teachers, "rounds": args.rounds,
+           "transport": "http" if args.http else "test_client", "sync": bool(args.sync), "wall_s": round(wall, 3)}
+    out.update(rec.report(wall))
+    out["data_json_bytes"] = os.path.getsize(data_path)
+    out["data_json_growth_bytes"] = out["data_json_bytes"] - data_before
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="30", help="comma-separated class sizes to run, e.g. 25,50,100")
+    ap.add_argument("--teachers", type=int, default=1)
+    ap.add_argument("--rounds", type=int, default=3, help="extension loop iterations per student")
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--tabs", type=int, default=5)
+    ap.add_argument("--images", type=int, default=3, help="image evaluations per round")
+    ap.add_argument("--raise-rate", type=float, default=0.05)
+    ap.add_argument("--interval", type=float, default=0.0, help="student think time between rounds (s)")
+    ap.add_argument("--teacher-interval", type=float, default=0.5, help="seconds between teacher polls")
+    ap.add_argument("--http", action="store_true", help="go through a local HTTP server instead of the test client")
+    ap.add_argument("--sync", action="store_true", help="students use the heartbeat sync block instead of polling")
+    ap.add_argument("--out", help="also write the JSON results here")
+    args = ap.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="gschool-classroom-load-")
+    for name in ("data.json", "scenes.json"):
+        src = os.path.join(REPO, name)
+        if os.path.exists(src):
+            shutil.copy(src, scratch)
+    os.environ["GSCHOOL_DATA_DIR"] = scratch
+    sys.path.insert(0, REPO)
+    import app as gschool  # noqa: E402  (must import after GSCHOOL_DATA_DIR is set)
+
+    shots = _jpeg_pool(8, (320, 180), seed=1)
+    thumbs = _jpeg_pool(16, (48, 48), seed=2)
+    try:
+        results = [run_size(gschool, args, int(n), shots, thumbs) for n in args.sizes.split(",") if n.strip()]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0 if all(not r["routes"].get(k, {}).get("errors") for r in results for k in r["routes"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Load test: a whole school answering one poll at once.
+
+Runs against a scratch copy of the data files (GSCHOOL_DATA_DIR) using the
+Flask test client from many threads, then checks that the live tally
+matches what was sent.
+
+    python benchmarks/poll_load.py --students 2000 --threads 64
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+
+def _percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--students", type=int, default=1000)
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--options", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="gschool-poll-load-")
+    for name in ("data.json", "scenes.json"):
+        src = os.path.join(REPO, name)
+        if os.path.exists(src):
+            shutil.copy(src, scratch)
+    os.environ["GSCHOOL_DATA_DIR"] = scratch
+    sys.path.insert(0, REPO)
+    import app as gschool  # noqa: E402  (must import after GSCHOOL_DATA_DIR is set)
+
+    teacher = gschool.app.test_client()
+    with teacher.session_transaction() as s:
+        s["user"] = {"email": "teacher@load.test", "role": "teacher"}
+    opts = [f"Option {i + 1}" for i in range(args.options)]
+    poll_id = teacher.post("/api/poll", json={"question": "Load test?", "options": opts}).get_json()["poll_id"]
+
+    answers = [random.choice(opts) for _ in range(args.students)]
+    latencies = [0.0] * args.students
+    errors = []
+    local = threading.local()
+
+    def answer(i):
+        cl = getattr(local, "client", None)
+        if cl is None:
+            cl = local.client = gschool.app.test_client()
+        t0 = time.perf_counter()
+        r = cl.post("/api/poll_response", json={
+            "poll_id": poll_id, "student": f"s{i}@load.test", "answer": answers[i],
+        })
+        latencies[i] = (time.perf_counter() - t0) * 1000.0
+        if r.status_code != 200:
+            errors.append(r.status_code)
+
+    data_before = os.path.getsize(gschool.tenancy.path("data.json"))
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(answer, range(args.students)))
+    wall = time.perf_counter() - t0
+
+    summary = teacher.get(f"/api/poll/{poll_id}/results").get_json()["summary"]
+    expected = {o: answers.count(o) for o in opts}
+    lat = sorted(latencies)
+    report = {
+        "students": args.students,
+        "threads": args.threads,
+        "wall_s": round(wall, 3),
+        "responses_per_s": round(args.students / wall, 1) if wall else None,
+        "latency_ms": {
+            "p50": round(_percentile(lat, 50), 2),
+            "p95": round(_percentile(lat, 95), 2),
+            "p99": round(_percentile(lat, 99), 2),
+            "max": round(lat[-1], 2) if lat else 0.0,
+        },
+        "errors": len(errors),
+        "tally_matches": summary["counts"] == expected and summary["respondents"] == args.students,
+        "data_json_growth_bytes": os.path.getsize(gschool.tenancy.path("data.json")) - data_before,
+    }
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(scratch, ignore_errors=True)
+    return 0 if report["tally_matches"] and not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
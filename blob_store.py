@@ -0,0 +1,184 @@
+"""
+Content-addressed store for uploaded screenshots and thumbnails.
+
+Blobs live under the tenant's screenshots/ directory as <sha256[:2]>/<sha256>.
+put_stream() copies an upload in CHUNK_BYTES pieces into a temp file while
+hashing it, then renames it into place, so an upload never exists in memory
+as one string (let alone as base64 inside a JSON document) and identical
+frames are stored once. stage_stream() stops before the rename, so a caller
+can inspect the temp file (e.g. drop a near-duplicate screenshot) and then
+commit() or discard() it. Reads past `max_bytes` stop the copy and raise
+TooLarge. Files older than RETENTION_DAYS are pruned about once an hour.
+
+Interface:
+    put_stream(stream, max_bytes=MAX_BYTES) -> (sha, size)
+    stage_stream(stream, max_bytes=MAX_BYTES) -> Upload   # .path (temp file), .sha, .size
+    commit(upload) -> sha
+    discard(upload)
+    put_bytes(data) -> (sha, size)
+    path_for(sha) -> str | None          # None for unknown / malformed ids
+    url_for(sha) -> str                  # "/api/blob/<sha>"
+    sniff_mimetype(path) -> str
+    prune(retention_days=RETENTION_DAYS) -> int
+"""
+
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+
+import tenancy
+
+CHUNK_BYTES = 64 * 1024
+MAX_BYTES = int(os.environ.get("MAX_BLOB_BYTES", str(8 * 1024 * 1024)) or 0)
+RETENTION_DAYS = int(os.environ.get("BLOB_RETENTION_DAYS", "7") or 0)
+PRUNE_INTERVAL_SECONDS = 3600
+
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+_last_prune = {}
+_prune_lock = threading.Lock()
+
+
+class TooLarge(ValueError):
+    pass
+
+
+def _root():
+    return tenancy.path("screenshots")
+
+
+def path_for(sha):
+    sha = (sha or "").lower()
+    if not _SHA_RE.match(sha):
+        return None
+    return os.path.join(_root(), sha[:2], sha)
+
+
+def url_for(sha):
+    return f"/api/blob/{sha}"
+
+
+class Upload:
+    """An upload held in a temp file until commit() or discard()."""
+
+    __slots__ = ("path", "sha", "size")
+
+    def __init__(self, path, sha, size):
+        self.path = path
+        self.sha = sha
+        self.size = size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def stage_stream(stream, max_bytes=MAX_BYTES):
+    """Copy a readable binary stream into a temp file in the store, hashing it; returns an Upload."""
+    root = _root()
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f".upload.{os.getpid()}.{threading.get_ident()}")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise TooLarge(f"upload exceeds {max_bytes} bytes")
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        _remove(tmp)
+        raise
+    return Upload(tmp, h.hexdigest(), size)
+
+
+def commit(upload):
+    """Move a staged upload into place (identical content is kept once); returns its sha."""
+    final = path_for(upload.sha)
+    try:
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        if os.path.exists(final):
+            _remove(upload.path)
+            os.utime(final)  # keep a re-sent frame from being pruned
+        else:
+            os.replace(upload.path, final)
+    except BaseException:
+        _remove(upload.path)
+        raise
+    _maybe_prune()
+    return upload.sha
+
+
+def discard(upload):
+    """Drop a staged upload that is not kept."""
+    _remove(upload.path)
+
+
+def put_stream(stream, max_bytes=MAX_BYTES):
+    """Copy a readable binary stream into the store; returns (sha256 hex, size)."""
+    upload = stage_stream(stream, max_bytes)
+    return commit(upload), upload.size
+
+
+def put_bytes(data):
+    return put_stream(io.BytesIO(data), max_bytes=0)
+
+
+def sniff_mimetype(path):
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def prune(retention_days=RETENTION_DAYS):
+    if not retention_days:
+        return 0
+    cutoff = time.time() - int(retention_days) * 86400
+    removed = 0
+    root = _root()
+    if not os.path.isdir(root):
+        return 0
+    for sub in os.listdir(root):
+        subdir = os.path.join(root, sub)
+        if len(sub) != 2 or not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            p = os.path.join(subdir, name)
+            try:
+                if os.path.getmtime(p) < cutoff:
+                    os.remove(p)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _maybe_prune():
+    tid = tenancy.current()
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune.get(tid, 0.0) < PRUNE_INTERVAL_SECONDS:
+            return
+        _last_prune[tid] = now
+    try:
+        prune()
+    except Exception as e:
+        print("[WARN] blob prune failed:", e)
@@ -0,0 +1,301 @@
+"""
+Indexed chat message store (SQLite) shared by the AI chat rooms and DMs.
+
+Every message gets a monotonic integer id, which is the only cursor
+clients should use: `ts` is stored in milliseconds for all rooms (older
+second-resolution rows are migrated once), but timestamps are not unique
+and used to be written with mixed units, so `since=<ts>` is kept only for
+backwards compatibility.
+
+Interface:
+    ensure_schema()                                   # idempotent, runs once per tenant per process
+    add_message(room, user_id, role, text) -> dict    # {"id", "room", "user_id", "role", "text", "ts"}
+    messages_after(room, after_id=0, limit=200) -> list[dict]
+    messages_since_ts(room, since_ts_ms, limit=200) -> list[dict]
+    wait_for_messages(room, after_id, timeout) -> list[dict]   # long-poll
+    prune(retention_days=RETENTION_DAYS, dm_retention_days=DM_RETENTION_DAYS) -> int
+
+Direct messages live in the same table (room "dm:<student>"). A small
+dm_conversations table keeps one row per student with an unread counter
+that is bumped on every student message and reset on mark-read, so the
+teacher's unread summary never has to count messages:
+    send_dm(student, user_id, role, text) -> dict
+    dm_history(student, after_id=0, limit=200) -> list[dict]
+    mark_dm_read(student)
+    dm_unread_summary() -> {student: unread}
+    import_dm(student, messages)      # one-off migration from data.json["dm"]
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import tenancy
+
+# Messages older than this are deleted; 0 disables pruning.
+RETENTION_DAYS = int(os.environ.get("CHAT_RETENTION_DAYS", "30") or 0)
+# Teacher/student DMs are kept until a school opts in to a window of its own.
+DM_RETENTION_DAYS = int(os.environ.get("DM_RETENTION_DAYS", "0") or 0)
+PRUNE_INTERVAL_SECONDS = 3600
+# Long-poll waits re-check the database at least this often so messages
+# written by other worker processes are picked up too.
+_RECHECK_SECONDS = 1.0
+
+# Tenants whose schema has been checked in this process
+_schema_ready = set()
+_schema_lock = threading.Lock()
+_new_message = threading.Condition()
+_last_prune = {}
+
+_COLUMNS = "id, room, user_id, role, text, ts"
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def ensure_schema():
+    tid = tenancy.current()
+    if tid in _schema_ready:
+        return
+    with _schema_lock:
+        if tid in _schema_ready:
+            return
+        with _db() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS chat_messages(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                room TEXT,
+                user_id TEXT,
+                role TEXT,
+                text TEXT,
+                ts INTEGER
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_room_id ON chat_messages(room, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_room_ts ON chat_messages(room, ts)")
+            # Older DM rows were written in seconds; everything is milliseconds now.
+            conn.execute("UPDATE chat_messages SET ts = ts * 1000 WHERE ts < 100000000000")
+            cur = conn.cursor()
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='dm_conversations'")
+            fresh = cur.fetchone() is None
+            conn.execute("""CREATE TABLE IF NOT EXISTS dm_conversations(
+                student TEXT PRIMARY KEY,
+                unread INTEGER NOT NULL DEFAULT 0,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                last_ts INTEGER NOT NULL DEFAULT 0
+            )""")
+            if fresh:
+                _backfill_dm_conversations(conn)
+            conn.commit()
+        _schema_ready.add(tid)
+
+
+def _backfill_dm_conversations(conn):
+    """Build counters for DM rooms that predate dm_conversations.
+
+    Student messages newer than the last teacher reply count as unread.
+    """
+    conn.execute("""
+        INSERT OR REPLACE INTO dm_conversations(student, unread, last_id, last_ts)
+        SELECT substr(m.room, 4),
+               SUM(CASE WHEN m.role = 'student' AND m.id > COALESCE(t.last_reply, 0) THEN 1 ELSE 0 END),
+               MAX(m.id), MAX(m.ts)
+        FROM chat_messages m
+        LEFT JOIN (
+            SELECT room, MAX(id) AS last_reply FROM chat_messages
+            WHERE room LIKE 'dm:%' AND role != 'student' GROUP BY room
+        ) t ON t.room = m.room
+        WHERE m.room LIKE 'dm:%'
+        GROUP BY m.room
+    """)
+
+
+def _row(r):
+    return {"id": r[0], "room": r[1], "user_id": r[2], "role": r[3], "text": r[4], "ts": r[5]}
+
+
+def _insert(conn, room, user_id, role, text, ts):
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO chat_messages(room,user_id,role,text,ts) VALUES(?,?,?,?,?)",
+        (room, user_id, role, text, ts),
+    )
+    return cur.lastrowid
+
+
+def _notify():
+    with _new_message:
+        _new_message.notify_all()
+    _maybe_prune()
+
+
+def add_message(room, user_id, role, text):
+    ensure_schema()
+    ts = now_ms()
+    with _db() as conn:
+        msg_id = _insert(conn, room, user_id, role, text, ts)
+        conn.commit()
+    _notify()
+    return {"id": msg_id, "room": room, "user_id": user_id, "role": role, "text": text, "ts": ts}
+
+
+def messages_after(room, after_id=0, limit=200):
+    """Messages in `room` with id > after_id, oldest first."""
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM chat_messages WHERE room=? AND id>? ORDER BY id ASC LIMIT ?",
+            (room, int(after_id or 0), int(limit)),
+        )
+        return [_row(r) for r in cur.fetchall()]
+
+
+def latest_messages(room, limit=200):
+    """The newest `limit` messages in `room`, returned oldest first."""
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM chat_messages WHERE room=? ORDER BY id DESC LIMIT ?",
+            (room, int(limit)),
+        )
+        rows = [_row(r) for r in cur.fetchall()]
+    rows.reverse()
+    return rows
+
+
+def messages_since_ts(room, since_ts_ms, limit=200):
+    """Legacy `since=<ts>` lookup; prefer messages_after()."""
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM chat_messages WHERE room=? AND ts>? ORDER BY ts ASC, id ASC LIMIT ?",
+            (room, int(since_ts_ms or 0), int(limit)),
+        )
+        return [_row(r) for r in cur.fetchall()]
+
+
+def wait_for_messages(room, after_id=0, timeout=25.0, limit=200):
+    """Block until `room` has a message with id > after_id or `timeout` elapses."""
+    deadline = time.time() + max(0.0, float(timeout))
+    while True:
+        rows = messages_after(room, after_id, limit)
+        remaining = deadline - time.time()
+        if rows or remaining <= 0:
+            return rows
+        with _new_message:
+            _new_message.wait(min(_RECHECK_SECONDS, remaining))
+
+
+# =========================
+# Direct messages
+# =========================
+
+def dm_room(student):
+    return f"dm:{student}"
+
+
+def _bump_conversation(conn, student, unread, msg_id, ts):
+    conn.execute(
+        """INSERT INTO dm_conversations(student, unread, last_id, last_ts) VALUES(?,?,?,?)
+           ON CONFLICT(student) DO UPDATE SET
+               unread = unread + excluded.unread,
+               last_id = excluded.last_id,
+               last_ts = excluded.last_ts""",
+        (student, unread, msg_id, ts),
+    )
+
+
+def send_dm(student, user_id, role, text):
+    """Store a DM and update the conversation's unread counter atomically."""
+    ensure_schema()
+    ts = now_ms()
+    room = dm_room(student)
+    with _db() as conn:
+        msg_id = _insert(conn, room, user_id, role, text, ts)
+        _bump_conversation(conn, student, 1 if role == "student" else 0, msg_id, ts)
+        conn.commit()
+    _notify()
+    return {"id": msg_id, "room": room, "user_id": user_id, "role": role, "text": text, "ts": ts}
+
+
+def dm_history(student, after_id=0, limit=200):
+    """A student's DMs, oldest first. Without a cursor, the newest `limit`."""
+    if after_id:
+        return messages_after(dm_room(student), after_id, limit)
+    return latest_messages(dm_room(student), limit)
+
+
+def mark_dm_read(student):
+    ensure_schema()
+    with _db() as conn:
+        conn.execute("UPDATE dm_conversations SET unread=0 WHERE student=?", (student,))
+        conn.commit()
+
+
+def dm_unread_summary():
+    """{student: unread} for every conversation with unread student messages."""
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT student, unread FROM dm_conversations WHERE unread > 0")
+        return {s: n for (s, n) in cur.fetchall()}
+
+
+def import_dm(student, messages):
+    """Import legacy data.json["dm"][student] messages ({from, text, ts, unread})."""
+    ensure_schema()
+    room = dm_room(student)
+    with _db() as conn:
+        for m in messages or []:
+            if not isinstance(m, dict) or not (m.get("text") or "").strip():
+                continue
+            role = "student" if m.get("from") == "student" else "teacher"
+            ts = int(m.get("ts") or 0)
+            if ts < 100000000000:
+                ts *= 1000
+            msg_id = _insert(conn, room, m.get("user") or (student if role == "student" else "teacher"),
+                             role, m["text"], ts)
+            unread = 1 if (role == "student" and m.get("unread", True)) else 0
+            _bump_conversation(conn, student, unread, msg_id, ts)
+        conn.commit()
+
+
+def prune(retention_days=None, dm_retention_days=None):
+    """
+    Delete messages older than the retention window: RETENTION_DAYS for chat
+    rooms, DM_RETENTION_DAYS for DM rooms (0 keeps them). Returns rows removed.
+    """
+    ensure_schema()
+    days = RETENTION_DAYS if retention_days is None else int(retention_days)
+    dm_days = DM_RETENTION_DAYS if dm_retention_days is None else int(dm_retention_days)
+    removed = 0
+    with _db() as conn:
+        if days > 0:
+            cutoff = now_ms() - days * 86400 * 1000
+            removed += conn.execute("DELETE FROM chat_messages WHERE ts < ? AND room NOT LIKE 'dm:%'",
+                                    (cutoff,)).rowcount
+        if dm_days > 0:
+            cutoff = now_ms() - dm_days * 86400 * 1000
+            removed += conn.execute("DELETE FROM chat_messages WHERE ts < ? AND room LIKE 'dm:%'",
+                                    (cutoff,)).rowcount
+        conn.commit()
+    return removed
+
+
+def _maybe_prune():
+    tid = tenancy.current()
+    now = time.time()
+    if now - _last_prune.get(tid, 0.0) < PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune[tid] = now
+    try:
+        prune()
+    except Exception as e:
+        print("[WARN] chat prune failed:", e)
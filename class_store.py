@@ -0,0 +1,229 @@
+"""
+Per-class state shards.
+
+Each class lives in its own JSON file, <tenant data dir>/classes/<class_id>.json,
+holding everything scoped to that class:
+
+    name, active, focus_mode, paused, allowlist, teacher_blocks, students,
+    scenes_current, pending_commands, chat
+
+Writes take a per-class lock (a thread lock plus an flock on a sidecar
+file, so several worker processes are safe too) and replace the file
+atomically, so teachers driving different classes never contend with or
+rewrite each other's state. A student -> class index in SQLite
+(class_members) answers "which classes is this student in" without
+opening every shard.
+
+Interface:
+    DEFAULT_CLASS_ID
+    clean_id(cid) -> str
+    list_ids() -> list[str]
+    get(cid) -> dict                      # a copy; default shard if the class doesn't exist yet
+    exists(cid) -> bool
+    update(cid, fn) -> dict               # fn(shard) mutates in place; returns a copy
+    delete(cid)
+    classes_for(student) -> list[str]
+"""
+
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+try:
+    import fcntl
+except Exception:  # not available on Windows – thread locks only
+    fcntl = None
+
+import metrics
+import tenancy
+
+DEFAULT_CLASS_ID = "period1"
+
+# Locks and the parsed-shard cache are keyed by file path, so tenants never share entries.
+_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+_cache = {}
+# Tenants whose schema has been checked in this process
+_schema_ready = set()
+
+
+def _classes_dir():
+    return tenancy.path("classes")
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def ensure_schema():
+    if tenancy.current() in _schema_ready:
+        return
+    os.makedirs(_classes_dir(), exist_ok=True)
+    with _db() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS class_members(
+            student TEXT,
+            class_id TEXT,
+            PRIMARY KEY(student, class_id)
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_class_members_class ON class_members(class_id)")
+        conn.commit()
+    _schema_ready.add(tenancy.current())
+
+
+def clean_id(cid):
+    return re.sub(r"[^a-zA-Z0-9_-]+", "", str(cid or "")) or DEFAULT_CLASS_ID
+
+
+def _path(cid):
+    return os.path.join(_classes_dir(), cid + ".json")
+
+
+def default_shard(cid):
+    return {
+        "id": cid,
+        "name": "Period 1" if cid == DEFAULT_CLASS_ID else cid,
+        "active": True,
+        "focus_mode": False,
+        "paused": False,
+        "allowlist": [],
+        "teacher_blocks": [],
+        "students": [],
+        "scenes_current": [],
+        "pending_commands": [],
+        "chat": [],
+    }
+
+
+def _normalize(cid, obj):
+    if not isinstance(obj, dict):
+        obj = {}
+    for k, v in default_shard(cid).items():
+        obj.setdefault(k, v)
+    obj["id"] = cid
+    return obj
+
+
+def _read(cid):
+    """Read a shard through the mtime-validated cache (no copy)."""
+    path = _path(cid)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    hit = _cache.get(path)
+    if hit and hit[0] == mtime:
+        metrics.inc("gschool_cache_requests_total", help="Cache lookups by cache and result", cache="class_shard", result="hit")
+        return hit[1]
+    metrics.inc("gschool_cache_requests_total", help="Cache lookups by cache and result", cache="class_shard", result="miss")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = _normalize(cid, json.load(f))
+    except Exception as e:
+        print(f"[WARN] class shard {cid} unreadable:", e)
+        return None
+    _cache[path] = (mtime, obj)
+    return obj
+
+
+def _write(cid, obj):
+    path = _path(cid)
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+    try:
+        _cache[path] = (os.stat(path).st_mtime_ns, obj)
+    except OSError:
+        _cache.pop(path, None)
+
+
+def list_ids():
+    ensure_schema()
+    return sorted(n[:-5] for n in os.listdir(_classes_dir()) if n.endswith(".json"))
+
+
+def exists(cid):
+    return os.path.exists(_path(clean_id(cid)))
+
+
+def get(cid):
+    ensure_schema()
+    cid = clean_id(cid)
+    obj = _read(cid)
+    return copy.deepcopy(obj) if obj is not None else default_shard(cid)
+
+
+class _ClassLock:
+    def __init__(self, cid):
+        self.path = os.path.join(_classes_dir(), cid + ".lock")
+        with _locks_guard:
+            self.tlock = _locks[self.path]
+        self.fh = None
+
+    def __enter__(self):
+        self.tlock.acquire()
+        if fcntl is not None:
+            self.fh = open(self.path, "a")
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fh is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+            self.fh.close()
+        self.tlock.release()
+
+
+def update(cid, fn):
+    """Apply fn(shard) under the class lock and persist the result."""
+    ensure_schema()
+    cid = clean_id(cid)
+    with _ClassLock(cid):
+        cur = _read(cid)
+        obj = copy.deepcopy(cur) if cur is not None else default_shard(cid)
+        before = list(obj.get("students") or [])
+        fn(obj)
+        obj = _normalize(cid, obj)
+        obj["students"] = [s for s in obj.get("students") or [] if s]
+        _write(cid, obj)
+        if cur is None or before != obj["students"]:
+            _reindex(cid, obj["students"])
+        return copy.deepcopy(obj)
+
+
+def delete(cid):
+    ensure_schema()
+    cid = clean_id(cid)
+    with _ClassLock(cid):
+        try:
+            os.remove(_path(cid))
+        except OSError:
+            pass
+        _cache.pop(_path(cid), None)
+        _reindex(cid, [])
+
+
+def _reindex(cid, students):
+    with _db() as conn:
+        conn.execute("DELETE FROM class_members WHERE class_id=?", (cid,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO class_members(student, class_id) VALUES(?,?)",
+            [((s or "").strip().lower(), cid) for s in students if (s or "").strip()],
+        )
+        conn.commit()
+
+
+def classes_for(student):
+    """Class ids whose roster contains `student` (case-insensitive)."""
+    student = (student or "").strip().lower()
+    if not student:
+        return []
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT class_id FROM class_members WHERE student=? ORDER BY class_id", (student,))
+        return [r[0] for r in cur.fetchall()]
@@ -0,0 +1,199 @@
+"""
+HTTP compression: negotiated gzip/brotli responses and gzip request bodies.
+
+Responses: compress_response() picks the best encoding the client accepts
+(br when the optional Brotli package is installed, else gzip) for
+uncompressed, non-streamed text/JSON bodies of at least MIN_BYTES. Hot
+payloads such as /api/presence are identical across many teacher polls, so
+compressed bodies are cached by a digest of the uncompressed bytes (up to
+CACHE_BYTES in total, least recently used first out); hashing is far
+cheaper than recompressing.
+
+Requests: GzipRequestMiddleware inflates `Content-Encoding: gzip` bodies on
+the configured path prefixes before Flask parses them, refusing bodies that
+inflate past MAX_REQUEST_BYTES.
+
+Interface:
+    choose_encoding(accept_encoding) -> "br" | "gzip" | None
+    compress(data, encoding) -> bytes
+    compress_response(resp, accept_encoding) -> resp
+    GzipRequestMiddleware(wsgi_app, prefixes)
+    cache_info() -> dict
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import metrics
+
+MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024") or 0)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+CACHE_BYTES = int(os.environ.get("COMPRESS_CACHE_BYTES", str(32 * 1024 * 1024)) or 0)
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_DECODED_REQUEST_BYTES", str(64 * 1024 * 1024)) or 0)
+
+COMPRESSIBLE = ("application/json", "application/javascript", "application/x-ndjson", "image/svg+xml")
+
+_brotli = None
+_brotli_checked = False
+_cache = OrderedDict()   # (encoding, digest) -> compressed bytes
+_cache_size = 0
+_cache_hits = 0
+_cache_misses = 0
+_lock = threading.Lock()
+
+
+def _get_brotli():
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_checked = True
+    return _brotli
+
+
+def choose_encoding(accept_encoding):
+    """Best supported coding in an Accept-Encoding header, honouring q=0."""
+    prefs = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        prefs[token] = q
+    star = prefs.get("*", 0.0)
+    if prefs.get("br", star) > 0 and _get_brotli() is not None:
+        return "br"
+    if prefs.get("gzip", prefs.get("x-gzip", star)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return _get_brotli().compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_cached(data, encoding):
+    global _cache_size, _cache_hits, _cache_misses
+    if not CACHE_BYTES:
+        return compress(data, encoding)
+    key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            _cache_hits += 1
+            return hit
+        _cache_misses += 1
+    out = compress(data, encoding)
+    with _lock:
+        if key not in _cache and len(out) <= CACHE_BYTES:
+            _cache[key] = out
+            _cache_size += len(out)
+            while _cache_size > CACHE_BYTES:
+                _, old = _cache.popitem(last=False)
+                _cache_size -= len(old)
+    return out
+
+
+def _compressible(resp):
+    if resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers:
+        return False
+    if resp.status_code < 200 or resp.status_code in (204, 206, 304):
+        return False
+    mt = resp.mimetype or ""
+    return mt.startswith("text/") or mt in COMPRESSIBLE
+
+
+def compress_response(resp, accept_encoding):
+    if not _compressible(resp):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = choose_encoding(accept_encoding)
+    if not encoding:
+        return resp
+    data = resp.get_data()
+    if len(data) < MIN_BYTES:
+        return resp
+    out = _compress_cached(data, encoding)
+    if len(out) >= len(data):
+        return resp
+    resp.set_data(out)
+    resp.headers["Content-Encoding"] = encoding
+    if resp.headers.get("ETag"):
+        resp.headers["ETag"] = resp.headers["ETag"].rstrip('"') + f'-{encoding}"'
+    metrics.inc("gschool_http_compressed_bytes_total", len(data), "Response bytes before compression",
+                encoding=encoding, stage="in")
+    metrics.inc("gschool_http_compressed_bytes_total", len(out), encoding=encoding, stage="out")
+    return resp
+
+
+def cache_info():
+    with _lock:
+        return {"entries": len(_cache), "bytes": _cache_size, "hits": _cache_hits, "misses": _cache_misses}
+
+
+class GzipRequestMiddleware:
+    """Inflate gzip request bodies for the given path prefixes before the app sees them."""
+
+    def __init__(self, wsgi_app, prefixes):
+        self.wsgi_app = wsgi_app
+        self.prefixes = tuple(prefixes)
+
+    def __call__(self, environ, start_response):
+        enc = (environ.get("HTTP_CONTENT_ENCODING") or "").strip().lower()
+        if enc in ("gzip", "x-gzip") and environ.get("PATH_INFO", "").startswith(self.prefixes):
+            try:
+                body = self._inflate(environ)
+            except ValueError as e:
+                return self._error(start_response, "413 Request Entity Too Large", str(e))
+            except (OSError, EOFError, zlib.error):
+                return self._error(start_response, "400 Bad Request", "invalid gzip body")
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            environ.pop("HTTP_CONTENT_ENCODING", None)
+            metrics.inc("gschool_http_request_inflated_bytes_total", len(body),
+                        "Request bytes after inflating gzip bodies")
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def _inflate(environ):
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        stream = environ["wsgi.input"]
+        raw = stream.read(length) if length > 0 else stream.read()
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        limit = MAX_REQUEST_BYTES or None
+        out = d.decompress(raw, limit + 1) if limit else d.decompress(raw)
+        if limit and (len(out) > limit or d.unconsumed_tail):
+            raise ValueError("decoded body too large")
+        out += d.flush()
+        if not d.eof:
+            raise EOFError("truncated gzip body")
+        return out
+
+    @staticmethod
+    def _error(start_response, status, message):
+        body = json.dumps({"ok": False, "error": message}).encode("utf-8")
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
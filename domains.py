@@ -0,0 +1,150 @@
+"""
+Host / registered-domain normalization shared by the whole app.
+
+Built on the pinned public suffix list (public_suffix_list.dat, ICANN
+section only, the same rules tldextract applies by default) compiled
+once into a label trie. Lookups walk the host's labels right-to-left, so
+cost depends on the number of labels, not the size of the list, and
+results are kept in an LRU cache since a classroom visits the same few
+hundred hosts over and over.
+
+Interface:
+    host_of(url) -> str                        # "https://WWW.Example.co.uk:443/x" -> "www.example.co.uk"
+    split_host(host) -> (subdomain, domain, suffix)
+    registered_domain(host) -> str             # "example.co.uk"; IPs/unknown TLDs -> the host part
+    domain_of(url) -> str                      # registered_domain(host_of(url))
+    host_matches(host, domain) -> bool         # host is domain or a subdomain of it
+    cache_info() -> dict
+"""
+
+import os
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+PSL_PATH = os.path.join(os.path.dirname(__file__), "public_suffix_list.dat")
+
+CACHE_SIZE = 65536
+
+_RULE = "$"        # a suffix rule ends at this node
+_EXCEPTION = "!"   # "!rule": this label is NOT part of the suffix
+_WILDCARD = "*"
+
+_IPV4 = re.compile(r"^\d{1,3}(\.\d{1,3}){3}$")
+
+_trie = None
+
+
+def _add_rule(trie, rule):
+    exception = rule.startswith("!")
+    if exception:
+        rule = rule[1:]
+    node = trie
+    for label in reversed(rule.split(".")):
+        node = node.setdefault(label, {})
+    node[_EXCEPTION if exception else _RULE] = True
+
+
+def _compile(path=PSL_PATH):
+    trie = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("// ===BEGIN PRIVATE DOMAINS==="):
+                break
+            if not line or line.startswith("//"):
+                continue
+            rule = line.split()[0].lower()
+            _add_rule(trie, rule)
+            # Hosts usually arrive punycoded; index IDN rules in both forms.
+            if not rule.isascii():
+                try:
+                    _add_rule(trie, rule.encode("idna").decode("ascii"))
+                except UnicodeError:
+                    pass
+    return trie
+
+
+def _get_trie():
+    global _trie
+    if _trie is None:
+        _trie = _compile()
+    return _trie
+
+
+def _suffix_len(labels):
+    """How many trailing labels form the public suffix."""
+    node = _get_trie()
+    matched = 0
+    for depth, label in enumerate(reversed(labels)):
+        child = node.get(label)
+        if child is not None:
+            if _EXCEPTION in child:
+                return depth
+            if _RULE in child:
+                matched = depth + 1
+            node = child
+            continue
+        wild = node.get(_WILDCARD)
+        if wild is not None:
+            matched = depth + 1
+            node = wild
+            continue
+        break
+    return matched
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_host(host):
+    host = (host or "").strip().lower().rstrip(".")
+    if not host:
+        return ("", "", "")
+    if ":" in host or _IPV4.match(host):
+        return ("", host, "")
+    labels = host.split(".")
+    n = _suffix_len(labels)
+    if n == 0:
+        return (".".join(labels[:-1]), labels[-1], "")
+    if n >= len(labels):
+        return ("", "", host)
+    return (".".join(labels[:-n - 1]), labels[-n - 1], ".".join(labels[-n:]))
+
+
+def registered_domain(host):
+    _, domain, suffix = split_host(host)
+    if domain and suffix:
+        return domain + "." + suffix
+    return domain or suffix
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def host_of(url):
+    url = (url or "").strip()
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "//" + url
+    try:
+        return (urlsplit(url).hostname or "").rstrip(".")
+    except ValueError:
+        return ""
+
+
+def domain_of(url):
+    return registered_domain(host_of(url))
+
+
+def host_matches(host, domain):
+    host = (host or "").lower()
+    domain = (domain or "").lower().lstrip(".")
+    if not host or not domain:
+        return False
+    return host == domain or host.endswith("." + domain)
+
+
+def cache_info():
+    out = {}
+    for name, fn in (("split_host", split_host), ("host_of", host_of)):
+        ci = fn.cache_info()
+        out[name] = {"hits": ci.hits, "misses": ci.misses, "size": ci.currsize, "maxsize": ci.maxsize}
+    return out
@@ -0,0 +1,108 @@
+"""
+Tiny in-process event bus with a Server-Sent Events adapter.
+
+Producers call publish(topic, payload); each subscriber owns a bounded
+queue and receives only the topics it asked for. Slow subscribers lose
+their oldest events rather than blocking producers, so publishing never
+stalls a request. Subscriptions are scoped to the tenant that opened them
+and only see events published while that tenant is current.
+
+Interface:
+    publish(topic: str, payload: dict) -> None
+    subscribe(topics: Iterable[str] | None) -> Subscription   # None = all topics
+    Subscription.get(timeout) -> (topic, payload) | None
+    Subscription.close()
+    sse_stream(sub, keepalive=15.0) -> Iterator[str]          # text/event-stream chunks
+    subscriber_count() -> int
+    queue_depths() -> [(tenant, depth, dropped), ...]
+"""
+
+import json
+import queue
+import threading
+import time
+
+import tenancy
+
+MAX_QUEUE = 256
+
+_subs = set()
+_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, topics=None):
+        self.topics = set(topics) if topics else None
+        self.tenant = tenancy.current()
+        self.q = queue.Queue(maxsize=MAX_QUEUE)
+        self.dropped = 0
+
+    def wants(self, tenant, topic):
+        return tenant == self.tenant and (self.topics is None or topic in self.topics)
+
+    def offer(self, item):
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            try:
+                self.q.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.q.put_nowait(item)
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        try:
+            return self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with _lock:
+            _subs.discard(self)
+
+
+def subscribe(topics=None):
+    sub = Subscription(topics)
+    with _lock:
+        _subs.add(sub)
+    return sub
+
+
+def publish(topic, payload):
+    tenant = tenancy.current()
+    with _lock:
+        targets = [s for s in _subs if s.wants(tenant, topic)]
+    item = (topic, payload)
+    for s in targets:
+        s.offer(item)
+
+
+def subscriber_count():
+    with _lock:
+        return len(_subs)
+
+
+def queue_depths():
+    """Pending events per subscriber and events dropped so far, for metrics."""
+    with _lock:
+        subs = list(_subs)
+    return [(s.tenant, s.q.qsize(), s.dropped) for s in subs]
+
+
+def sse_stream(sub, keepalive=15.0):
+    """Yield SSE frames for `sub` until the client disconnects."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            item = sub.get(timeout=keepalive)
+            if item is None:
+                yield f": keepalive {int(time.time())}\n\n"
+                continue
+            topic, payload = item
+            yield f"event: {topic}\ndata: {json.dumps(payload)}\n\n"
+    finally:
+        sub.close()
@@ -0,0 +1,153 @@
+"""
+Streaming exports of the timeline, alerts and audit log as NDJSON or CSV.
+
+Rows are read off a database cursor (or walked in an already loaded list)
+and encoded one at a time into chunks of about CHUNK_BYTES, so an export of
+any size runs in constant memory. Every row carries a "cursor"; passing it
+back as ?cursor= resumes the export right after that row. A response stops
+cleanly after `limit` rows or MAX_SECONDS, so a worker is never tied up by
+one huge download: NDJSON then ends with {"next_cursor": ...}, and with
+{"done": true} when the range is exhausted. CSV has no trailer; resume from
+the cursor column of the last row received.
+
+Cursors:
+    history  "<ts>:<student>"     (intervals ordered by start, then student)
+    alerts   "<ts>:<n>"           (the n-th alert raised at second ts)
+    audit    "<id>"
+
+Interface:
+    KINDS, FORMATS, COLUMNS
+    history_rows(stored, pending, cursor=None, since=None, until=None, student=None, domain=None)
+    alert_rows(alerts, cursor=None, since=None, until=None, student=None, kind=None)
+    audit_rows(stored)
+    encode(rows, fmt, columns, cursor=None, limit=0, max_seconds=MAX_SECONDS) -> iterator of bytes
+    parse_cursor(kind, cursor) -> tuple | None          # ValueError when malformed
+"""
+
+import csv
+import heapq
+import io
+import json
+import os
+import time
+
+KINDS = ("history", "alerts", "audit")
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+COLUMNS = {
+    "history": ["student", "ts", "end", "duration", "domain", "url", "title", "category"],
+    "alerts": ["ts", "student", "kind", "score", "title", "url", "domain", "note"],
+    "audit": ["id", "ts", "event", "user", "subject", "data"],
+}
+CHUNK_BYTES = 64 * 1024
+MAX_SECONDS = float(os.environ.get("EXPORT_MAX_SECONDS", "25") or 0)
+
+
+def parse_cursor(kind, cursor):
+    if not cursor:
+        return None
+    if kind == "audit":
+        return (int(cursor),)
+    head, sep, tail = str(cursor).partition(":")
+    if not sep:
+        raise ValueError("malformed cursor")
+    return (int(head), tail if kind == "history" else int(tail))
+
+
+def history_rows(stored, pending, cursor=None, since=None, until=None, student=None, domain=None):
+    """
+    Merge rolled-up intervals (`stored`, already filtered and resumed, in
+    (ts, student) order) with `pending` [(student, interval)] from data.json.
+    An interval in both (rolled up by another worker meanwhile) is yielded
+    once, from `stored`. Yields (cursor, row).
+    """
+    after = parse_cursor("history", cursor)
+    student = (student or "").strip().lower()
+    domain = (domain or "").strip().lower()
+    extra = []
+    for who, e in pending:
+        ts = int(e.get("ts") or 0)
+        dom = (e.get("domain") or "").lower()
+        if (since and ts < since) or (until and ts >= until) or (student and who != student):
+            continue
+        if domain and dom != domain and not dom.endswith("." + domain):
+            continue
+        if after and (ts, who) <= after:
+            continue
+        end = max(ts, int(e.get("end") or ts))
+        extra.append({"student": who, "ts": ts, "end": end, "duration": end - ts, "domain": e.get("domain"),
+                      "url": e.get("url"), "title": e.get("title"), "category": None})
+    extra.sort(key=lambda r: (r["ts"], r["student"]))
+    last = None
+    for row in heapq.merge(stored, extra, key=lambda r: (r["ts"], r["student"])):
+        key = (row["ts"], row["student"])
+        if key == last:
+            continue
+        last = key
+        yield f"{row['ts']}:{row['student']}", row
+
+
+def alert_rows(alerts, cursor=None, since=None, until=None, student=None, kind=None):
+    """Alerts in list order (oldest first); yields (cursor, row)."""
+    after = parse_cursor("alerts", cursor)
+    student = (student or "").strip().lower()
+    last_ts, n = None, 0
+    for a in alerts or ():
+        ts = int(a.get("ts") or 0)
+        n = n + 1 if ts == last_ts else 0
+        last_ts = ts
+        if after and (ts, n) <= after:
+            continue
+        if (since and ts < since) or (until and ts >= until):
+            continue
+        if student and (a.get("student") or "").strip().lower() != student:
+            continue
+        if kind and a.get("kind") != kind:
+            continue
+        yield f"{ts}:{n}", a
+
+
+def audit_rows(stored):
+    """`stored` from audit_log.iter_rows(after_id=...); yields (cursor, row)."""
+    for row in stored:
+        yield str(row["id"]), row
+
+
+def _csv_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, separators=(",", ":"), default=str)
+    return v
+
+
+def encode(rows, fmt, columns, cursor=None, limit=0, max_seconds=MAX_SECONDS):
+    """Encode (cursor, row) pairs as NDJSON or CSV byte chunks; stops early at `limit` rows / `max_seconds`."""
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n") if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns + ["cursor"])
+    count, last, stopped = 0, cursor, False
+    for cursor, row in rows:
+        if (limit and count >= limit) or (deadline and time.monotonic() > deadline):
+            stopped = True
+            break
+        if writer:
+            writer.writerow([_csv_value(row.get(c)) for c in columns] + [cursor])
+        else:
+            buf.write(json.dumps(dict(row, cursor=cursor), default=str))
+            buf.write("\n")
+        count += 1
+        last = cursor
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if not writer:
+        buf.write(json.dumps({"next_cursor": last, "rows": count} if stopped else {"done": True, "rows": count}))
+        buf.write("\n")
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+    close = getattr(rows, "close", None)
+    if close:
+        close()
@@ -0,0 +1,97 @@
+"""
+Cheap frame-difference signatures for student screenshots.
+
+Students often sit on the same page for minutes at a time, so consecutive
+heartbeat screenshots are usually near-identical. This module computes a
+tiny perceptual signature (a 64-bit difference hash over a 9x8 grayscale
+thumbnail) so the backend can tell whether a new frame is meaningfully
+different from the previous one without keeping the full images around.
+
+Interface:
+    frame_signature(image: bytes | str | None) -> str | None
+    file_signature(path: str, sha: str) -> str | None   # uploaded blob on disk
+    frame_distance(a: str, b: str) -> int          # 0..64
+    is_similar(a: str, b: str, threshold: int) -> bool
+
+Signatures are short strings:
+    "d:<16 hex digits>"  – difference hash (Pillow available)
+    "s:<sha256 hex>"     – exact content hash (Pillow missing / undecodable); the
+                           same hash blob_store names files by, so a frame sent as
+                           a data URL and as a binary upload gets one signature
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+
+from image_filter_ai import _from_data_url, _pil_image
+
+
+HASH_BITS = 64
+
+
+def _dhash(img_bytes: bytes) -> str | None:
+    return _dhash_file(io.BytesIO(img_bytes))
+
+
+def _dhash_file(fp) -> str | None:
+    Image = _pil_image()
+    if Image is None:  # Pillow not installed – fall back to exact-match hashing
+        return None
+    try:
+        img = Image.open(fp)
+        # JPEG decoders can downscale while decoding, which is much cheaper
+        # than decoding the full frame and resizing afterwards.
+        img.draft("L", (64, 64))
+        img = img.convert("L").resize((9, 8))
+    except Exception:
+        return None
+    px = list(img.getdata())
+    bits = 0
+    for row in range(8):
+        base = row * 9
+        for col in range(8):
+            bits = (bits << 1) | (1 if px[base + col] > px[base + col + 1] else 0)
+    return "d:%016x" % bits
+
+
+def frame_signature(image: bytes | str | None) -> str | None:
+    """Return a short signature for a screenshot (data URL or raw bytes)."""
+    if not image:
+        return None
+    if isinstance(image, str):
+        img_bytes = _from_data_url(image)
+    else:
+        img_bytes = image
+    if not img_bytes:
+        return None
+    sig = _dhash(img_bytes)
+    if sig:
+        return sig
+    return "s:" + hashlib.sha256(img_bytes).hexdigest()
+
+
+def file_signature(path: str, sha: str) -> str | None:
+    """Signature of an image file on disk; `sha` (its sha256) is the exact-match fallback."""
+    sig = _dhash_file(path)
+    if sig:
+        return sig
+    return "s:" + sha if sha else None
+
+
+def frame_distance(a: str | None, b: str | None) -> int:
+    """Hamming distance between two signatures (HASH_BITS when incomparable)."""
+    if not a or not b:
+        return HASH_BITS
+    if a.startswith("d:") and b.startswith("d:"):
+        try:
+            return bin(int(a[2:], 16) ^ int(b[2:], 16)).count("1")
+        except ValueError:
+            return HASH_BITS
+    return 0 if a == b else HASH_BITS
+
+
+def is_similar(a: str | None, b: str | None, threshold: int = 4) -> bool:
+    """True when two frames differ by at most `threshold` hash bits."""
+    return frame_distance(a, b) <= max(0, int(threshold))
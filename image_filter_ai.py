@@ -28,10 +28,19 @@ import io
 import math
 from typing import Dict
 
-try:
-    from PIL import Image
-except Exception:  # Pillow not installed – classifier will fall back to URL heuristics only
-    Image = None
+_PIL_IMAGE = False  # not imported yet
+
+
+def _pil_image():
+    """PIL.Image, imported on first use (it is slow to import); None if Pillow is missing."""
+    global _PIL_IMAGE
+    if _PIL_IMAGE is False:
+        try:
+            from PIL import Image
+        except Exception:  # Pillow not installed – classifier will fall back to URL heuristics only
+            Image = None
+        _PIL_IMAGE = Image
+    return _PIL_IMAGE
 
 
 LABELS = [
@@ -176,7 +185,8 @@ def classify_image(
     else:
         img_bytes = image_bytes_or_data_url
 
-    if Image is not None and img_bytes:
+    Image = _pil_image() if img_bytes else None
+    if Image is not None:
         try:
             img = Image.open(io.BytesIO(img_bytes))
             sr = _skin_ratio(img)
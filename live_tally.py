@@ -0,0 +1,209 @@
+"""
+Running aggregators for live polls and attention checks.
+
+Each poll / attention check gets an Aggregator that keeps, in memory:
+  * a tally per answer,
+  * the respondent set (student -> latest answer),
+  * a histogram of response latency (seconds since the question went out).
+
+Recording a response is O(1): the aggregator is updated under a lock and
+the raw response is upserted into a small SQLite table, so data.json is
+never rewritten for an answer. After a restart (or in another worker)
+an aggregator is rebuilt lazily from that table.
+
+Other worker processes open checks and record answers too, so a cached
+aggregator is rebuilt from the tables once it is SYNC_SECONDS old, and
+current() re-reads the newest live_checks row just as often. A check opened
+(or reopened) elsewhere, and the answers other workers recorded, show up
+within SYNC_SECONDS.
+
+Interface:
+    open_check(kind, ref_id, meta) -> Aggregator      # kind: "poll" | "attention"
+    get(kind, ref_id) -> Aggregator | None
+    current(kind) -> Aggregator | None                # most recently opened
+    record(kind, ref_id, student, answer, ts=None) -> dict | None   # summary
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+import tenancy
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+SYNC_SECONDS = 1.0
+
+# Tenants whose schema has been checked in this process
+_schema_ready = set()
+_lock = threading.Lock()
+
+
+def _aggregators():
+    return tenancy.cache("live_tally.aggregators")
+
+
+def _current():
+    return tenancy.cache("live_tally.current")
+
+
+def _db():
+    conn = sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+    # Many students answer within the same second; WAL lets those small
+    # commits proceed without serialising on a full fsync each.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def ensure_schema():
+    if tenancy.current() in _schema_ready:
+        return
+    with _db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS live_checks(
+            kind TEXT,
+            ref_id TEXT,
+            meta_json TEXT,
+            started INTEGER,
+            PRIMARY KEY(kind, ref_id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS live_responses(
+            kind TEXT,
+            ref_id TEXT,
+            student TEXT,
+            answer TEXT,
+            ts INTEGER,
+            PRIMARY KEY(kind, ref_id, student)
+        )""")
+        conn.commit()
+    _schema_ready.add(tenancy.current())
+
+
+class Aggregator:
+    def __init__(self, kind, ref_id, meta, started):
+        self.kind = kind
+        self.ref_id = ref_id
+        self.meta = dict(meta or {})
+        self.started = int(started)
+        self.counts = {}
+        self.respondents = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.lock = threading.Lock()
+        self.synced = time.monotonic()
+        for opt in self.meta.get("options") or []:
+            self.counts[str(opt)] = 0
+
+    def _bucket(self, ts):
+        return bisect_left(LATENCY_BUCKETS, max(0, int(ts) - self.started))
+
+    def apply(self, student, answer, ts):
+        """Fold one response into the running totals (re-answers replace the old one)."""
+        answer = "" if answer is None else str(answer)
+        with self.lock:
+            prev = self.respondents.get(student)
+            if prev is not None:
+                self.counts[prev["answer"]] = self.counts.get(prev["answer"], 1) - 1
+                self.latency[self._bucket(prev["ts"])] -= 1
+            self.respondents[student] = {"answer": answer, "ts": int(ts)}
+            self.counts[answer] = self.counts.get(answer, 0) + 1
+            self.latency[self._bucket(ts)] += 1
+
+    def summary(self):
+        with self.lock:
+            hist = []
+            for i, n in enumerate(self.latency):
+                le = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else "+Inf"
+                hist.append({"le": le, "count": n})
+            return {
+                "kind": self.kind,
+                "id": self.ref_id,
+                "meta": self.meta,
+                "started": self.started,
+                "respondents": len(self.respondents),
+                "counts": dict(self.counts),
+                "latency_histogram": hist,
+            }
+
+    def responses(self):
+        with self.lock:
+            return {s: dict(v) for s, v in self.respondents.items()}
+
+
+def open_check(kind, ref_id, meta=None, started=None):
+    ensure_schema()
+    started = int(started or time.time())
+    agg = Aggregator(kind, ref_id, meta, started)
+    with _db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO live_checks(kind, ref_id, meta_json, started) VALUES(?,?,?,?)",
+            (kind, ref_id, json.dumps(agg.meta), started),
+        )
+        conn.execute("DELETE FROM live_responses WHERE kind=? AND ref_id=?", (kind, ref_id))
+        conn.commit()
+    with _lock:
+        _aggregators()[(kind, ref_id)] = agg
+        _current()[kind] = (ref_id, time.monotonic())
+    return agg
+
+
+def _load(kind, ref_id):
+    ensure_schema()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT meta_json, started FROM live_checks WHERE kind=? AND ref_id=?", (kind, ref_id))
+        row = cur.fetchone()
+        if not row:
+            return None
+        agg = Aggregator(kind, ref_id, json.loads(row[0] or "{}"), row[1])
+        cur.execute("SELECT student, answer, ts FROM live_responses WHERE kind=? AND ref_id=?", (kind, ref_id))
+        for student, answer, ts in cur.fetchall():
+            agg.apply(student, answer, ts)
+    return agg
+
+
+def get(kind, ref_id):
+    key = (kind, ref_id)
+    agg = _aggregators().get(key)
+    if agg is not None and time.monotonic() - agg.synced < SYNC_SECONDS:
+        return agg
+    agg = _load(kind, ref_id)
+    with _lock:
+        if agg is None:
+            _aggregators().pop(key, None)
+        else:
+            _aggregators()[key] = agg
+    return agg
+
+
+def current(kind):
+    hit = _current().get(kind)
+    if hit is None or time.monotonic() - hit[1] >= SYNC_SECONDS:
+        ensure_schema()
+        with _db() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT ref_id FROM live_checks WHERE kind=? ORDER BY started DESC, rowid DESC LIMIT 1", (kind,))
+            row = cur.fetchone()
+        if not row:
+            _current().pop(kind, None)
+            return None
+        hit = _current()[kind] = (row[0], time.monotonic())
+    return get(kind, hit[0])
+
+
+def record(kind, ref_id, student, answer, ts=None):
+    """Persist one response and update the aggregator. None if the check is unknown."""
+    agg = get(kind, ref_id)
+    if agg is None:
+        return None
+    ts = int(ts or time.time())
+    with _db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO live_responses(kind, ref_id, student, answer, ts) VALUES(?,?,?,?,?)",
+            (kind, ref_id, student, "" if answer is None else str(answer), ts),
+        )
+        conn.commit()
+    agg.apply(student, answer, ts)
+    return agg.summary()
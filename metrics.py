@@ -0,0 +1,151 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Recording is a dict lookup plus an add under one lock, so it is cheap
+enough for every request. Values that are expensive to compute (file
+sizes, queue depths, room counts) are not recorded at all; they are
+produced by collector callbacks only when /metrics is scraped.
+
+Interface:
+    inc(name, value=1, help="", **labels)
+    observe(name, seconds, help="", buckets=LATENCY_BUCKETS, **labels)
+    timed(name, help="", **labels)                 # context manager / decorator
+    register_collector(fn)     # fn() -> iterable of (name, type, help, [(labels, value), ...])
+    render() -> str
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}     # name -> {labels_tuple: value}
+_histograms = {}   # name -> {labels_tuple: [bucket counts..., sum, count]}
+_buckets = {}
+_help = {}
+_collectors = []
+
+
+def _key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def inc(name, value=1, help="", **labels):
+    k = _key(labels)
+    with _lock:
+        series = _counters.get(name)
+        if series is None:
+            series = _counters[name] = {}
+            _help[name] = help
+        series[k] = series.get(k, 0) + value
+
+
+def observe(name, seconds, help="", buckets=LATENCY_BUCKETS, **labels):
+    k = _key(labels)
+    i = bisect_left(buckets, seconds)
+    with _lock:
+        series = _histograms.get(name)
+        if series is None:
+            series = _histograms[name] = {}
+            _buckets[name] = buckets
+            _help[name] = help
+        h = series.get(k)
+        if h is None:
+            h = series[k] = [0] * (len(buckets) + 1) + [0.0, 0]
+        h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+
+class timed:
+    """Observe the wall time of a block (or of every call, as a decorator)."""
+
+    def __init__(self, name, help="", **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.t0, self.help, **self.labels)
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*a, **kw):
+            with timed(self.name, self.help, **self.labels):
+                return fn(*a, **kw)
+        return wrapper
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def _esc(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v):
+    if isinstance(v, float):
+        if v != v:
+            return "NaN"
+        if v in (float("inf"), float("-inf")):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+
+def render():
+    out = []
+    with _lock:
+        counters = {n: dict(s) for n, s in _counters.items()}
+        hists = {n: {k: list(h) for k, h in s.items()} for n, s in _histograms.items()}
+        helps = dict(_help)
+
+    for name in sorted(counters):
+        out.append(f"# HELP {name} {helps.get(name) or name}")
+        out.append(f"# TYPE {name} counter")
+        for k, v in sorted(counters[name].items()):
+            out.append(f"{name}{_fmt_labels(k)} {_fmt_value(v)}")
+
+    for name in sorted(hists):
+        buckets = _buckets[name]
+        out.append(f"# HELP {name} {helps.get(name) or name}")
+        out.append(f"# TYPE {name} histogram")
+        for k, h in sorted(hists[name].items()):
+            cum = 0
+            for i, le in enumerate(buckets):
+                cum += h[i]
+                out.append(f"{name}_bucket{_fmt_labels(k, [('le', le)])} {cum}")
+            cum += h[len(buckets)]
+            out.append(f"{name}_bucket{_fmt_labels(k, [('le', '+Inf')])} {cum}")
+            out.append(f"{name}_sum{_fmt_labels(k)} {_fmt_value(float(h[-2]))}")
+            out.append(f"{name}_count{_fmt_labels(k)} {h[-1]}")
+
+    for fn in list(_collectors):
+        try:
+            families = list(fn())
+        except Exception as e:
+            out.append(f"# collector {getattr(fn, '__name__', fn)} failed: {_esc(e)}")
+            continue
+        for name, kind, help_text, samples in families:
+            out.append(f"# HELP {name} {help_text or name}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{_fmt_labels(sorted((labels or {}).items()))} {_fmt_value(value)}")
+
+    return "\n".join(out) + "\n"
@@ -0,0 +1,115 @@
+"""
+Off-task evaluation of a student's active tab.
+
+A student's effective lists - class allowlist and teacher blocks, the
+active scenes, the active policy's allow_urls / block_urls and blocked
+categories - are compiled once into host sets (a "*://*.example.org/*"
+pattern is just "example.org") plus glob regexes for patterns that name a
+path, so checking a URL is a walk up its host labels and a few regex
+matches. The heartbeat runs this on every active tab (see
+app._offtask_stage); compiled rules are cached by their inputs.
+
+Verdicts, first rule that applies wins:
+    blocked pattern                      off task, reason "blocked"
+    allowlisted pattern                  on task,  reason "allowed"
+    off-task keyword in the host         off task, reason "keyword"
+    domain in a blocked category         off task, reason "category"
+    an allowlist exists (no match)       off task, reason "not_allowed"
+    otherwise                            on task,  reason "default"
+
+Interface:
+    DEFAULT_KEYWORDS
+    compile_rules(allow=(), block=(), blocked_categories=(), keywords=DEFAULT_KEYWORDS) -> Rules
+    evaluate(rules, url, category_of=None) -> {"on_task": bool, "reason": str, "domain": str, ...}
+"""
+
+import fnmatch
+import re
+from functools import lru_cache
+
+import domains
+
+DEFAULT_KEYWORDS = ("coolmath", "roblox", "twitch", "steam", "epicgames")
+
+_HOST_PATTERN = re.compile(r"^(?:(?:\*|https?)://)?(?:\*\.)?([a-z0-9.-]+)(?::\d+)?(?:/\*?)?$")
+
+
+class Rules:
+    """Compiled allow / block lists; build with compile_rules()."""
+
+    __slots__ = ("allow_hosts", "allow_patterns", "block_hosts", "block_patterns", "blocked_categories", "keywords")
+
+    def __init__(self, allow_hosts, allow_patterns, block_hosts, block_patterns, blocked_categories, keywords):
+        self.allow_hosts = allow_hosts
+        self.allow_patterns = allow_patterns
+        self.block_hosts = block_hosts
+        self.block_patterns = block_patterns
+        self.blocked_categories = blocked_categories
+        self.keywords = keywords
+
+    @property
+    def has_allowlist(self):
+        return bool(self.allow_hosts or self.allow_patterns)
+
+
+def _split(patterns):
+    """(host set, compiled regex or None) for a list of URL patterns."""
+    hosts, globs = set(), []
+    for p in patterns or ():
+        p = (p or "").strip().lower()
+        if not p:
+            continue
+        m = _HOST_PATTERN.match(p)
+        if m:
+            hosts.add(m.group(1).strip("."))
+            continue
+        if "://" not in p:
+            p = "*://" + p
+        globs.append(fnmatch.translate(p))
+    return frozenset(hosts), (re.compile("|".join(f"(?:{g})" for g in globs)) if globs else None)
+
+
+@lru_cache(maxsize=1024)
+def compile_rules(allow=(), block=(), blocked_categories=(), keywords=DEFAULT_KEYWORDS):
+    """Rules for these lists (tuples, so identical lists share one compiled object)."""
+    allow_hosts, allow_patterns = _split(allow)
+    block_hosts, block_patterns = _split(block)
+    return Rules(allow_hosts, allow_patterns, block_hosts, block_patterns,
+                 frozenset(c for c in blocked_categories if c),
+                 tuple(k.strip().lower() for k in keywords if k and k.strip()))
+
+
+def _in_hosts(host, hosts):
+    """host, or any parent domain of it, is in `hosts`."""
+    while host:
+        if host in hosts:
+            return True
+        host = host.partition(".")[2]
+    return False
+
+
+def _matches(host, url, hosts, patterns):
+    return (bool(hosts) and _in_hosts(host, hosts)) or (patterns is not None and patterns.match(url) is not None)
+
+
+def evaluate(rules, url, category_of=None):
+    """
+    Judge one URL. category_of(domain) -> category name is only called when
+    the rules block categories; its answer is included as "category".
+    """
+    host = domains.host_of(url)
+    low = (url or "").strip().lower()
+    out = {"on_task": True, "reason": "default", "domain": domains.registered_domain(host)}
+    if _matches(host, low, rules.block_hosts, rules.block_patterns):
+        return dict(out, on_task=False, reason="blocked")
+    if _matches(host, low, rules.allow_hosts, rules.allow_patterns):
+        return dict(out, reason="allowed")
+    if any(k in host for k in rules.keywords):
+        return dict(out, on_task=False, reason="keyword")
+    if rules.blocked_categories and category_of and out["domain"]:
+        out["category"] = category_of(out["domain"])
+        if out["category"] in rules.blocked_categories:
+            return dict(out, on_task=False, reason="category")
+    if rules.has_allowlist:
+        return dict(out, on_task=False, reason="not_allowed")
+    return out
@@ -0,0 +1,148 @@
+"""
+Policy version counters.
+
+Anything that changes what /api/policy returns bumps a counter - the
+tenant-wide one, a class's, or a single student's - instead of queueing a
+{"type": "policy_refresh"} command. Every bump takes the next value of one
+per-tenant sequence, so a student's version is simply the largest counter
+that applies to them (global, their classes, themselves). Extensions get it
+back on every poll and re-fetch /api/policy only when it differs from the
+version they last applied: one refresh per real change, and nothing piles
+up in pending_commands.
+
+The "config" scope versions the extension's other settings documents
+(youtube_rules, image_filter, doodle_block) the same way, so a heartbeat can
+tell the extension which of them to re-read.
+
+Counters are stored in the policy_versions table of the tenant's gschool.db
+and mirrored in memory. A bump takes the next value inside a write
+transaction, so worker processes never hand out the same version, and each
+process picks up the others' bumps (rows newer than the largest version it
+has seen) at most SYNC_SECONDS after they were made.
+
+Interface:
+    ensure_schema()
+    bump(scope="global", key="") -> int       # scope: "global" | "class" | "student" | "config"
+    bump_many(scope, keys) -> int
+    get(scope="global", key="") -> int
+    version_for(student, class_ids=()) -> int
+    config_versions() -> {"youtube_rules": int, "image_filter": int, "doodle_block": int}
+"""
+
+import sqlite3
+import threading
+import time
+
+import tenancy
+
+SCOPES = ("global", "class", "student", "config")
+CONFIGS = ("youtube_rules", "image_filter", "doodle_block")
+SYNC_SECONDS = 1.0
+
+_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def _norm(scope, key):
+    if scope not in SCOPES:
+        raise ValueError(f"unknown policy version scope: {scope!r}")
+    key = (key or "").strip()
+    if scope == "student":
+        key = key.lower()
+    return (scope, "" if scope == "global" else key)
+
+
+def ensure_schema():
+    tid = tenancy.current()
+    if tid in _schema_ready:
+        return
+    with _db() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS policy_versions(
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY(scope, key)
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_policy_versions_version ON policy_versions(version)")
+        conn.commit()
+    _schema_ready.add(tid)
+
+
+def _merge(st, rows):
+    for scope, key, version in rows:
+        st["versions"][(scope, key)] = version
+        st["seq"] = max(st["seq"], version)
+    st["synced"] = time.monotonic()
+
+
+def _sync(st, conn):
+    """Pull rows bumped (by any process) since the largest version this one has seen."""
+    _merge(st, conn.execute("SELECT scope, key, version FROM policy_versions WHERE version > ?",
+                            (st["seq"],)).fetchall())
+
+
+def _state():
+    """{"seq": int, "versions": {(scope, key): version}} for the current tenant, kept in sync with the table."""
+    st = tenancy.cache("policy_versions")
+    if "versions" not in st:
+        with _lock:
+            if "versions" not in st:
+                ensure_schema()
+                st["seq"] = 0
+                st["versions"] = {}
+                with _db() as conn:
+                    _sync(st, conn)
+    elif time.monotonic() - st["synced"] >= SYNC_SECONDS:
+        with _lock:
+            if time.monotonic() - st["synced"] >= SYNC_SECONDS:
+                with _db() as conn:
+                    _sync(st, conn)
+    return st
+
+
+def bump_many(scope, keys):
+    """Give every (scope, key) the same fresh version; returns it (0 when keys is empty)."""
+    items = {_norm(scope, k) for k in keys}
+    if scope != "global":
+        items = {item for item in items if item[1]}
+    if not items:
+        return 0
+    st = _state()
+    with _lock:
+        with _db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM policy_versions").fetchone()[0]
+            conn.executemany(
+                "INSERT OR REPLACE INTO policy_versions(scope, key, version) VALUES(?,?,?)",
+                [(s, k, version) for s, k in items])
+            conn.commit()
+            _sync(st, conn)
+    return version
+
+
+def bump(scope="global", key=""):
+    return bump_many(scope, [key])
+
+
+def get(scope="global", key=""):
+    return _state()["versions"].get(_norm(scope, key), 0)
+
+
+def version_for(student, class_ids=()):
+    """The policy version a student's extension should be on."""
+    versions = _state()["versions"]
+    v = versions.get(("global", ""), 0)
+    for cid in class_ids or ():
+        v = max(v, versions.get(("class", cid), 0))
+    if student:
+        v = max(v, versions.get(_norm("student", student), 0))
+    return v
+
+
+def config_versions():
+    versions = _state()["versions"]
+    return {name: versions.get(("config", name), 0) for name in CONFIGS}
@@ -0,0 +1,283 @@
+"""
+On-demand CPU profiling for a running server.
+
+Two modes, one session at a time, always bounded in time:
+
+  * "sample"   – a background thread snapshots every thread's stack with
+                 sys._current_frames() every `interval_ms` for `duration`
+                 seconds. Cheap enough to leave on during a live period.
+  * "requests" – cProfile around each of the next `requests` requests,
+                 optionally only those whose route is in `routes`
+                 (e.g. /api/heartbeat). Requests are profiled one at a time;
+                 a matching request that arrives while another is being
+                 profiled simply runs unprofiled.
+
+Results are available as a hot list (per function self / total time or
+samples) and as collapsed stacks ("frame;frame;frame count" per line),
+which flamegraph.pl, speedscope and similar tools read directly. For
+cProfile sessions the stacks are rebuilt from the caller graph along each
+function's heaviest caller chain, weighted in microseconds.
+
+Interface:
+    start(mode, duration=30, interval_ms=10, requests=50, routes=None) -> dict
+    stop() -> dict
+    status() -> dict
+    active() -> bool                             # a session is running (cheap per-request check)
+    hot(limit=30) -> list[dict]
+    collapsed() -> str
+    request_started(route) -> token | None       # called by the app per request
+    request_finished(token)
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_DURATION = 300
+MAX_REQUESTS = 1000
+
+_lock = threading.Lock()
+_request_lock = threading.Lock()
+_session = None
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _func_label(func):
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-ins, e.g. <method 'append' of 'list' objects>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class _Session:
+    def __init__(self, mode, duration, interval_ms, requests, routes):
+        self.mode = mode
+        self.started = time.time()
+        self.deadline = self.started + duration
+        self.duration = duration
+        self.interval = max(1, interval_ms) / 1000.0
+        self.requests_left = requests
+        self.requests_wanted = requests
+        self.routes = set(routes or [])
+        self.stopped = None
+        self.samples = Counter()      # "a;b;c" -> count   (sample mode)
+        self.sample_count = 0
+        self.stats = None             # pstats.Stats       (requests mode)
+        self.profiled = 0
+        self.skipped = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.stopped is None
+
+    def finish(self):
+        if self.stopped is None:
+            self.stopped = time.time()
+        self.stop_event.set()
+
+    def summary(self):
+        out = {
+            "mode": self.mode,
+            "running": self.running,
+            "started": int(self.started),
+            "stopped": int(self.stopped) if self.stopped else None,
+            "duration": self.duration,
+        }
+        if self.mode == "sample":
+            out.update(interval_ms=int(self.interval * 1000), samples=self.sample_count)
+        else:
+            out.update(requests=self.requests_wanted, profiled=self.profiled,
+                       skipped=self.skipped, routes=sorted(self.routes))
+        return out
+
+
+# ---------------------------
+# Stack sampler
+# ---------------------------
+def _sample_loop(sess):
+    me = threading.get_ident()
+    while not sess.stop_event.wait(sess.interval):
+        if time.time() >= sess.deadline:
+            break
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                sess.samples[";".join(reversed(stack))] += 1
+        sess.sample_count += 1
+    with _lock:
+        sess.finish()
+
+
+# ---------------------------
+# Session control
+# ---------------------------
+def start(mode, duration=30, interval_ms=10, requests=50, routes=None):
+    global _session
+    if mode not in ("sample", "requests"):
+        raise ValueError("mode must be 'sample' or 'requests'")
+    duration = max(1, min(int(duration), MAX_DURATION))
+    requests = max(1, min(int(requests), MAX_REQUESTS))
+    with _lock:
+        if _session is not None and _session.running:
+            raise RuntimeError("a profiling session is already running")
+        sess = _session = _Session(mode, duration, int(interval_ms), requests, routes)
+    if mode == "sample":
+        sess.thread = threading.Thread(target=_sample_loop, args=(sess,), name="gschool-profiler", daemon=True)
+        sess.thread.start()
+    return sess.summary()
+
+
+def stop():
+    with _lock:
+        sess = _session
+        if sess is None:
+            return {"running": False}
+        sess.finish()
+    return sess.summary()
+
+
+def active():
+    sess = _session
+    return sess is not None and sess.running
+
+
+def status():
+    sess = _session
+    if sess is None:
+        return {"running": False}
+    if sess.running and sess.mode == "requests" and time.time() >= sess.deadline:
+        with _lock:
+            sess.finish()
+    return sess.summary()
+
+
+# ---------------------------
+# Per-request cProfile
+# ---------------------------
+def request_started(route):
+    """Begin profiling this request if a "requests" session wants it; returns a token or None."""
+    sess = _session
+    if sess is None or not sess.running or sess.mode != "requests":
+        return None
+    if sess.routes and route not in sess.routes:
+        return None
+    if time.time() >= sess.deadline:
+        with _lock:
+            sess.finish()
+        return None
+    if not _request_lock.acquire(blocking=False):
+        sess.skipped += 1
+        return None
+    with _lock:
+        if sess.requests_left <= 0 or not sess.running:
+            _request_lock.release()
+            return None
+        sess.requests_left -= 1
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:  # another profiler (e.g. a debugger) is active
+        _request_lock.release()
+        return None
+    return (sess, prof)
+
+
+def request_finished(token):
+    if token is None:
+        return
+    sess, prof = token
+    try:
+        prof.disable()
+        with _lock:
+            if sess.stats is None:
+                sess.stats = pstats.Stats(prof)
+            else:
+                sess.stats.add(prof)
+            sess.profiled += 1
+            if sess.requests_left <= 0:
+                sess.finish()
+    finally:
+        _request_lock.release()
+
+
+# ---------------------------
+# Reports
+# ---------------------------
+def hot(limit=30):
+    sess = _session
+    if sess is None:
+        return []
+    if sess.mode == "sample":
+        self_counts, total_counts = Counter(), Counter()
+        with _lock:
+            items = list(sess.samples.items())
+        for stack, n in items:
+            frames = stack.split(";")
+            self_counts[frames[-1]] += n
+            for f in set(frames):
+                total_counts[f] += n
+        total = sess.sample_count or 1
+        return [{"function": f, "self_samples": n, "total_samples": total_counts[f],
+                 "self_pct": round(100.0 * n / total, 2)}
+                for f, n in self_counts.most_common(limit)]
+
+    with _lock:
+        stats = sess.stats
+        if stats is None:
+            return []
+        rows = [(func, cc, nc, tt, ct) for func, (cc, nc, tt, ct, _callers) in stats.stats.items()]
+    rows.sort(key=lambda r: r[3], reverse=True)
+    return [{"function": _func_label(func), "calls": nc, "self_ms": round(tt * 1000.0, 3),
+             "total_ms": round(ct * 1000.0, 3)}
+            for func, cc, nc, tt, ct in rows[:limit]]
+
+
+def collapsed():
+    sess = _session
+    if sess is None:
+        return ""
+    if sess.mode == "sample":
+        with _lock:
+            items = sorted(sess.samples.items())
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    with _lock:
+        stats = sess.stats
+        if stats is None:
+            return ""
+        graph = {func: (tt, callers) for func, (cc, nc, tt, ct, callers) in stats.stats.items()}
+
+    def heaviest_chain(func):
+        chain, seen = [func], {func}
+        while len(chain) < 64:
+            callers = graph.get(chain[-1], (0, {}))[1]
+            if not callers:
+                break
+            # callers: {caller: (cc, nc, tt, ct)} – follow the caller that spent most time here
+            parent = max(callers, key=lambda c: callers[c][3])
+            if parent in seen:
+                break
+            chain.append(parent)
+            seen.add(parent)
+        return [_func_label(f) for f in reversed(chain)]
+
+    lines = Counter()
+    for func, (tt, _callers) in graph.items():
+        us = int(tt * 1_000_000)
+        if us > 0:
+            lines[";".join(heaviest_chain(func))] += us
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(lines.items()))
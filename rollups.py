@@ -0,0 +1,345 @@
+"""
+Category usage rollups: classifier verdicts joined with the timeline.
+
+A background job (see app._run_rollups) hands every tenant's history to
+ingest(). Each dwell interval that has closed - a later interval exists or
+it has been idle past the gap - is copied once into timeline_intervals,
+tagged with its domain's category, and its seconds are added into the
+per-hour usage_rollup rows of the student and of each of the student's
+classes. Dashboards read those rows instead of scanning history.
+
+A domain's category comes from the admin category URL lists, then the
+domain_categories table (verdicts recorded by /api/ai/classify; a verdict
+made from page text beats a URL-only one), then the URL-only keyword
+classifier, whose answer is stored as well.
+
+Interface:
+    ensure_schema()
+    record_verdict(domain, category, source="url")     # source: "page" | "url"
+    verdicts() -> {domain: category}
+    verdict(domain) -> str | None
+    revision() -> int                                   # changes whenever a verdict is recorded
+    ingest(history, closed_before, class_ids_for, admin_categories=None) -> int
+    query(scope, keys=None, since=None, until=None, by_hour=False) -> list[dict]
+    iter_intervals(since=None, until=None, student=None, domain=None, after=None) -> iterator of dicts
+    stored_marks(students) -> {student: latest ts in timeline_intervals}
+    unrolled(history, marks=None) -> [(student, interval)]   # not in timeline_intervals yet
+    rows_after(id) -> [(id, student, domain, ts, end_ts)]
+    first_rowid() -> int | None
+    state() -> {"students": int, "domains": int, "last_run": int | None}
+"""
+
+import sqlite3
+import threading
+import time
+
+import analytics
+import tenancy
+
+SCOPES = ("student", "class")
+HOUR = 3600
+
+_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def ensure_schema():
+    tid = tenancy.current()
+    if tid in _schema_ready:
+        return
+    with _db() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS domain_categories(
+            domain TEXT PRIMARY KEY,
+            category TEXT NOT NULL,
+            source TEXT NOT NULL,
+            updated_ts INTEGER
+        )""")
+        # The id is what analytics.Store and the search index follow; tables made
+        # before it existed are copied over, keeping each row's rowid as its id.
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(timeline_intervals)")]
+        migrate = bool(cols) and "id" not in cols
+        if migrate:
+            conn.execute("PRAGMA legacy_alter_table=ON")
+            conn.execute("ALTER TABLE timeline_intervals RENAME TO timeline_intervals_old")
+        conn.execute("""CREATE TABLE IF NOT EXISTS timeline_intervals(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            domain TEXT,
+            url TEXT,
+            title TEXT,
+            category TEXT,
+            UNIQUE(student, ts)
+        )""")
+        if migrate:
+            conn.execute("INSERT INTO timeline_intervals(id, student, ts, end_ts, domain, url, title, category) "
+                         "SELECT rowid, student, ts, end_ts, domain, url, title, category FROM timeline_intervals_old")
+            conn.execute("DROP TABLE timeline_intervals_old")
+            conn.execute("PRAGMA legacy_alter_table=OFF")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_timeline_intervals_ts ON timeline_intervals(ts)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS usage_rollup(
+            hour INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            category TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            PRIMARY KEY(scope, key, hour, category)
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_rollup_hour ON usage_rollup(scope, hour)")
+        conn.commit()
+    _schema_ready.add(tid)
+
+
+def _cache():
+    """{"verdicts": {domain: category}, "rev": int, "marks": {student: last ts rolled up}, "last_run": ts}."""
+    st = tenancy.cache("rollups")
+    if "verdicts" not in st:
+        with _lock:
+            if "verdicts" not in st:
+                ensure_schema()
+                with _db() as conn:
+                    st["verdicts"] = dict(conn.execute("SELECT domain, category FROM domain_categories"))
+                    st["marks"] = dict(conn.execute("SELECT student, MAX(ts) FROM timeline_intervals GROUP BY student"))
+                st["last_run"] = None
+                st["rev"] = 0
+    return st
+
+
+def record_verdict(domain, category, source="url"):
+    """Remember a classifier verdict for a domain; URL-only guesses never replace page verdicts."""
+    domain = (domain or "").strip().lower()
+    if not domain or not category:
+        return
+    st = _cache()
+    with _db() as conn:
+        conn.execute("""INSERT INTO domain_categories(domain, category, source, updated_ts) VALUES(?,?,?,?)
+            ON CONFLICT(domain) DO UPDATE SET category=excluded.category, source=excluded.source,
+                updated_ts=excluded.updated_ts
+            WHERE excluded.source = 'page' OR domain_categories.source = 'url'""",
+                     (domain, category, source, int(time.time())))
+        conn.commit()
+        row = conn.execute("SELECT category FROM domain_categories WHERE domain=?", (domain,)).fetchone()
+    st["verdicts"][domain] = row[0]
+    st["rev"] += 1
+
+
+def verdicts():
+    return dict(_cache()["verdicts"])
+
+
+def verdict(domain):
+    return _cache()["verdicts"].get((domain or "").strip().lower())
+
+
+def revision():
+    return _cache()["rev"]
+
+
+def _hour_slices(start, end):
+    """(hour start, seconds) pieces of [start, end)."""
+    t = start
+    while t < end:
+        h = t - t % HOUR
+        nxt = min(end, h + HOUR)
+        yield h, nxt - t
+        t = nxt
+
+
+def ingest(history, closed_before, class_ids_for, admin_categories=None):
+    """
+    Roll up every interval that has closed since the last run; returns how many.
+
+    history: data.json["history"]; closed_before: an interval that is the
+    student's last and ended after this is still open and waits for a later run.
+    class_ids_for(student) -> class ids the student's minutes also count toward.
+
+    Idempotent: an interval's seconds are only added by the run whose insert
+    into timeline_intervals actually stored it, and each run holds a write
+    transaction, so overlapping runs (threads or worker processes) never
+    count an interval twice.
+    """
+    st = _cache()
+    marks = st["marks"]
+    with _lock:
+        fresh = []
+        for student, arr in (history or {}).items():
+            key = (student or "").strip().lower()
+            mark = marks.get(key)
+            arr = arr or []
+            for i, e in enumerate(arr):
+                ts = int(e.get("ts") or 0)
+                if mark is not None and ts <= mark:
+                    continue
+                end = max(ts, int(e.get("end") or ts))
+                if i == len(arr) - 1 and end >= closed_before:
+                    break
+                fresh.append((key, ts, end, e))
+        if not fresh:
+            st["last_run"] = int(time.time())
+            return 0
+
+        doms = sorted({(e.get("domain") or "") for _, _, _, e in fresh})
+        known = st["verdicts"]
+        cats = dict(zip(doms, analytics.category_map(doms, admin_categories, known=known)))
+        new_verdicts = [(dom, analytics.classify_domain(dom), "url", int(time.time()))
+                        for dom in doms if dom and dom not in known]
+
+        inserted, sums, classes = 0, {}, {}
+        with _db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR IGNORE INTO domain_categories(domain, category, source, updated_ts) "
+                             "VALUES(?,?,?,?)", new_verdicts)
+            for student, ts, end, e in fresh:
+                cat = cats[e.get("domain") or ""]
+                cur = conn.execute("INSERT OR IGNORE INTO timeline_intervals(student, ts, end_ts, domain, url, "
+                                   "title, category) VALUES(?,?,?,?,?,?,?)",
+                                   (student, ts, end, e.get("domain"), e.get("url"), e.get("title"), cat))
+                if cur.rowcount != 1:
+                    continue  # already rolled up (by another worker)
+                inserted += 1
+                if student not in classes:
+                    classes[student] = list(class_ids_for(student) or [])
+                for hour, secs in _hour_slices(ts, end):
+                    for scope, k in [("student", student)] + [("class", c) for c in classes[student]]:
+                        sums[(hour, scope, k, cat)] = sums.get((hour, scope, k, cat), 0) + secs
+            conn.executemany("""INSERT INTO usage_rollup(hour, scope, key, category, seconds) VALUES(?,?,?,?,?)
+                ON CONFLICT(scope, key, hour, category) DO UPDATE SET seconds = seconds + excluded.seconds""",
+                             [(h, scope, k, cat, secs) for (h, scope, k, cat), secs in sums.items()])
+            conn.commit()
+        for dom, cat, _, _ in new_verdicts:
+            known.setdefault(dom, cat)
+        if new_verdicts:
+            st["rev"] += 1
+        for student, ts, _, _ in fresh:
+            if ts > marks.get(student, -1):
+                marks[student] = ts
+        st["last_run"] = int(time.time())
+    return inserted
+
+
+def query(scope, keys=None, since=None, until=None, by_hour=False):
+    """
+    Rolled-up seconds per (key, category), or per (key, hour, category) with
+    by_hour. Hours are whole: since/until are rounded down to the hour.
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"unknown rollup scope: {scope!r}")
+    ensure_schema()
+    where, args = ["scope=?"], [scope]
+    if keys is not None:
+        keys = sorted({(k or "").strip().lower() if scope == "student" else k for k in keys})
+        if not keys:
+            return []
+        where.append(f"key IN ({','.join('?' * len(keys))})")
+        args += keys
+    if since is not None:
+        where.append("hour>=?")
+        args.append(int(since) - int(since) % HOUR)
+    if until is not None:
+        where.append("hour<?")
+        args.append(int(until))
+    cols = "key, hour, category" if by_hour else "key, category"
+    sql = (f"SELECT {cols}, SUM(seconds) FROM usage_rollup WHERE {' AND '.join(where)} "
+           f"GROUP BY {cols} ORDER BY {'key, hour, ' if by_hour else 'key, '}SUM(seconds) DESC")
+    with _db() as conn:
+        out = []
+        for row in conn.execute(sql, args):
+            item = {"key": row[0], "category": row[-2], "seconds": int(row[-1]),
+                    "minutes": round(row[-1] / 60.0, 2)}
+            if by_hour:
+                item["hour"] = row[1]
+            out.append(item)
+    return out
+
+
+def iter_intervals(since=None, until=None, student=None, domain=None, after=None):
+    """
+    timeline_intervals rows starting in [since, until), ordered by (ts, student),
+    read off one cursor. after=(ts, student) resumes past that row; `domain`
+    also matches its subdomains. The query runs before this returns.
+    """
+    ensure_schema()
+    where, args = ["1=1"], []
+    if since:
+        where.append("ts >= ?")
+        args.append(int(since))
+    if until:
+        where.append("ts < ?")
+        args.append(int(until))
+    if student:
+        where.append("student = ?")
+        args.append(student.strip().lower())
+    if domain:
+        domain = domain.strip().lower()
+        where.append("(domain = ? OR domain LIKE ?)")
+        args += [domain, "%." + domain]
+    if after:
+        where.append("(ts, student) > (?, ?)")
+        args += [int(after[0]), after[1]]
+    conn = _db()
+    cur = conn.execute("SELECT student, ts, end_ts, domain, url, title, category FROM timeline_intervals "
+                       f"WHERE {' AND '.join(where)} ORDER BY ts, student", args)
+
+    def rows():
+        try:
+            for student_, ts, end, dom, url, title, cat in cur:
+                yield {"student": student_, "ts": ts, "end": end, "duration": end - ts, "domain": dom,
+                       "url": url, "title": title, "category": cat}
+        finally:
+            conn.close()
+    return rows()
+
+
+def rows_after(id):
+    """timeline_intervals rows stored after `id` (ids only grow), in id order."""
+    ensure_schema()
+    with _db() as conn:
+        return conn.execute("SELECT id, student, domain, ts, end_ts FROM timeline_intervals WHERE id > ? "
+                            "ORDER BY id", (int(id or 0),)).fetchall()
+
+
+def first_rowid():
+    """Smallest timeline_intervals id (None when the table is empty)."""
+    ensure_schema()
+    with _db() as conn:
+        return conn.execute("SELECT MIN(id) FROM timeline_intervals").fetchone()[0]
+
+
+def stored_marks(students):
+    """{student: start of their latest stored interval}, read from the table (any worker may have ingested)."""
+    ensure_schema()
+    out = {}
+    with _db() as conn:
+        for student in students:
+            key = (student or "").strip().lower()
+            ts = conn.execute("SELECT MAX(ts) FROM timeline_intervals WHERE student=?", (key,)).fetchone()[0]
+            if ts is not None:
+                out[key] = ts
+    return out
+
+
+def unrolled(history, marks=None):
+    """
+    Intervals in history that are not in timeline_intervals yet (the open
+    ones, normally). marks: {student: latest stored start}, as the caller
+    last read the table; read from the table when None.
+    """
+    history = history or {}
+    if marks is None:
+        marks = stored_marks(history)
+    out = []
+    for student, arr in history.items():
+        key = (student or "").strip().lower()
+        mark = marks.get(key)
+        out += [(key, e) for e in arr or () if mark is None or int(e.get("ts") or 0) > mark]
+    return out
+
+
+def state():
+    st = _cache()
+    return {"students": len(st["marks"]), "domains": len(st["verdicts"]), "last_run": st["last_run"]}
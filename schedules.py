@@ -0,0 +1,184 @@
+"""
+Shared schedule engine for policy and category schedules.
+
+A schedule is {"enabled": bool, "start": "HH:MM", "end": "HH:MM",
+"weekdays_only": bool}, evaluated in server local time:
+
+  * start == end, or a missing/invalid start or end -> open all day
+  * start < end  -> open on [start, end)
+  * start > end  -> overnight window, open on [start, 24:00) + [00:00, end)
+  * weekdays_only -> always closed on Saturday and Sunday
+
+(Category schedules used to treat start == end as "never" and fill in
+00:00/23:59 defaults; both kinds now share the rules above.)
+
+Schedules are compiled once per distinct (start, end, weekdays_only), and
+for each compiled window the state and the timestamp of the next
+transition are cached together. The cached answer stays valid until that
+transition, so evaluating a policy is a couple of dict lookups until a
+boundary is actually crossed.
+
+Interface:
+    window_open(sched, now_ts=None) -> bool        # ignores "enabled"
+    policy_active(policy, now_ts=None) -> bool     # inactive policy -> False; disabled schedule -> True
+    category_active(sched, now_ts=None) -> bool    # disabled/missing schedule -> False
+    next_transition(sched, now_ts=None) -> int | None   # None = never changes
+    BoundaryTimer(next_fn, fire_fn)                # background thread firing at boundaries
+"""
+
+import datetime as _dt
+import threading
+import time
+from functools import lru_cache
+
+# Transitions are searched for this many days ahead (covers weekends).
+_HORIZON_DAYS = 8
+
+_state_cache = {}   # compiled window -> (valid_from, valid_until, open)
+_state_lock = threading.Lock()
+
+
+def _parse_hhmm(s):
+    if not s or not isinstance(s, str):
+        return None
+    parts = s.split(":")
+    if len(parts) != 2:
+        return None
+    try:
+        h, m = int(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+    if 0 <= h < 24 and 0 <= m < 60:
+        return h * 60 + m
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _compile(start, end, weekdays_only):
+    """(start_min, end_min, weekdays_only); start/end None means open all day."""
+    s, e = _parse_hhmm(start), _parse_hhmm(end)
+    if s is None or e is None or s == e:
+        s = e = None
+    return (s, e, bool(weekdays_only))
+
+
+def _compiled(sched):
+    sched = sched or {}
+    return _compile(sched.get("start") or "", sched.get("end") or "", bool(sched.get("weekdays_only")))
+
+
+def _open_at(win, ts):
+    start, end, weekdays_only = win
+    dt = _dt.datetime.fromtimestamp(ts)
+    if weekdays_only and dt.weekday() >= 5:
+        return False
+    if start is None:
+        return True
+    cur = dt.hour * 60 + dt.minute
+    if start < end:
+        return start <= cur < end
+    return cur >= start or cur < end
+
+
+def _candidates(win, ts):
+    """Local times after ts at which the window could open or close, ascending."""
+    start, end, weekdays_only = win
+    base = _dt.datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    out = set()
+    for day in range(_HORIZON_DAYS + 1):
+        midnight = base + _dt.timedelta(days=day)
+        if weekdays_only:
+            out.add(midnight)
+        for minute in (start, end):
+            if minute is not None:
+                out.add(midnight + _dt.timedelta(minutes=minute))
+    return sorted(t for t in (int(c.timestamp()) for c in out) if t > ts)
+
+
+def _state(win, ts):
+    """(open, next_transition_ts | None) for a compiled window, cached until the transition."""
+    hit = _state_cache.get(win)
+    if hit and hit[0] <= ts and (hit[1] is None or ts < hit[1]):
+        return hit[2], hit[1]
+    is_open = _open_at(win, ts)
+    nxt = None
+    if win[0] is not None or win[2]:
+        for cand in _candidates(win, ts):
+            if _open_at(win, cand) != is_open:
+                nxt = cand
+                break
+    with _state_lock:
+        _state_cache[win] = (ts, nxt, is_open)
+    return is_open, nxt
+
+
+def window_open(sched, now_ts=None):
+    return _state(_compiled(sched), int(now_ts if now_ts is not None else time.time()))[0]
+
+
+def policy_active(policy, now_ts=None):
+    if not policy or not policy.get("active", True):
+        return False
+    sched = policy.get("schedule") or {}
+    if not sched.get("enabled"):
+        return True  # always on when schedule is disabled
+    return window_open(sched, now_ts)
+
+
+def category_active(sched, now_ts=None):
+    if not isinstance(sched, dict) or not sched.get("enabled"):
+        return False
+    return window_open(sched, now_ts)
+
+
+def next_transition(sched, now_ts=None):
+    if not isinstance(sched, dict) or not sched.get("enabled"):
+        return None
+    return _state(_compiled(sched), int(now_ts if now_ts is not None else time.time()))[1]
+
+
+class BoundaryTimer:
+    """
+    Sleep until the next boundary reported by next_fn(now) and call fire_fn(ts).
+
+    next_fn returns a unix timestamp or None. poke() wakes the timer early
+    so it re-reads the next boundary (call it after schedules change);
+    it also re-checks at least every `max_sleep` seconds.
+    """
+
+    def __init__(self, next_fn, fire_fn, max_sleep=300, name="gschool-schedule-timer"):
+        self.next_fn = next_fn
+        self.fire_fn = fire_fn
+        self.max_sleep = max_sleep
+        self.name = name
+        self.wake = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.next_at = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def poke(self):
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            now = time.time()
+            try:
+                self.next_at = self.next_fn(now)
+            except Exception as e:
+                print(f"[WARN] {self.name}:", e)
+                self.next_at = None
+            delay = self.max_sleep if self.next_at is None else min(self.max_sleep, max(0.0, self.next_at - now))
+            if self.wake.wait(delay):
+                self.wake.clear()
+                continue
+            if self.next_at is not None and time.time() >= self.next_at:
+                try:
+                    self.fire_fn(self.next_at)
+                except Exception as e:
+                    print(f"[WARN] {self.name} failed:", e)
@@ -0,0 +1,250 @@
+"""
+Full-text search over the browsing timeline, DMs and chat (SQLite FTS5).
+
+timeline_fts indexes the title and URL of every row in timeline_intervals
+(the durable timeline the rollup job fills as intervals close), chat_fts
+the text of chat_messages (AI chat rooms and DMs). Both are external
+content tables kept current by triggers, so rows are indexed by the same
+insert that stores them and pruning removes them again; nothing is ever
+re-scanned. Existing rows are indexed once when the tables are created.
+
+Each timeline row also carries a tags column (a token for the student and
+one for the UTC day it started), so student and time filters narrow the
+match inside the index instead of scanning every hit.
+
+Queries are plain words: every word must match, the last one as a prefix
+("khan acad" finds "Khan Academy"); quoted phrases are kept together. The
+newest CANDIDATES matching timeline rows are ranked by BM25 (a title hit
+outweighs a URL hit), newest first among equals. Pages of a timeline
+search must end within those CANDIDATES rows (search() raises ValueError
+otherwise), and "truncated" says when older matches were left out.
+
+Interface:
+    ensure_schema()
+    SOURCES = ("timeline", "dm", "chat")
+    fts_query(text) -> str | None                    # None when there is nothing to search for
+    search(text, sources=("timeline",), student=None, since=None, until=None,
+           domain=None, offset=0, limit=50) -> {"items": [...], "next_offset": int | None, "truncated": bool}
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+import chat_store
+import rollups
+import tenancy
+
+SOURCES = ("timeline", "dm", "chat")
+TITLE_WEIGHT = 4.0
+URL_WEIGHT = 1.0
+CANDIDATES = 1000        # newest matching timeline rows that get ranked
+MAX_DAY_TAGS = 62        # longer time ranges are filtered on the row only
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+_TOKEN_RE = re.compile(r'"([^"]+)"|(\S+)')
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _db():
+    return sqlite3.connect(tenancy.path("gschool.db"), timeout=10)
+
+
+def _student_tag(student):
+    return "u" + re.sub(r"[@.\-_+]", "", (student or "").strip().lower())
+
+
+def _tags_sql(row):
+    """SQL for the tags column: the student's tag and "day<YYYYMMDD>" (UTC) of the interval start."""
+    student = f"lower({row}student)"
+    for ch in "@.-_+":
+        student = f"replace({student}, '{ch}', '')"
+    return f"'u' || {student} || ' day' || strftime('%Y%m%d', {row}ts, 'unixepoch')"
+
+
+def ensure_schema():
+    tid = tenancy.current()
+    if tid in _schema_ready:
+        return
+    with _schema_lock:
+        if tid in _schema_ready:
+            return
+        rollups.ensure_schema()
+        chat_store.ensure_schema()
+        with _db() as conn:
+            have = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            conn.execute(f"""CREATE VIEW IF NOT EXISTS timeline_search AS
+                SELECT id AS rid, title, url, {_tags_sql('')} AS tags FROM timeline_intervals""")
+            conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS timeline_fts USING fts5(
+                title, url, tags, content='timeline_search', content_rowid='rid', prefix='2 3')""")
+            conn.executescript(f"""
+                CREATE TRIGGER IF NOT EXISTS timeline_fts_ai AFTER INSERT ON timeline_intervals BEGIN
+                    INSERT INTO timeline_fts(rowid, title, url, tags)
+                    VALUES (new.id, new.title, new.url, {_tags_sql('new.')});
+                END;
+                CREATE TRIGGER IF NOT EXISTS timeline_fts_ad AFTER DELETE ON timeline_intervals BEGIN
+                    INSERT INTO timeline_fts(timeline_fts, rowid, title, url, tags)
+                    VALUES ('delete', old.id, old.title, old.url, {_tags_sql('old.')});
+                END;
+                CREATE TRIGGER IF NOT EXISTS timeline_fts_au AFTER UPDATE ON timeline_intervals BEGIN
+                    INSERT INTO timeline_fts(timeline_fts, rowid, title, url, tags)
+                    VALUES ('delete', old.id, old.title, old.url, {_tags_sql('old.')});
+                    INSERT INTO timeline_fts(rowid, title, url, tags)
+                    VALUES (new.id, new.title, new.url, {_tags_sql('new.')});
+                END;
+            """)
+            conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+                text, content='chat_messages', content_rowid='id', prefix='2 3')""")
+            conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS chat_fts_ai AFTER INSERT ON chat_messages BEGIN
+                    INSERT INTO chat_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chat_fts_ad AFTER DELETE ON chat_messages BEGIN
+                    INSERT INTO chat_fts(chat_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chat_fts_au AFTER UPDATE OF text ON chat_messages BEGIN
+                    INSERT INTO chat_fts(chat_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    INSERT INTO chat_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+            """)
+            # Index whatever was stored before the search tables existed
+            if "timeline_fts" not in have:
+                conn.execute("INSERT INTO timeline_fts(timeline_fts) VALUES('rebuild')")
+            if "chat_fts" not in have:
+                conn.execute("INSERT INTO chat_fts(chat_fts) VALUES('rebuild')")
+            conn.commit()
+        _schema_ready.add(tid)
+
+
+def fts_query(text):
+    """
+    Turn user input into an FTS5 query: words are ANDed, the last one as a
+    prefix (search-as-you-type); "quoted phrases" stay phrases.
+    """
+    parts = []
+    for phrase, word in _TOKEN_RE.findall(text or ""):
+        words = _WORD_RE.findall(phrase or word)
+        if not words:
+            continue
+        if phrase:
+            parts.append('"' + " ".join(words) + '"')
+        else:
+            parts += [f'"{w}"' for w in words]
+    if parts and not parts[-1].endswith('"*') and " " not in parts[-1]:
+        parts[-1] += "*"
+    return " AND ".join(parts) or None
+
+
+def _phrase(text):
+    return '"' + " ".join(_WORD_RE.findall(text)) + '"'
+
+
+def _timeline(conn, q, student, since, until, domain, n):
+    # Filters are narrowed inside the index first (student and day tags, the
+    # domain as a URL phrase), then checked exactly against the row.
+    match = [f"({q})"]
+    where, args = [], []
+    if student:
+        match.append("tags : " + _phrase(_student_tag(student)))
+        where.append("t.student = ?")
+        args.append(student)
+    if since or until:
+        first = int(since or 0) // 86400
+        last = (int(until) - 1) // 86400 if until else int(time.time()) // 86400
+        if 0 <= last - first < MAX_DAY_TAGS:
+            days = (time.strftime("%Y%m%d", time.gmtime(day * 86400)) for day in range(first, last + 1))
+            match.append("tags : (" + " OR ".join(f'"day{d}"' for d in days) + ")")
+    if since:
+        where.append("t.ts >= ?")
+        args.append(int(since))
+    if until:
+        where.append("t.ts < ?")
+        args.append(int(until))
+    if domain:
+        match.append("url : " + _phrase(domain))
+        where.append("(t.domain = ? OR t.domain LIKE ?)")
+        args += [domain, "%." + domain]
+    sql = (f"SELECT f.score, t.student, t.ts, t.end_ts, t.domain, t.url, t.title, t.category FROM "
+           f"(SELECT rowid, bm25(timeline_fts, {TITLE_WEIGHT}, {URL_WEIGHT}, 0) AS score FROM timeline_fts "
+           "WHERE timeline_fts MATCH ? ORDER BY rowid DESC) f "
+           "CROSS JOIN timeline_intervals t ON t.id = f.rowid "
+           f"{'WHERE ' + ' AND '.join(where) if where else ''} LIMIT ?")
+    hits = conn.execute(sql, [" AND ".join(match)] + args + [CANDIDATES + 1]).fetchall()
+    truncated = len(hits) > CANDIDATES
+    hits = hits[:CANDIDATES]
+    hits.sort(key=lambda h: (h[0], -h[2]))
+    out = []
+    for score, who, ts, end, dom, url, title, cat in hits[:n]:
+        out.append({"source": "timeline", "score": -score, "student": who, "ts": ts, "end": end,
+                    "duration": end - ts, "domain": dom, "url": url, "title": title, "category": cat})
+    return out, truncated
+
+
+def _highlighter(text):
+    """Function wrapping the query's words (the last as a prefix) in [ ] within a string."""
+    words = [w for phrase, word in _TOKEN_RE.findall(text or "") for w in _WORD_RE.findall(phrase or word)]
+    if not words:
+        return lambda s: s
+    alts = [re.escape(w) for w in words[:-1]] + [re.escape(words[-1]) + r"\w*"]
+    pat = re.compile(r"\b(" + "|".join(alts) + r")\b", re.IGNORECASE | re.UNICODE)
+    return lambda s: pat.sub(r"[\1]", s or "")
+
+
+def _chat(conn, q, source, student, since, until, n):
+    where, args = ["chat_fts MATCH ?"], [q]
+    if source == "dm":
+        if student:
+            where.append("m.room = ?")
+            args.append(chat_store.dm_room(student))
+        else:
+            where.append("m.room LIKE 'dm:%'")
+    else:
+        where.append("m.room NOT LIKE 'dm:%'")
+        if student:
+            where.append("m.user_id = ?")
+            args.append(student)
+    if since:
+        where.append("m.ts >= ?")
+        args.append(int(since) * 1000)
+    if until:
+        where.append("m.ts < ?")
+        args.append(int(until) * 1000)
+    sql = ("SELECT bm25(chat_fts) AS score, m.id, m.room, m.user_id, m.role, m.text, m.ts "
+           "FROM chat_fts CROSS JOIN chat_messages m ON m.id = chat_fts.rowid "
+           f"WHERE {' AND '.join(where)} ORDER BY score, m.id DESC LIMIT ?")
+    out = []
+    for score, mid, room, uid, role, text, ts in conn.execute(sql, args + [n]):
+        out.append({"source": source, "score": -score, "id": mid, "room": room, "user_id": uid,
+                    "role": role, "text": text, "ts": ts // 1000,
+                    "student": room[3:] if source == "dm" else uid})
+    return out
+
+
+def search(text, sources=("timeline",), student=None, since=None, until=None, domain=None, offset=0, limit=50):
+    """Ranked hits across the requested sources; page with offset/limit."""
+    if "timeline" in sources and offset + limit > CANDIDATES:
+        raise ValueError(f"offset + limit must be at most {CANDIDATES} when searching the timeline")
+    q = fts_query(text)
+    if not q:
+        return {"items": [], "next_offset": None, "truncated": False}
+    ensure_schema()
+    student = (student or "").strip().lower() or None
+    domain = (domain or "").strip().lower() or None
+    n = offset + limit + 1
+    items, truncated = [], False
+    with _db() as conn:
+        if "timeline" in sources:
+            hits, truncated = _timeline(conn, q, student, since, until, domain, n)
+            items += hits
+        for source in ("dm", "chat"):
+            if source in sources and not domain:
+                items += _chat(conn, q, source, student, since, until, n)
+    items.sort(key=lambda it: (-it["score"], -it["ts"]))
+    page = items[offset:offset + limit]
+    mark = _highlighter(text)
+    for it in page:
+        it["highlight"] = mark(it.get("title") if it["source"] == "timeline" else it.get("text"))
+    more = len(items) > offset + limit and not ("timeline" in sources and offset + limit >= CANDIDATES)
+    return {"items": page, "next_offset": offset + limit if more else None, "truncated": truncated}
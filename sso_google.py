@@ -10,6 +10,8 @@ from urllib.parse import urljoin
 import requests
 import os
 
+import tenancy
+
 # ==============================
 # Blueprint
 # ==============================
@@ -109,7 +111,8 @@ def google_callback():
             "name": name,
             "picture": user.get("picture", ""),
             "domain": email.split("@")[-1],
-            "role": "teacher"
+            "role": "teacher",
+            "tenant": tenancy.current(),
         }
 
         # ✅ Redirect properly depending on environment
@@ -0,0 +1,254 @@
+"""
+Multi-school tenancy.
+
+One deployment serves several schools. Every request is routed to a
+tenant, by token first and then by host:
+
+    X-Tenant-Token header                    -> tenant that owns the token
+    Host header                              -> tenant that lists the host
+    anything else                            -> DEFAULT_TENANT
+
+Each tenant has its own storage shard (data.json, gschool.db, scenes.json,
+classes/ ...). The default tenant keeps the legacy location, the data dir
+itself, so a single-school install behaves exactly as before; every other
+tenant lives in <data dir>/tenants/<tenant_id>/.
+
+The registry is <data dir>/tenants.json:
+
+    {"tenants": {"north": {"name": "North High",
+                           "hosts": ["north.gschool.example"],
+                           "tokens": ["..."]}}}
+
+The active tenant is held in a context variable, so storage modules just
+call path("gschool.db") and get the right shard for the current request
+(or for whatever activate() block they run in). cache(name) gives each
+tenant its own in-process cache, and usage() reports per-tenant request
+counts, time and bytes.
+
+Interface:
+    DEFAULT_TENANT
+    current() -> str
+    data_dir(tenant_id=None) -> str
+    path(name, tenant_id=None) -> str
+    resolve(host, token) -> str | None          # None = unknown token
+    activate(tenant_id)                          # context manager
+    cache(name, factory=dict)                    # per-tenant object
+    registry() -> dict
+    save_tenant(tenant_id, name=None, hosts=None, tokens=None) -> dict
+    begin_request(tenant_id) / end_request(state, status, bytes_in, bytes_out)
+    usage(tenant_id=None) -> dict
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+
+ROOT = os.path.dirname(__file__)
+ROOT_DATA_DIR = os.environ.get("GSCHOOL_DATA_DIR") or ROOT
+TENANTS_DIR = os.path.join(ROOT_DATA_DIR, "tenants")
+REGISTRY_PATH = os.path.join(ROOT_DATA_DIR, "tenants.json")
+
+DEFAULT_TENANT = "default"
+
+_current = contextvars.ContextVar("gschool_tenant", default=DEFAULT_TENANT)
+_lock = threading.Lock()
+_registry = {"mtime": None, "tenants": {}, "hosts": {}, "tokens": {}}
+_caches = {}
+_usage = {}
+
+
+def clean_id(tenant_id):
+    return re.sub(r"[^a-z0-9_-]+", "", str(tenant_id or "").lower())
+
+
+def current():
+    return _current.get()
+
+
+def data_dir(tenant_id=None):
+    tid = tenant_id or current()
+    if tid == DEFAULT_TENANT:
+        return ROOT_DATA_DIR
+    return os.path.join(TENANTS_DIR, tid)
+
+
+def path(name, tenant_id=None):
+    return os.path.join(data_dir(tenant_id), name)
+
+
+@contextlib.contextmanager
+def activate(tenant_id):
+    """Run a block (startup work, background jobs) against one tenant's shard."""
+    token = _current.set(tenant_id or DEFAULT_TENANT)
+    try:
+        yield tenant_id
+    finally:
+        _current.reset(token)
+
+
+def set_current(tenant_id):
+    """Make tenant_id current for the rest of this context; returns a reset token."""
+    tid = tenant_id or DEFAULT_TENANT
+    if tid != DEFAULT_TENANT:
+        os.makedirs(data_dir(tid), exist_ok=True)
+    return _current.set(tid)
+
+
+def reset_current(token):
+    _current.reset(token)
+
+
+# ---------------------------
+# Registry
+# ---------------------------
+def _load_registry():
+    """Re-read tenants.json when it changes; returns the indexed registry."""
+    try:
+        mtime = os.stat(REGISTRY_PATH).st_mtime_ns
+    except OSError:
+        mtime = 0
+    if _registry["mtime"] == mtime:
+        return _registry
+    tenants = {}
+    if mtime:
+        try:
+            with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
+                raw = json.load(f).get("tenants") or {}
+            for tid, t in raw.items():
+                tid = clean_id(tid)
+                if tid and tid != DEFAULT_TENANT and isinstance(t, dict):
+                    tenants[tid] = {
+                        "name": t.get("name") or tid,
+                        "hosts": [str(h).strip().lower() for h in t.get("hosts") or [] if h],
+                        "tokens": [str(k) for k in t.get("tokens") or [] if k],
+                    }
+        except Exception as e:
+            print("[WARN] tenants.json unreadable:", e)
+    hosts, tokens = {}, {}
+    for tid, t in tenants.items():
+        for h in t["hosts"]:
+            hosts[h] = tid
+        for k in t["tokens"]:
+            tokens[k] = tid
+    with _lock:
+        _registry.update(mtime=mtime, tenants=tenants, hosts=hosts, tokens=tokens)
+    return _registry
+
+
+def registry():
+    return {tid: dict(t) for tid, t in _load_registry()["tenants"].items()}
+
+
+def save_tenant(tenant_id, name=None, hosts=None, tokens=None):
+    """Create or update a tenant in tenants.json and create its data dir."""
+    tid = clean_id(tenant_id)
+    if not tid or tid == DEFAULT_TENANT:
+        raise ValueError("invalid tenant id")
+    with _lock:
+        try:
+            with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except Exception:
+            doc = {}
+        tenants = doc.setdefault("tenants", {})
+        t = tenants.setdefault(tid, {"name": tid, "hosts": [], "tokens": []})
+        if name is not None:
+            t["name"] = str(name)
+        if hosts is not None:
+            t["hosts"] = [str(h).strip().lower() for h in hosts if h]
+        if tokens is not None:
+            t["tokens"] = [str(k) for k in tokens if k]
+        tmp = REGISTRY_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        os.replace(tmp, REGISTRY_PATH)
+    os.makedirs(data_dir(tid), exist_ok=True)
+    return dict(t)
+
+
+def resolve(host, token=None):
+    """Tenant id for a request. None means a token was given but matches no tenant."""
+    reg = _load_registry()
+    if token:
+        return reg["tokens"].get(token)
+    h = (host or "").strip().lower().split(":", 1)[0]
+    return reg["hosts"].get(h, DEFAULT_TENANT)
+
+
+# ---------------------------
+# Per-tenant caches
+# ---------------------------
+def cache(name, factory=dict):
+    """An in-process object private to the current tenant, created on first use."""
+    key = (current(), name)
+    obj = _caches.get(key)
+    if obj is None:
+        with _lock:
+            obj = _caches.get(key)
+            if obj is None:
+                obj = _caches[key] = factory()
+    return obj
+
+
+# ---------------------------
+# Resource accounting
+# ---------------------------
+def _blank_usage():
+    return {"requests": 0, "errors": 0, "in_flight": 0, "wall_ms": 0.0, "cpu_ms": 0.0,
+            "bytes_in": 0, "bytes_out": 0, "last_request": 0}
+
+
+def begin_request(tenant_id):
+    with _lock:
+        u = _usage.setdefault(tenant_id, _blank_usage())
+        u["in_flight"] += 1
+    return (tenant_id, time.perf_counter(), time.thread_time())
+
+
+def end_request(state, status=200, bytes_in=0, bytes_out=0):
+    tenant_id, wall0, cpu0 = state
+    wall = (time.perf_counter() - wall0) * 1000.0
+    cpu = (time.thread_time() - cpu0) * 1000.0
+    with _lock:
+        u = _usage.setdefault(tenant_id, _blank_usage())
+        u["in_flight"] = max(0, u["in_flight"] - 1)
+        u["requests"] += 1
+        if status >= 500:
+            u["errors"] += 1
+        u["wall_ms"] += wall
+        u["cpu_ms"] += cpu
+        u["bytes_in"] += int(bytes_in or 0)
+        u["bytes_out"] += int(bytes_out or 0)
+        u["last_request"] = int(time.time())
+
+
+def storage_bytes(tenant_id):
+    """Bytes on disk for a tenant's shard (the default tenant excludes other tenants)."""
+    root = data_dir(tenant_id)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == ROOT_DATA_DIR:
+            # The legacy data dir is also the code checkout; only count data files.
+            dirnames[:] = [n for n in dirnames if n in ("classes", "screenshots")]
+            filenames = [n for n in filenames if n.endswith((".json", ".db", ".db-wal", ".db-shm"))]
+        for n in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, n))
+            except OSError:
+                pass
+    return total
+
+
+def usage(tenant_id=None):
+    with _lock:
+        if tenant_id is not None:
+            u = dict(_usage.get(tenant_id) or _blank_usage())
+            u["wall_ms"] = round(u["wall_ms"], 1)
+            u["cpu_ms"] = round(u["cpu_ms"], 1)
+            return u
+        ids = list(_usage)
+    return {tid: usage(tid) for tid in ids}